@@ -2,15 +2,15 @@
 """
 # dataclasses requires python 3.7
 from dataclasses import dataclass
-# importlib.metadata requires python 3.8
-from importlib.metadata import version
 import json
 from pathlib import Path
-import shutil
+import time
 from urllib.parse import urlparse
-import urllib3
 # app modules
+from distrobuilder_menu import metrics
 from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+from distrobuilder_menu.api.progress import Progress, copy_response, format_bytes
 # app classes
 from distrobuilder_menu.api.singleton import SingletonThreadSafe
 from distrobuilder_menu.config.user import Settings
@@ -44,6 +44,8 @@ class Gethub(SingletonThreadSafe):
             self.headers = {'Accept': 'application/vnd.github+json'}
 
         # create HTTP session pool
+        # deferred import (urllib3 is slow to import & most menus are offline)
+        import urllib3  # pylint: disable=import-outside-toplevel
         self.http = urllib3.PoolManager()
 
 
@@ -79,6 +81,9 @@ class Gethub(SingletonThreadSafe):
             (so no need to manually close the connection as still shown in the docs)
         """
         # pylint: disable=too-many-arguments
+        # already imported by __init__
+        import urllib3  # pylint: disable=import-outside-toplevel
+
         if debug:
             print(f"\nDEBUG: call_the_api()\n\n {http_type} {self.headers}\n {url}\n")
 
@@ -90,11 +95,14 @@ class Gethub(SingletonThreadSafe):
             if self.check_url(url):
 
                 if data_type == 'json':
-                    if json_headers:
-                        response = self.http.request(http_type, url, headers=self.headers)
-                    else:
-                        # no headers sent for Aurweb HTTP queries
-                        response = self.http.request(http_type, url)
+                    with tracer.span('github_api', url=url):
+                        if json_headers:
+                            response = self.http.request(http_type, url, headers=self.headers)
+                            # alert on rate limit exhaustion (see metrics.py)
+                            metrics.record_rate_limit(response.headers)
+                        else:
+                            # no headers sent for Aurweb HTTP queries
+                            response = self.http.request(http_type, url)
                     try:
                         data = json.loads(response.data)
                         # Github API returns messages not HTTP errors on invalid urls
@@ -162,6 +170,7 @@ class Gethub(SingletonThreadSafe):
         """ Queries the Github API for the latest dbmenu release
         """
         # see importlib.metadata (python 3.8+)
+        from importlib.metadata import version  # pylint: disable=import-outside-toplevel
         app_version = version('distrobuilder-menu')
         print(f"Distrobuilder Menu: {app_version}")
 
@@ -212,11 +221,17 @@ class Gethub(SingletonThreadSafe):
         return archlinux_check
 
 
-    def download_files(self, file_dict):
+    def download_files(self, file_dict, interactive=True):
         """ As input takes a list of dicts with keys: 'url' / 'file' as the
             source & destination of file downloads. Input is generated by
             update_templates() in the main application.
+
+            interactive=False creates missing destinations without asking
+            (background refreshes - see refresh.py)
         """
+        downloaded_bytes = 0
+        start_time = time.monotonic()
+
         for item in file_dict:
             url = item['url']
             file = item['file']
@@ -227,21 +242,43 @@ class Gethub(SingletonThreadSafe):
             dest_dir = Path(file).parent
 
             if not dest_dir.is_dir():
-                choice = utils.get_input(f"\nCreate destination ? : {dest_dir} [Y/n] ",
-                                            accept_empty=True, default='Y'
-                                        )
-                # create destination
-                if choice.startswith('y') or choice.startswith('Y'):
-                    try:
-                        dest_dir.mkdir(parents=True)
-                    # cross platform & also catches permission errors
-                    except (OSError, IOError) as err:
-                        utils.die(1, f"Error: {err.args[1]} : {dest_dir}")
-                else:
-                    utils.die(1, f"Cancelled download of: {file}\n")
+                create_destination(dest_dir, file, interactive)
 
             # download the file
-            with open(file, 'wb') as out_file:
+            with tracer.span('download', url=url), open(file, 'wb') as out_file:
                 response = self.call_the_api('GET', url, data_type = 'binary')
-                shutil.copyfileobj(response, out_file)
+                content_length = int(response.headers.get('Content-Length') or 0)
+
+                with Progress(f" {Path(file).name}", total=content_length) as progress:
+                    downloaded_bytes += copy_response(response, out_file.write, progress)
                 print(f" Saved to: ==> {file}")
+
+        if file_dict:
+            seconds = max(time.monotonic() - start_time, 0.001)
+            print(f"\nDownloaded {len(file_dict)} file(s): {format_bytes(downloaded_bytes)} in "
+                  f"{seconds:.1f} seconds ({format_bytes(downloaded_bytes / seconds)}/s)")
+
+        metrics.record_sync(len(file_dict), downloaded_bytes)
+
+
+def create_destination(dest_dir, file, interactive=True):
+    """ Creates the missing destination directory of a download (asking first
+        unless interactive is False - see download_files())
+    """
+    if interactive:
+        choice = utils.get_input(f"\nCreate destination ? : {dest_dir} [Y/n] ",
+                                 accept_empty=True, default='Y'
+                                )
+    else:
+        print(f"\nCreating destination: {dest_dir}")
+        choice = 'Y'
+
+    # create destination
+    if choice.startswith('y') or choice.startswith('Y'):
+        try:
+            dest_dir.mkdir(parents=True)
+        # cross platform & also catches permission errors
+        except (OSError, IOError) as err:
+            utils.die(1, f"Error: {err.args[1]} : {dest_dir}")
+    else:
+        utils.die(1, f"Cancelled download of: {file}\n")
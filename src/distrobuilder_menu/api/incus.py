@@ -0,0 +1,354 @@
+""" A class to query the local Incus / LXD REST API over it's unix socket
+"""
+import json
+import os
+from pathlib import Path
+import socket
+import threading
+from urllib.parse import quote
+import urllib3
+# app modules
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+# app classes
+from distrobuilder_menu.api.singleton import SingletonThreadSafe
+from distrobuilder_menu.config.user import Settings
+
+# checked in order when no socket is configured
+SOCKET_PATHS = ('/var/lib/incus/unix.socket',
+                '/var/snap/lxd/common/lxd/unix.socket',
+                '/var/lib/lxd/unix.socket')
+
+
+class UnixHTTPConnection(urllib3.connection.HTTPConnection):
+    """ urllib3 connection to a unix socket (the host is only used in HTTP headers)
+    """
+    def __init__(self, *args, socket_path=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+
+    def _new_conn(self):
+        """ Connects to the unix socket instead of a TCP host / port
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+
+        try:
+            sock.connect(self.socket_path)
+        except OSError as err:
+            sock.close()
+            raise urllib3.exceptions.NewConnectionError(
+                self, f"Failed to connect to: {self.socket_path}: {err}") from err
+
+        return sock
+
+
+class UnixHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    """ urllib3 connection pool reusing keep-alive connections to a unix socket
+    """
+    ConnectionCls = UnixHTTPConnection
+
+
+class Incus(SingletonThreadSafe):
+    """ Singleton class to make Incus / LXD API calls over a pooled unix socket
+        connection (instead of spawning 'sudo lxc || incus' for each query)
+    """
+    def __init__(self):
+
+        # fix pylint 'super-init-not-called'
+        super().__init__()
+
+        # read user settings (Settings is also a singleton)
+        user_config = Settings.instance()
+
+        self.socket_path = find_socket(user_config.lxd_socket)
+        self.server = None
+        # Incus accepts X-Incus-* headers & LXD X-LXD-* headers
+        self.header_prefix = 'X-Incus'
+        self.http = None
+        self._socket_lock = threading.Lock()
+
+        if self.socket_path:
+            self.http = UnixHTTPConnectionPool('localhost', maxsize=4,
+                                               socket_path=self.socket_path
+                                              )
+
+
+    def check_socket(self):
+        """ Checks the API is reachable (users need to be in the incus-admin / lxd group)
+            The result is cached so the socket is only checked once.
+
+        Returns:
+            boolean: True if the API can be used
+        """
+        # worker threads may check the socket at the same time
+        with self._socket_lock:
+            if self.server is None:
+                self.server = self.get_server()
+
+                if self.server == 'lxd':
+                    self.header_prefix = 'X-LXD'
+
+        return bool(self.server)
+
+
+    def get_server(self):
+        """ Queries the API server name used by check_socket()
+
+        Returns:
+            str: incus || lxd (or an empty string if the API is not reachable)
+        """
+        if not self.http or not os.access(self.socket_path, os.R_OK | os.W_OK):
+            return ''
+
+        try:
+            response = self.http.request('GET', '/1.0')
+            data = json.loads(response.data)
+            return data['metadata']['environment'].get('server', 'lxd')
+        except (urllib3.exceptions.HTTPError, json.decoder.JSONDecodeError,
+                KeyError, TypeError):
+            return ''
+
+
+    def call_the_api(self, http_type, path, body=None, headers=None, missing_ok=False):
+        """ Dedicated function for Incus API error handling in a single place.
+
+        Args:
+            http_type (str): GET / POST / DELETE
+            path (str): API path e.g /1.0/images
+            body (bytes || file || generator, optional): request body. Defaults to None.
+            headers (dict, optional): request headers. Defaults to None.
+            missing_ok (bool, optional): return None on 404. Defaults to False.
+
+        Returns:
+            dict: decoded API response
+        """
+        # pylint: disable=too-many-arguments
+        try:
+            with tracer.span('incus_api', path=f"{http_type} {path}"):
+                response = self.http.request(http_type, path, body=body, headers=headers,
+                                             preload_content=True
+                                            )
+            data = json.loads(response.data)
+        except urllib3.exceptions.HTTPError as err:
+            utils.die(1, f"Incus API error: {err} : {http_type} {path}")
+        except json.decoder.JSONDecodeError:
+            utils.die(1, f"Incus API error: no JSON Data was returned: {http_type} {path}")
+
+        if data.get('type') == 'error':
+            if missing_ok and data.get('error_code') == 404:
+                return None
+            utils.die(1, f"Incus API error: {data.get('error')} : {http_type} {path}")
+
+        return data
+
+
+    def wait_operation(self, data):
+        """ Waits for an async API operation to finish
+
+        Returns:
+            dict: operation metadata
+        """
+        operation = self.call_the_api('GET', f"{data['operation']}/wait?timeout=-1")
+        metadata = operation['metadata']
+
+        if metadata['status'] != 'Success':
+            utils.die(1, f"Incus API error: {metadata['err']} : {data['operation']}")
+
+        return metadata
+
+
+    def get_aliases(self):
+        """ Returns all image aliases with a single API call
+
+        Returns:
+            dict: alias name : image fingerprint
+        """
+        data = self.call_the_api('GET', '/1.0/images/aliases?recursion=1')
+        return {item['name']: item['target'] for item in data['metadata']}
+
+
+    def get_alias(self, alias):
+        """ Returns the fingerprint of an image alias (or None if it does not exist)
+        """
+        data = self.call_the_api('GET', f"/1.0/images/aliases/{quote(alias, safe='')}",
+                                 missing_ok=True
+                                )
+
+        if data is None:
+            return None
+
+        return data['metadata']['target']
+
+
+    def create_alias(self, alias, fingerprint):
+        """ Creates an image alias
+        """
+        body = json.dumps({'name': alias, 'target': fingerprint, 'description': ''})
+        self.call_the_api('POST', '/1.0/images/aliases', body=body,
+                          headers={'Content-Type': 'application/json'}
+                         )
+
+
+    def update_alias(self, alias, fingerprint):
+        """ Points an existing image alias to another image
+        """
+        body = json.dumps({'target': fingerprint, 'description': ''})
+        self.call_the_api('PUT', f"/1.0/images/aliases/{quote(alias, safe='')}", body=body,
+                          headers={'Content-Type': 'application/json'}
+                         )
+
+
+    def get_image(self, fingerprint):
+        """ Returns image metadata (or None if the image does not exist)
+        """
+        data = self.call_the_api('GET', f"/1.0/images/{fingerprint}", missing_ok=True)
+
+        if data is None:
+            return None
+
+        return data['metadata']
+
+
+    def delete_image(self, fingerprint):
+        """ Deletes an image (& it's aliases) by fingerprint
+        """
+        data = self.call_the_api('DELETE', f"/1.0/images/{fingerprint}")
+        self.wait_operation(data)
+
+
+    def list_images(self, alias=None):
+        """ Lists images optionally filtered by alias
+
+        Returns:
+            list: image metadata dicts
+        """
+        data = self.call_the_api('GET', '/1.0/images?recursion=1')
+        images = data['metadata']
+
+        if alias:
+            images = [image for image in images
+                      if alias in [item['name'] for item in image.get('aliases') or []]]
+
+        return images
+
+
+    def show_images(self, alias=None):
+        """ Prints image details like 'lxc image ls'
+        """
+        images = self.list_images(alias)
+        print(f"\n{'ALIAS':<30} {'FINGERPRINT':<13} {'TYPE':<16} {'SIZE':>10}  UPLOAD DATE")
+
+        for image in images:
+            aliases = ','.join(item['name'] for item in image.get('aliases') or [])
+            size = f"{image['size'] / 1048576:.2f}MiB"
+            print(f"{aliases:<30} {image['fingerprint'][:12]:<13} {image['type']:<16} "
+                  f"{size:>10}  {image['uploaded_at']}")
+
+        print('')
+
+
+    def import_image(self, alias, image_path=None, meta_path=None, rootfs_path=None):
+        """ Imports a unified image tarball (streamed from disk) or a split
+            metadata / rootfs image & optionally creates the alias
+
+        Returns:
+            str: image fingerprint
+        """
+        headers = {f"{self.header_prefix}-public": '0'}
+
+        if image_path:
+            headers['Content-Type'] = 'application/octet-stream'
+            headers['Content-Length'] = str(Path(image_path).stat().st_size)
+            headers[f"{self.header_prefix}-filename"] = Path(image_path).name
+
+            with open(image_path, 'rb') as image_file:
+                data = self.call_the_api('POST', '/1.0/images', body=image_file,
+                                         headers=headers
+                                        )
+        else:
+            # split images are streamed from disk as multipart/form-data
+            rootfs_part = 'rootfs.img' if rootfs_path.endswith('.qcow2') else 'rootfs'
+            boundary = urllib3.filepost.choose_boundary()
+
+            with open(meta_path, 'rb') as meta_file, open(rootfs_path, 'rb') as rootfs_file:
+                body, length = get_multipart_body({'metadata': meta_file,
+                                                   rootfs_part: rootfs_file}, boundary
+                                                 )
+                headers['Content-Type'] = f"multipart/form-data; boundary={boundary}"
+                headers['Content-Length'] = str(length)
+                data = self.call_the_api('POST', '/1.0/images', body=body, headers=headers)
+
+        fingerprint = self.wait_operation(data)['metadata']['fingerprint']
+
+        if alias:
+            self.create_alias(alias, fingerprint)
+
+        return fingerprint
+
+
+def get_multipart_body(fields, boundary):
+    """ Streams a multipart/form-data body from open files (so split images are
+        never read into memory) - the length is known up front so the body is
+        sent with a Content-Length instead of chunked
+
+    Args:
+        fields (dict): form field name : open binary file
+        boundary (str): multipart boundary
+
+    Returns:
+        tuple: (generator yielding the body, body length in bytes)
+    """
+    parts = []
+    length = 0
+
+    for name, file in fields.items():
+        header = (f"--{boundary}\r\n"
+                  f"Content-Disposition: form-data; name=\"{name}\"; "
+                  f"filename=\"{Path(file.name).name}\"\r\n"
+                  'Content-Type: application/octet-stream\r\n\r\n').encode()
+        parts.append((header, file))
+        length += len(header) + os.fstat(file.fileno()).st_size + 2
+
+    closing = f"--{boundary}--\r\n".encode()
+    length += len(closing)
+
+    def generate():
+        for header, file in parts:
+            yield header
+
+            while chunk := file.read(1048576):
+                yield chunk
+
+            yield b'\r\n'
+
+        yield closing
+
+    return generate(), length
+
+
+def find_socket(socket_path=None):
+    """ Finds the Incus / LXD unix socket
+
+    Args:
+        socket_path (str, optional): configured socket path. Defaults to None.
+
+    Returns:
+        str: socket path (or None if not found)
+    """
+    candidates = [socket_path, os.environ.get('INCUS_SOCKET')]
+
+    for env_dir in ('INCUS_DIR', 'LXD_DIR'):
+        if os.environ.get(env_dir):
+            candidates.append(f"{os.environ[env_dir]}/unix.socket")
+
+    candidates.extend(SOCKET_PATHS)
+
+    for candidate in candidates:
+        if candidate and Path(candidate).is_socket():
+            return candidate
+
+    return None
@@ -0,0 +1,188 @@
+""" Provides a thread safe progress reporter for downloads (bytes / rate / ETA)
+    & longer running operations (item counts / rate / ETA).
+
+    On a TTY the progress line is redrawn in place a few times a second &
+    otherwise a plain text line is written every PLAIN_INTERVAL seconds (so
+    logs / pipes still show progress) with a final summary line for both
+    (marked as interrupted when the with block raised). Call end_line()
+    before printing an error while the progress line is being redrawn.
+
+    usage:
+            with Progress('Downloading', total=content_length) as progress:
+                progress.update(len(chunk))
+
+            with Progress('Regenerating', total=10, unit='templates') as progress:
+                progress.update()
+"""
+import sys
+import threading
+import time
+
+# seconds between progress lines
+TTY_INTERVAL = 0.1
+PLAIN_INTERVAL = 5.0
+
+# bytes read at a time by copy_response()
+CHUNK_SIZE = 65536
+
+
+def format_bytes(size):
+    """ Returns a human readable size e.g 1.5 MiB
+    """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+
+    return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+
+
+def format_seconds(seconds):
+    """ Returns a short duration e.g 42s || 3m05s
+    """
+    seconds = int(seconds)
+
+    if seconds < 60:
+        return f"{seconds}s"
+
+    return f"{seconds // 60}m{seconds % 60:02}s"
+
+
+class Progress:
+    """ Thread safe progress reporter (workers may share one instance
+        & add to the total as they learn their sizes)
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, label, total=None, unit='bytes', interval=None):
+        """ Initialises the reporter
+
+        Args:
+            label (str): shown at the start of each progress line
+            total (int, optional): expected bytes / items. Defaults to None (unknown).
+            unit (str, optional): 'bytes' or the name of the items. Defaults to 'bytes'.
+            interval (float, optional): seconds between progress lines. Defaults to None.
+        """
+        self.label = label
+        self.total = total or 0
+        self.unit = unit
+        # the stream is resolved once (see refresh.ThreadOutput)
+        self.stream = sys.stdout
+        self.tty = self.stream.isatty()
+        self.interval = interval or (TTY_INTERVAL if self.tty else PLAIN_INTERVAL)
+        self.done = 0
+        self.start_time = time.monotonic()
+        self.last_report = self.start_time
+        self.line_length = 0
+        self._lock = threading.Lock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exception, value, traceback):
+        with self._lock:
+            self.report(time.monotonic(), final=True, interrupted=exception is not None)
+
+
+    def add_total(self, amount):
+        """ Adds to the expected total (e.g from a Content-Length header)
+        """
+        with self._lock:
+            self.total += amount
+
+
+    def update(self, amount=1):
+        """ Adds completed bytes / items & reports at most once per interval
+        """
+        with self._lock:
+            self.done += amount
+            now = time.monotonic()
+
+            if now - self.last_report >= self.interval:
+                self.last_report = now
+                self.report(now)
+
+
+    def end_line(self):
+        """ Finishes the TTY progress line being redrawn (so the next output
+            e.g an error message starts on a new line)
+        """
+        with self._lock:
+            if self.tty and self.line_length:
+                self.stream.write('\n')
+                self.stream.flush()
+                self.line_length = 0
+
+
+    def report(self, now, final=False, interrupted=False):
+        """ Writes a progress line (the caller holds the lock)
+        """
+        line = self.format(now, final)
+
+        if interrupted:
+            line = f"{line} (interrupted)"
+
+        if self.tty:
+            # pad to overwrite the end of a longer previous line
+            padding = ' ' * max(self.line_length - len(line), 0)
+            end = '\n' if final else ''
+            self.stream.write(f"\r{line}{padding}{end}")
+            self.line_length = len(line)
+        else:
+            self.stream.write(f"{line}\n")
+
+        self.stream.flush()
+
+
+    def format(self, now, final=False):
+        """ Returns the progress line e.g
+
+            Downloading: 1.2 MiB / 3.4 MiB (35%) 512.0 KiB/s ETA 4s
+        """
+        elapsed = max(now - self.start_time, 0.001)
+        rate = self.done / elapsed
+        # compressed Content-Length totals can be exceeded
+        total = max(self.total, self.done) if self.total else 0
+
+        if self.unit == 'bytes':
+            done_text, total_text = format_bytes(self.done), format_bytes(total)
+            rate_text = f"{format_bytes(rate)}/s"
+        else:
+            done_text, total_text = str(self.done), f"{total} {self.unit}"
+            rate_text = f"{rate:.1f} {self.unit}/s"
+
+        if total:
+            line = f"{self.label}: {done_text} / {total_text} ({self.done * 100 // total}%) " \
+                   f"{rate_text}"
+        else:
+            line = f"{self.label}: {done_text} {rate_text}"
+
+        if final:
+            return f"{line} in {format_seconds(elapsed)}"
+
+        if total and rate:
+            return f"{line} ETA {format_seconds((total - self.done) / rate)}"
+
+        return line
+
+
+def copy_response(response, write, progress=None):
+    """ Streams a urllib3 response (requested with preload_content=False) to
+        write() counting the bytes received (Content-Length counts the bytes
+        before any content decoding)
+
+    Returns:
+        int: bytes written
+    """
+    written = 0
+    position = 0
+
+    for chunk in response.stream(CHUNK_SIZE):
+        write(chunk)
+        written += len(chunk)
+        if progress:
+            progress.update(response.tell() - position)
+        position = response.tell()
+
+    return written
@@ -0,0 +1,206 @@
+""" A class to read image remote catalogues over simplestreams HTTP
+    (so no lxc / incus client or daemon is needed to list remote images)
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
+import urllib3
+# app modules
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+from distrobuilder_menu.api.progress import Progress, copy_response
+# app classes
+from distrobuilder_menu.api.gethub import Gethub
+from distrobuilder_menu.api.singleton import SingletonThreadSafe
+from distrobuilder_menu.config.user import Settings
+
+# simplestreams (debian) architectures => uname architectures
+ARCH_MAP = {
+    'amd64': 'x86_64',
+    'arm64': 'aarch64',
+    'armhf': 'armv7l',
+    'i386': 'i686',
+    'ppc64el': 'ppc64le',
+    'riscv64': 'riscv64',
+    's390x': 's390x',
+}
+
+# simplestreams item ftype => LXD image type
+FTYPE_MAP = {
+    'squashfs': 'container',
+    'disk-kvm.img': 'virtual-machine',
+}
+
+
+class Simplestreams(SingletonThreadSafe):
+    """ Singleton class reusing the urllib3 connection pool of Gethub
+        to download simplestreams index / products files with conditional
+        requests (unchanged files are not downloaded again)
+    """
+    def __init__(self):
+
+        # fix pylint 'super-init-not-called'
+        super().__init__()
+
+        # read user settings (Settings is also a singleton)
+        user_config = Settings.instance()
+
+        self.remotes = user_config.image_remotes
+        self.cache_dir = Path(user_config.lxd_json).parent / 'streams'
+        # share the HTTP session pool (PoolManager is thread safe)
+        self.http = Gethub.instance().http
+        # shared by the fetch threads of update_lxd_json()
+        self.progress = None
+
+
+    def die(self, message):
+        """ Exits with an error message (on a new line after the progress line)
+        """
+        if self.progress:
+            self.progress.end_line()
+
+        utils.die(1, message)
+
+
+    def fetch(self, remote, path):
+        """ Downloads a simplestreams file unless the cached copy is current
+            (using the ETag / Last-Modified headers of the last download)
+
+        Args:
+            remote (str): remote name (from image_remotes)
+            path (str): path relative to the server e.g streams/v1/index.json
+
+        Returns:
+            dict: decoded JSON data
+        """
+        url = f"{self.remotes[remote].rstrip('/')}/{path}"
+        cache_dir = self.cache_dir / remote
+        cache_file = cache_dir / Path(path).name
+        meta_file = cache_dir / f"{Path(path).name}.meta"
+        headers = {}
+
+        if cache_file.is_file() and meta_file.is_file():
+            meta = json.loads(meta_file.read_text(encoding='utf-8'))
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            with tracer.span('simplestreams_fetch', url=url):
+                # streamed so the shared progress reporter counts the bytes
+                response = self.http.request('GET', url, headers=headers,
+                                             preload_content=False)
+
+                if response.status == 200:
+                    if self.progress:
+                        self.progress.add_total(int(response.headers.get('Content-Length') or 0))
+                    chunks = []
+                    copy_response(response, chunks.append, self.progress)
+                    data = b''.join(chunks)
+
+                response.release_conn()
+        except urllib3.exceptions.HTTPError as err:
+            self.die(f"HTTP error: {err} : {url}")
+
+        if response.status == 304:
+            data = cache_file.read_bytes()
+        elif response.status == 200:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_file.write_bytes(data)
+            meta = {'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')}
+            meta_file.write_text(json.dumps(meta), encoding='utf-8')
+        else:
+            self.die(f"HTTP error: {response.status} : {url}")
+
+        try:
+            return json.loads(data)
+        except json.decoder.JSONDecodeError:
+            return self.die(f"Error: invalid simplestreams JSON: {url}")
+
+
+    def get_products(self, remote):
+        """ Reads the index & returns the products of the 'image-downloads' stream
+        """
+        index = self.fetch(remote, 'streams/v1/index.json')
+
+        for stream in index['index'].values():
+            if stream.get('datatype') == 'image-downloads':
+                return self.fetch(remote, stream['path'])['products']
+
+        return self.die(f"Error: no image-downloads stream found: {remote}")
+
+
+    def get_images(self, remote):
+        """ Converts the products to the format of 'lxc image ls -f json' so the
+            listing is processed by process_data() like the lxc / incus output
+
+        Args:
+            remote (str): remote name (from image_remotes)
+
+        Returns:
+            list: image dicts with keys 'architecture' / 'type' / 'aliases' /
+                  'properties' / 'remote'
+        """
+        images = []
+
+        for product in self.get_products(remote).values():
+            versions = product.get('versions') or {}
+
+            # only the latest version of a product is aliased
+            if not versions:
+                continue
+            items = versions[max(versions)].get('items') or {}
+
+            for item in items.values():
+                ftype = item.get('ftype')
+
+                if ftype not in FTYPE_MAP:
+                    continue
+
+                image = {}
+                image['architecture'] = ARCH_MAP.get(product['arch'], product['arch'])
+                image['type'] = FTYPE_MAP[ftype]
+                # unaliased images are null in 'lxc image ls' output
+                aliases = [{'name': alias}
+                           for alias in product.get('aliases', '').split(',') if alias]
+                image['aliases'] = aliases or None
+                # ubuntu: products have no variant
+                image['properties'] = {'os': product['os'],
+                                       'release': product['release'],
+                                       'variant': product.get('variant', 'default'),
+                                       'architecture': product['arch'],
+                                       'type': ftype}
+                image['remote'] = remote
+                images.append(image)
+
+        return images
+
+
+    def get_all_images(self):
+        """ Fetches all configured remotes concurrently & merges their images
+            into one listing (each image is tagged with it's remote)
+
+        Returns:
+            list: see get_images()
+        """
+        images = []
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.remotes))) as executor:
+            # map() returns results in the order of image_remotes
+            for remote_images in executor.map(self.get_images, self.remotes):
+                images.extend(remote_images)
+
+        return images
+
+
+    def update_lxd_json(self, outfile):
+        """ Writes the remote image listing to outfile (replaces 'lxc image ls -f json')
+        """
+        with Progress('Downloading image data') as self.progress:
+            images = self.get_all_images()
+        self.progress = None
+
+        # renamed into place (a background refresh may be stopped when dbmenu exits)
+        utils.write_file_atomic(outfile, json.dumps(images))
@@ -2,20 +2,20 @@
     & creating logger / other objects you only want a single instance of.
 """
 import threading
-# python 3.7+ (fixes pylint 'too-few-public-methods'
-from dataclasses import dataclass
 
 # https://stackoverflow.com/questions/31875/is-there-a-simple-elegant-way-to-define-singletons
 # https://stackoverflow.com/questions/6760685/creating-a-singleton-in-python
 
-@dataclass
+# not a dataclass (dataclasses imports inspect which slows down dbmenu --help)
+# pylint 'too-few-public-methods' is fixed by the lazy() classmethod
 class SingletonThreadSafe:
     """ Resources shared by each and every instance.
 
         Based on tornado.ioloop.IOLoop.instance() approach.
         See https://github.com/facebook/tornado
     """
-    __singleton_lock = threading.Lock()
+    # reentrant so singletons can create other singletons in __init__
+    __singleton_lock = threading.RLock()
     __singleton_instance = None
 
     @classmethod
@@ -37,3 +37,40 @@ class SingletonThreadSafe:
 
         # return the singleton instance
         return cls.__singleton_instance
+
+
+    @classmethod
+    def swap(cls, instance):
+        """ Replaces the singleton instance with a fully initialised instance
+            (so other threads never see a partially initialised singleton)
+        """
+        with cls.__singleton_lock:
+            cls.__singleton_instance = instance
+
+
+    @classmethod
+    def lazy(cls):
+        """ Returns a proxy which creates the singleton instance on first attribute
+            access (so module level globals don't parse argv / read config / open
+            connection pools at import time) - example configuration:
+
+        MY_INSTANCE = MyClass.lazy()
+        """
+        return LazySingleton(cls)
+
+
+class LazySingleton:
+    """ Forwards attribute access to <singleton class>.instance()
+    """
+    def __init__(self, singleton_class):
+        # bypass __setattr__ (which forwards to the singleton instance)
+        object.__setattr__(self, '_singleton_class', singleton_class)
+
+    def __getattr__(self, name):
+        return getattr(self._singleton_class.instance(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._singleton_class.instance(), name, value)
+
+    def __repr__(self):
+        return f"<lazy {self._singleton_class.__name__}>"
@@ -0,0 +1,225 @@
+""" Provides hierarchical tracing spans (nested timings) for the hot paths.
+
+    With -t an aggregated tree of the spans is printed when dbmenu exits &
+    with --trace FILE the spans are written as Chrome trace events (open the
+    file with chrome://tracing or https://ui.perfetto.dev).
+
+    usage:
+            from distrobuilder_menu.api import tracer
+
+            with tracer.span('process_data', images=len(data)):
+                ...
+
+            @tracer.traced()
+            def load_json_cache():
+                ...
+
+    Disabled spans return a shared no-op context manager (so tracing costs a
+    single attribute check when -t / --trace are not used).
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+# app classes
+from distrobuilder_menu.api.singleton import SingletonThreadSafe
+
+
+class NullSpan:
+    """ No-op context manager returned by span() when tracing is disabled
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception, value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """ Context manager timing a single span (nested in the current span of it's thread)
+    """
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start_time = None
+
+    def __enter__(self):
+        self.tracer.local.stack.append(self.name)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exception, value, traceback):
+        duration = time.perf_counter() - self.start_time
+        stack = self.tracer.local.stack
+        self.tracer.add(tuple(stack), self.start_time, duration, self.attrs)
+        stack.pop()
+        return False
+
+
+class Tracer(SingletonThreadSafe):
+    """ Singleton class aggregating the spans of all threads into a tree
+        (& optionally recording each span as a Chrome trace event)
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self):
+
+        # fix pylint 'super-init-not-called'
+        super().__init__()
+
+        # disabled until configure() is called with the -t / --trace options
+        self.show_tree = False
+        self.trace_file = None
+        self.enabled = False
+
+        # span path (tuple of names) : [calls, total seconds]
+        self.tree = {}
+        self.events = []
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+        self._tree_lock = threading.Lock()
+
+
+    def configure(self, show_tree=False, trace_file=None):
+        """ Enables tracing (see the module level configure() function)
+        """
+        if (show_tree or trace_file) and not self.enabled:
+            atexit.register(self.report)
+
+        self.show_tree = show_tree
+        self.trace_file = trace_file
+        self.enabled = bool(show_tree or trace_file)
+
+
+    def span(self, name, attrs):
+        """ Returns a Span (see the module level span() function)
+        """
+        # each thread has it's own stack of open spans
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        return Span(self, name, attrs)
+
+
+    def add(self, path, start_time, duration, attrs):
+        """ Adds a finished span to the tree (& the trace events)
+        """
+        with self._tree_lock:
+            node = self.tree.setdefault(path, [0, 0.0])
+            node[0] += 1
+            node[1] += duration
+
+            if self.trace_file:
+                event = {'name': path[-1], 'cat': 'dbmenu', 'ph': 'X',
+                         'ts': round((start_time - self.origin) * 1000000, 1),
+                         'dur': round(duration * 1000000, 1),
+                         'pid': os.getpid(), 'tid': threading.get_native_id()}
+                if attrs:
+                    event['args'] = {key: str(value) for key, value in attrs.items()}
+                self.events.append(event)
+
+
+    def reset(self):
+        """ Clears the recorded spans (used by the benchmarks between stages)
+        """
+        with self._tree_lock:
+            self.tree.clear()
+            self.events.clear()
+
+
+    def format_tree(self):
+        """ Formats the aggregated spans as an indented tree
+
+        Returns:
+            list: lines with name / total ms / calls / self ms
+        """
+        with self._tree_lock:
+            tree = dict(self.tree)
+
+        # paths are added when spans finish (so siblings are in the order they ran)
+        children = {}
+        for path in tree:
+            children.setdefault(path[:-1], []).append(path)
+
+        lines = [f"{'DEBUG: trace':<50} {'total ms':>10} {'calls':>7} {'self ms':>10}"]
+
+        def add_lines(parent):
+            for path in children.get(parent, []):
+                calls, total = tree[path]
+                children_total = sum(tree[child][1] for child in children.get(path, []))
+                name = f"{'  ' * len(path)}{path[-1]}"
+                lines.append(f"{name:<50} {total * 1000:>10.2f} {calls:>7} "
+                             f"{(total - children_total) * 1000:>10.2f}")
+                add_lines(path)
+
+        add_lines(())
+        return lines
+
+
+    def write_trace(self, outfile):
+        """ Writes the spans as Chrome trace events (JSON object format)
+        """
+        with self._tree_lock:
+            trace = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+        with open(outfile, 'w', encoding='utf-8') as file:
+            json.dump(trace, file)
+
+        print(f"Wrote trace events to: {outfile}")
+
+
+    def report(self):
+        """ Prints the span tree & writes the trace file when dbmenu exits
+        """
+        if not self.tree:
+            return
+
+        if self.show_tree:
+            print('\n' + '\n'.join(self.format_tree()))
+
+        if self.trace_file:
+            self.write_trace(self.trace_file)
+
+
+def configure(show_tree=False, trace_file=None):
+    """ Enables tracing from the command line options (called by app.main())
+
+    Args:
+        show_tree (bool, optional): print the span tree at exit (-t). Defaults to False.
+        trace_file (str, optional): write Chrome trace events (--trace). Defaults to None.
+    """
+    Tracer.instance().configure(show_tree, trace_file)
+
+
+def span(name, **attrs):
+    """ Returns a context manager timing the code inside it as a span named name
+        (attrs are added to the Chrome trace event)
+    """
+    tracer = Tracer.instance()
+
+    if not tracer.enabled:
+        return NULL_SPAN
+
+    return tracer.span(name, attrs)
+
+
+def traced(name=None):
+    """ Decorator running a function inside a span (named after the function)
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
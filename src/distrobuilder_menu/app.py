@@ -5,29 +5,66 @@
     calls the default menu unless one of the 2nd level menu options
     are called via command line options
 """
-# custom modules
-from distrobuilder_menu.menus import cloudinit
-from distrobuilder_menu.menus import common
-from distrobuilder_menu import templates
-from distrobuilder_menu import utils
 # custom classes
-from distrobuilder_menu.api.gethub import Gethub
 from distrobuilder_menu.config.app import AppConfig
-from distrobuilder_menu.config.user import Settings
 
 # globals (singleton classes)
-# shares user config between modules
-USER_CONFIG = Settings.instance()
 # read command line
-ARGS = AppConfig.instance().get()
-# Github API methods
-GETHUB = Gethub.instance()
+ARGS = AppConfig.lazy()
 
 def main():
     """ The main() method
         processes command line options (many are mutually exclusive except -t option).
     """
-    # pylint: disable=too-many-branches
+    # pylint: disable=too-many-branches,too-many-statements
+    # parse the command line before importing the menus (so dbmenu --help
+    # exits without importing them - see benchmarks/startup.py)
+    AppConfig.instance()
+
+    # -t & --trace options
+    if ARGS.timer or ARGS.trace:
+        from distrobuilder_menu.api import tracer  # pylint: disable=import-outside-toplevel
+        tracer.configure(ARGS.timer, ARGS.trace)
+
+    # -q menu option (thin client: exits without importing the menus)
+    if ARGS.query:
+        from distrobuilder_menu import client  # pylint: disable=import-outside-toplevel
+        client.main(ARGS.query)
+
+    # custom modules
+    # pylint: disable=import-outside-toplevel
+    from distrobuilder_menu.menus import cloudinit
+    from distrobuilder_menu.menus import common
+    from distrobuilder_menu import templates
+    from distrobuilder_menu import utils
+    # custom classes
+    from distrobuilder_menu.api.gethub import Gethub
+    from distrobuilder_menu.config.user import Settings
+
+    # --daemon menu option
+    if ARGS.daemon:
+        from distrobuilder_menu import daemon
+        daemon.serve()
+        utils.die(0)
+
+    # --watch menu option
+    if ARGS.watch:
+        from distrobuilder_menu import watch
+        watch.watch()
+        utils.die(0)
+
+    # --gc menu option
+    if ARGS.gc:
+        from distrobuilder_menu import store
+        store.gc()
+        utils.die(0)
+
+    # --bench-compression menu option
+    if ARGS.bench_compression is not None:
+        from distrobuilder_menu import compression
+        compression.bench_compression(ARGS.bench_compression)
+        utils.die(0)
+
     # -u menu option
     if ARGS.update:
         # also runs process_data() / load_json_cache() & update_templates()
@@ -35,11 +72,11 @@ def main():
 
     # --rate menu option
     if ARGS.rate:
-        GETHUB.check_rate_limit()
+        Gethub.instance().check_rate_limit()
 
     # --reset menu option
     if ARGS.reset:
-        USER_CONFIG.setup_config()
+        Settings.instance().setup_config()
 
     # -o menu option
     if ARGS.override:
@@ -86,7 +123,7 @@ def main():
 
     # -v menu option
     if ARGS.version:
-        GETHUB.check_latest_release()
+        Gethub.instance().check_latest_release()
 
     # by default show the main menu & also show it after individual options run
     common.menu_default()
@@ -0,0 +1,81 @@
+""" Functions shared by the benchmarks (temporary HOME / JSON reports)
+"""
+import contextlib
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+
+
+@contextlib.contextmanager
+def temporary_home(user_config):
+    """ Runs dbmenu in a temporary HOME with a User Config so the real User Config
+        & templates are never touched (dbmenu modules must be imported afterwards
+        as the default paths are read from HOME on import)
+
+    Args:
+        user_config (str): YAML written to ~/.config/dbmenu.yaml
+
+    Yields:
+        str: the temporary HOME directory
+    """
+    # AppConfig parses the command line when dbmenu modules are used
+    sys.argv = ['dbmenu']
+    old_home = os.environ.get('HOME')
+
+    with tempfile.TemporaryDirectory(prefix='dbmenu-bench-') as home_dir:
+        os.environ['HOME'] = home_dir
+        # a missing User Config runs the interactive initial setup
+        config_file = Path(home_dir) / '.config' / 'dbmenu.yaml'
+        config_file.parent.mkdir(parents=True)
+        config_file.write_text(user_config, encoding='utf-8')
+
+        try:
+            yield home_dir
+        finally:
+            if old_home is not None:
+                os.environ['HOME'] = old_home
+
+
+def get_commit():
+    """ Returns the git commit of the source tree (or None)
+    """
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                capture_output=True, check=True, cwd=Path(__file__).parent)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.stdout.strip()
+
+
+def new_report(benchmark, **fields):
+    """ Returns a report dict with the details needed to compare results across commits
+    """
+    return {'benchmark': benchmark,
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            **fields}
+
+
+def get_output(output_file):
+    """ Returns the stream for the results table (stderr when the JSON goes to stdout)
+    """
+    return sys.stderr if output_file == '-' else sys.stdout
+
+
+def write_report(report, output_file):
+    """ Writes the report as JSON to output_file (or stdout for '-')
+    """
+    if output_file == '-':
+        print(json.dumps(report, indent=2))
+        return
+
+    with open(output_file, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    print(f"\nWrote results to: {output_file}")
@@ -0,0 +1,315 @@
+""" Template pipeline benchmark: generates a corpus of custom templates from the
+    bundled examples/ (overrides & cloud-init user-data) & measures the wall time
+    & the number of processes spawned by each stage of the pipeline:
+
+    * yaml_merge          - utils.yaml_merge() (standard || base template + override)
+    * yaml_add_content    - utils.yaml_add_content() (cloud-init user-data)
+    * format_template     - utils.format_template()
+    * add_custom_footer   - utils.add_custom_footer()
+    * create_custom_lists - templates.create_custom_lists()
+    * regenerate_template - templates.regenerate_template() (base then custom templates)
+
+    usage:
+            python -m distrobuilder_menu.benchmarks.pipeline [--sizes 10 100 1000]
+                   [--repeat 1] [--yq auto || real || stand-in] [--output results.json]
+
+    Runs offline in a temporary HOME. The standard templates are the example base
+    templates without their dbmenu footer & when the golang version of yq is not
+    installed a stand-in (see yq_standin.py) is put first in the PATH.
+"""
+import argparse
+import contextlib
+import io
+import os
+from pathlib import Path
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+# app modules
+from distrobuilder_menu.benchmarks import common
+
+DEFAULT_SIZES = (10, 100, 1000)
+
+# base templates first so custom templates can be merged from them
+EXAMPLES = ('alpine-base', 'ubuntu-base', 'alpine-abuild', 'ubuntu-gitlab', 'ubuntu-podman')
+
+STAGES = ('yaml_merge', 'yaml_add_content', 'format_template', 'add_custom_footer',
+          'create_custom_lists', 'regenerate_template')
+
+# processes started with subprocess (counted with an audit hook)
+SPAWNS = {'count': 0}
+
+
+def count_spawns(event, _args):
+    """ Audit hook counting subprocess.Popen calls (shell=True calls also exec a shell)
+    """
+    if event == 'subprocess.Popen':
+        SPAWNS['count'] += 1
+
+
+def find_examples():
+    """ Returns the examples directory (packaged under site-packages or in the repo)
+    """
+    package_dir = Path(__file__).parents[1]
+
+    for examples_dir in (package_dir / 'examples', package_dir.parents[1] / 'examples'):
+        if (examples_dir / 'templates' / 'custom').is_dir():
+            return examples_dir
+
+    return None
+
+
+def check_yq():
+    """ Returns True when the golang version of yq is installed
+    """
+    try:
+        output = subprocess.run(['yq', '-V'], text=True, capture_output=True, check=False)
+    except OSError:
+        return False
+
+    return 'mikefarah' in output.stdout
+
+
+def install_standin(bin_dir):
+    """ Writes a yq wrapper script running yq_standin.py & puts it first in the PATH
+    """
+    package_parent = Path(__file__).parents[2]
+    script = Path(bin_dir) / 'yq'
+    script.write_text(f"#!{sys.executable}\n"
+                      "import sys\n"
+                      f"sys.path.insert(0, {str(package_parent)!r})\n"
+                      "from distrobuilder_menu.benchmarks.yq_standin import main\n"
+                      "sys.exit(main())\n", encoding='utf-8')
+    script.chmod(0o755)
+    os.environ['PATH'] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+
+
+def read_footer(template_path):
+    """ Returns the dbmenu footer of an example template
+    """
+    from distrobuilder_menu import utils  # pylint: disable=import-outside-toplevel
+
+    return utils.find_regex(template_path, '#dbmenu.*$', substring='#dbmenu', json_dict=True)
+
+
+def create_corpus(examples_dir, user_config, count):
+    """ Copies the example overrides / cloud-init files & the standard templates
+        into the temporary HOME & returns the dbmenu footers of count custom
+        templates (the examples repeated in groups)
+
+    Returns:
+        list: footer dicts (see add_custom_footer())
+    """
+    # pylint: disable=too-many-locals
+    example_footers = {}
+
+    for subdir in ('subdir_images', 'subdir_custom', 'subdir_overrides'):
+        Path(getattr(user_config, subdir)).mkdir(parents=True, exist_ok=True)
+
+    for example in EXAMPLES:
+        footer = read_footer(examples_dir / 'templates' / 'custom' / f"{example}.yaml")
+        example_footers[example] = footer
+
+        shutil.copy(examples_dir / 'templates' / 'overrides' / f"{example}.yaml",
+                    user_config.subdir_overrides)
+
+        for key, value in (footer['cloudinit'] or {}).items():
+            cloudinit_dir = Path(user_config.cloudinit_dir) / key
+            cloudinit_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copy(examples_dir / 'cloudinit' / key / Path(value).name, cloudinit_dir)
+
+        # standard templates: the example base templates without the footer
+        if footer['type'] == 'base':
+            lines = (examples_dir / 'templates' / 'custom' / f"{example}.yaml").read_text(
+                encoding='utf-8').splitlines(keepends=True)
+            Path(user_config.subdir_images, Path(footer['source']).name).write_text(
+                ''.join(line for line in lines if not line.startswith('#dbmenu')),
+                encoding='utf-8')
+
+    footer_list = []
+
+    for index in range(count):
+        example = EXAMPLES[index % len(EXAMPLES)]
+        group = index // len(EXAMPLES)
+        footer = example_footers[example]
+        source_name = Path(footer['source']).stem
+
+        if footer['type'] == 'base':
+            source = f"{user_config.subdir_images}/{source_name}.yaml"
+        else:
+            source = f"{user_config.subdir_custom}/{source_name}-{group:04}.yaml"
+
+        cloudinit = {key: f"{user_config.cloudinit_dir}/{key}/{Path(value).name}"
+                     for key, value in (footer['cloudinit'] or {}).items()} or None
+        name = f"{example}-{group:04}"
+
+        footer_list.append({'source': source,
+                            'override': f"{user_config.subdir_overrides}/{example}.yaml",
+                            'type': footer['type'],
+                            'name': name,
+                            'destination': f"{user_config.subdir_custom}/{name}.yaml",
+                            'cloudinit': cloudinit})
+
+    return footer_list
+
+
+def run_stage(stage, func, results):
+    """ Runs a stage recording it's wall time & process spawns (output is discarded)
+    """
+    spawns = SPAWNS['count']
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start_time
+
+    results[stage] = {'seconds': round(seconds, 6), 'spawns': SPAWNS['count'] - spawns}
+    return result
+
+
+def run_pipeline(examples_dir, count):
+    """ Generates count custom templates stage by stage & regenerates them
+
+    Returns:
+        dict: stage : dict with keys 'seconds' 'spawns' ('breakdown')
+    """
+    # pylint: disable=too-many-locals
+    # dbmenu modules are imported after the temporary HOME is set (see main())
+    # pylint: disable=import-outside-toplevel
+    from distrobuilder_menu import templates
+    from distrobuilder_menu import utils
+    from distrobuilder_menu.api.tracer import Tracer
+    from distrobuilder_menu.config.user import Settings
+
+    user_config = Settings.instance()
+    # each run starts from an empty distrobuilder directory
+    shutil.rmtree(user_config.main_dir, ignore_errors=True)
+    footer_list = create_corpus(examples_dir, user_config, count)
+    results = {}
+
+    def merge_all():
+        for footer in footer_list:
+            utils.yaml_merge(user_config.yq_check, footer['destination'],
+                             footer['source'], footer['override'])
+
+    def add_content_all():
+        for footer in footer_list:
+            for key, value in (footer['cloudinit'] or {}).items():
+                utils.yaml_add_content(src_file=footer['destination'], node='files',
+                                       search_key='name', search_value=key,
+                                       merge_file=value, new_key='content')
+
+    def format_all():
+        for footer in footer_list:
+            utils.format_template(footer['destination'])
+
+    def footer_all():
+        for footer in footer_list:
+            utils.add_custom_footer(footer['destination'], footer)
+
+    def regenerate_all():
+        templates.regenerate_template(base_list)
+        templates.regenerate_template(custom_list)
+
+    run_stage('yaml_merge', merge_all, results)
+    run_stage('yaml_add_content', add_content_all, results)
+    run_stage('format_template', format_all, results)
+    run_stage('add_custom_footer', footer_all, results)
+    base_list, custom_list = run_stage('create_custom_lists', templates.create_custom_lists,
+                                       results)
+
+    # the spans of regenerate_template() show where the time goes
+    tracer = Tracer.instance()
+    tracer.enabled = True
+    tracer.reset()
+    run_stage('regenerate_template', regenerate_all, results)
+
+    results['regenerate_template']['breakdown'] = {
+        path[1]: round(total, 6) for path, (_, total) in tracer.tree.items()
+        if len(path) == 2 and path[0] == 'regenerate_template'}
+    tracer.enabled = False
+
+    return results
+
+
+def run_size(examples_dir, count, repeat):
+    """ Runs the pipeline repeat times (the median of each stage is kept)
+
+    Returns:
+        dict: results for this size
+    """
+    runs = [run_pipeline(examples_dir, count) for _ in range(repeat)]
+    stages = {}
+
+    for stage in STAGES:
+        seconds = statistics.median(run[stage]['seconds'] for run in runs)
+        stages[stage] = {'seconds': round(seconds, 6),
+                         'per_template_ms': round(seconds / count * 1000, 3),
+                         'spawns': runs[-1][stage]['spawns']}
+
+    stages['regenerate_template']['breakdown'] = runs[-1]['regenerate_template']['breakdown']
+
+    return {'templates': count, 'stages': stages}
+
+
+def show_results(report, output):
+    """ Prints the results as a table
+    """
+    print(f"\nyq: {report['yq']}\n", file=output)
+    print(f"{'TEMPLATES':>9} {'STAGE':<20} {'SECONDS':>9} {'PER TEMPLATE ms':>16} {'SPAWNS':>7}",
+          file=output)
+
+    for result in report['results']:
+        for stage, stats in result['stages'].items():
+            print(f"{result['templates']:>9} {stage:<20} {stats['seconds']:>9.3f} "
+                  f"{stats['per_template_ms']:>16.2f} {stats['spawns']:>7}", file=output)
+
+
+def main():
+    """ Reads the benchmark options & runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description="dbmenu template pipeline benchmark",
+                                     prog="python -m distrobuilder_menu.benchmarks.pipeline")
+    parser.add_argument("--sizes", nargs='+', type=int, default=DEFAULT_SIZES, metavar='N',
+                        help="number of custom templates (default 10 100 1000)")
+    parser.add_argument("--repeat", default=1, type=int,
+                        help="number of runs of each size (default 1)")
+    parser.add_argument("--yq", choices=('auto', 'real', 'stand-in'), default='auto',
+                        help="yq binary (default auto: the stand-in when golang yq is missing)")
+    parser.add_argument("--examples", type=Path, default=find_examples(), metavar='DIR',
+                        help="examples directory (default the bundled examples)")
+    parser.add_argument("--output", default='-', metavar='FILE',
+                        help="write the JSON results to FILE (default stdout)")
+    args = parser.parse_args()
+
+    if not args.examples:
+        sys.exit('Error: examples directory not found (use --examples DIR)')
+
+    if args.yq == 'real' and not check_yq():
+        sys.exit('Error: the golang version of yq (mikefarah/yq) is not installed')
+
+    sys.addaudithook(count_spawns)
+
+    with common.temporary_home('yq_check: true\n') as home_dir:
+        yq_binary = 'real'
+
+        if args.yq == 'stand-in' or (args.yq == 'auto' and not check_yq()):
+            bin_dir = Path(home_dir) / 'bin'
+            bin_dir.mkdir()
+            install_standin(bin_dir)
+            yq_binary = 'stand-in'
+
+        report = common.new_report('pipeline', yq=yq_binary, repeat=max(1, args.repeat),
+                                   results=[run_size(args.examples, size, max(1, args.repeat))
+                                            for size in args.sizes])
+
+    output = common.get_output(args.output)
+    show_results(report, output)
+    common.write_report(report, args.output)
+
+
+# Start #
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+""" Scaling benchmark: generates synthetic LXD image listings (lxd.json) with a
+    realistic mix of architectures / image types & measures the wall time &
+    peak memory of each stage of the version cache:
+
+    * parse           - utils.read_config(lxd.json) as used by update_lxd_json()
+    * parse_json      - json.load(lxd.json) (baseline for parse)
+    * process_data    - templates.process_data()
+    * cache_to_json   - templates.cache_to_json()
+    * load_json_cache - templates.load_json_cache()
+    * select_versions - templates.select_versions() (the menu_versions() filter)
+
+    usage:
+            python -m distrobuilder_menu.benchmarks.scaling [--sizes 1000 10000]
+                   [--repeat 3] [--output results.json] [--compare old.json]
+
+    Results are written as JSON (to stdout or --output) so they can be compared
+    across commits with --compare (exits 1 if a stage is slower than
+    --max-regression times the old median). A temporary HOME is used so the
+    User Config / templates are never touched.
+"""
+import argparse
+import contextlib
+import io
+import json
+from pathlib import Path
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+# app modules
+from distrobuilder_menu.benchmarks import common
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+# uname architecture : (simplestreams architecture, weight)
+ARCHITECTURES = {
+    'x86_64': ('amd64', 40),
+    'aarch64': ('arm64', 25),
+    'armv7l': ('armhf', 10),
+    'i686': ('i386', 5),
+    'ppc64le': ('ppc64el', 8),
+    'riscv64': ('riscv64', 6),
+    's390x': ('s390x', 6),
+}
+
+# image properties type : (LXD image type, weight)
+IMAGE_TYPES = {
+    'squashfs': ('container', 55),
+    'disk-kvm.img': ('virtual-machine', 30),
+    'root.tar.xz': ('container', 15),
+}
+
+OPERATING_SYSTEMS = {
+    'alpine': ('3.18', '3.19', '3.20', 'edge'),
+    'archlinux': ('current',),
+    'centos': ('9-Stream',),
+    'debian': ('bullseye', 'bookworm', 'trixie'),
+    'fedora': ('39', '40'),
+    'opensuse': ('15.5', 'tumbleweed'),
+    'ubuntu': ('focal', 'jammy', 'noble'),
+}
+
+VARIANTS = ('default', 'cloud')
+
+# os used for the select_versions stage
+SELECT_OS = 'debian'
+
+STAGES = ('parse', 'parse_json', 'process_data', 'cache_to_json', 'load_json_cache',
+          'select_versions')
+
+# --compare ignores slowdowns of stages faster than this
+MIN_COMPARE_S = 0.001
+
+
+def generate_image(rng, host_arch):
+    """ Returns a synthetic image in the format of 'lxc image ls -f json'
+    """
+    arch = rng.choices(list(ARCHITECTURES), [value[1] for value in ARCHITECTURES.values()])[0]
+    # make sure the host architecture is in the mix (process_data() only keeps it)
+    if arch == 'x86_64':
+        arch = host_arch
+
+    image_type = rng.choices(list(IMAGE_TYPES), [value[1] for value in IMAGE_TYPES.values()])[0]
+    os_name = rng.choice(list(OPERATING_SYSTEMS))
+    release = rng.choice(OPERATING_SYSTEMS[os_name])
+    variant = rng.choice(VARIANTS)
+    serial = f"2024{rng.randrange(1, 13):02}{rng.randrange(1, 29):02}_07:42"
+
+    # older builds of a product are unaliased
+    if rng.random() < 0.7:
+        aliases = [{'name': f"{os_name}/{release}/{variant}", 'description': ''}]
+    else:
+        aliases = None
+
+    return {
+        'aliases': aliases,
+        'architecture': arch,
+        'auto_update': False,
+        'cached': False,
+        'created_at': '2024-01-01T00:00:00Z',
+        'filename': f"{os_name}-{release}-{variant}.{image_type}",
+        'fingerprint': f"{rng.getrandbits(256):064x}",
+        'properties': {
+            'architecture': ARCHITECTURES.get(arch, (arch,))[0],
+            'description': f"{os_name.capitalize()} {release} {arch} ({variant}) ({serial})",
+            'os': os_name.capitalize(),
+            'release': release,
+            'serial': serial,
+            'type': image_type,
+            'variant': variant,
+        },
+        'public': True,
+        'size': rng.randrange(2000000, 700000000),
+        'type': IMAGE_TYPES[image_type][0],
+        'remote': 'images',
+    }
+
+
+def write_listing(file_path, size, seed=42):
+    """ Streams a synthetic listing of size images to file_path
+        (without holding the whole listing in memory)
+
+    Returns:
+        int: file size in bytes
+    """
+    rng = random.Random(seed)
+    host_arch = platform.machine()
+
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write('[')
+        for index in range(size):
+            if index:
+                file.write(', ')
+            file.write(json.dumps(generate_image(rng, host_arch)))
+        file.write(']')
+
+    return Path(file_path).stat().st_size
+
+
+def run_stage(func, repeat, memory):
+    """ Runs a stage repeat times (dbmenu output is discarded)
+
+    Returns:
+        tuple: stage result, dict with keys 'min_s' 'median_s' ('peak_bytes')
+    """
+    times = []
+    result = None
+
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start_time)
+
+    stats = {'min_s': round(min(times), 6), 'median_s': round(statistics.median(times), 6)}
+
+    # tracemalloc slows python down so memory is measured in a separate run
+    if memory:
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        stats['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result, stats
+
+
+def run_size(size, repeat, memory, stages):
+    """ Measures the stages for a listing of size images (stages which are not
+        measured still run once when a later stage needs their output)
+
+    Returns:
+        dict: results for this size
+    """
+    # pylint: disable=too-many-locals
+    # dbmenu modules are imported after the temporary HOME is set (see main())
+    # pylint: disable=import-outside-toplevel
+    from distrobuilder_menu import templates
+    from distrobuilder_menu import utils
+    from distrobuilder_menu.config.user import Settings
+
+    user_config = Settings.instance()
+    Path(user_config.template_dir).mkdir(parents=True, exist_ok=True)
+
+    lxd_json = user_config.lxd_json
+    listing_bytes = write_listing(lxd_json, size)
+    results = {}
+
+    def measure(stage, func):
+        if stage not in stages:
+            with contextlib.redirect_stdout(io.StringIO()):
+                return func()
+
+        result, results[stage] = run_stage(func, repeat, memory)
+        return result
+
+    def parse_json():
+        with open(lxd_json, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    # parse & parse_json read the same listing so parse is only run when measured
+    if 'parse' in stages:
+        measure('parse', lambda: utils.read_config(lxd_json))
+
+    data = measure('parse_json', parse_json)
+    versions = measure('process_data', lambda: templates.process_data(data))
+    del data
+
+    measure('cache_to_json', lambda: templates.cache_to_json(versions,
+                                                             user_config.json_cachefile))
+    versions = measure('load_json_cache', templates.load_json_cache)
+    selected = measure('select_versions', lambda: templates.select_versions(versions, SELECT_OS))
+
+    return {'images': size,
+            'lxd_json_bytes': listing_bytes,
+            'cache_json_bytes': Path(user_config.json_cachefile).stat().st_size,
+            'versions': len(versions),
+            'selected': len(selected),
+            'stages': results}
+
+
+def show_results(report, output):
+    """ Prints the results as a table
+    """
+    memory = 'PEAK MiB' if report['memory'] else ''
+
+    print(f"\n{'IMAGES':>8} {'STAGE':<16} {'MEDIAN s':>10} {'MIN s':>10} {memory:>9}",
+          file=output)
+
+    for result in report['results']:
+        for stage, stats in result['stages'].items():
+            peak = f"{stats['peak_bytes'] / 1048576:>9.1f}" if 'peak_bytes' in stats else ''
+            print(f"{result['images']:>8} {stage:<16} {stats['median_s']:>10.4f} "
+                  f"{stats['min_s']:>10.4f} {peak}", file=output)
+
+
+def compare_results(report, old_file, max_regression, output):
+    """ Compares the median stage times with an earlier report (stages faster than
+        MIN_COMPARE_S are shown but never fail as their timings are mostly noise)
+
+    Returns:
+        int: exit code (1 if a stage is slower than max_regression times the old median)
+    """
+    with open(old_file, 'r', encoding='utf-8') as file:
+        old_report = json.load(file)
+
+    old_results = {result['images']: result['stages'] for result in old_report['results']}
+    exit_code = 0
+
+    print(f"\nCompared with: {old_file} (commit {old_report.get('commit')})\n", file=output)
+
+    for result in report['results']:
+        old_stages = old_results.get(result['images'], {})
+
+        for stage, stats in result['stages'].items():
+            if stage not in old_stages or not old_stages[stage]['median_s']:
+                continue
+
+            ratio = stats['median_s'] / old_stages[stage]['median_s']
+
+            if stats['median_s'] < MIN_COMPARE_S:
+                status = 'OK'
+            else:
+                status = 'FAIL' if ratio > max_regression else 'OK'
+
+            if status == 'FAIL':
+                exit_code = 1
+
+            print(f"{status}: {result['images']:>8} {stage:<16} {ratio:>6.2f}x", file=output)
+
+    return exit_code
+
+
+def main():
+    """ Reads the benchmark options & runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description="dbmenu version cache scaling benchmark",
+                                     prog="python -m distrobuilder_menu.benchmarks.scaling")
+    parser.add_argument("--sizes", nargs='+', type=int, default=DEFAULT_SIZES, metavar='N',
+                        help="number of images in each listing (default 1000 10000 100000 "
+                             "1000000)")
+    parser.add_argument("--stages", nargs='+', choices=STAGES, default=STAGES, metavar='STAGE',
+                        help=f"stages to measure (default {' '.join(STAGES)})")
+    parser.add_argument("--repeat", default=3, type=int,
+                        help="number of measured runs of each stage (default 3)")
+    parser.add_argument("--no-memory", action='store_true',
+                        help="skip measuring peak memory with tracemalloc")
+    parser.add_argument("--output", default='-', metavar='FILE',
+                        help="write the JSON results to FILE (default stdout)")
+    parser.add_argument("--compare", metavar='FILE',
+                        help="compare the median times with an earlier JSON result")
+    parser.add_argument("--max-regression", default=1.25, type=float, metavar='RATIO',
+                        help="slowdown allowed by --compare (default 1.25)")
+    args = parser.parse_args()
+
+    with common.temporary_home('yq_check: false\n'):
+        report = common.new_report('scaling', repeat=max(1, args.repeat),
+                                   memory=not args.no_memory,
+                                   results=[run_size(size, max(1, args.repeat),
+                                                     not args.no_memory, args.stages)
+                                            for size in args.sizes])
+
+    output = common.get_output(args.output)
+    show_results(report, output)
+    common.write_report(report, args.output)
+
+    if args.compare:
+        sys.exit(compare_results(report, args.compare, args.max_regression, output))
+
+
+# Start #
+if __name__ == "__main__":
+    main()
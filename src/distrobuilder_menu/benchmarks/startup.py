@@ -0,0 +1,138 @@
+""" Startup benchmark: measures the import time of the main menu modules with
+    'python -X importtime' & the wall time of 'dbmenu --help' against a budget
+    in milliseconds.
+
+    usage:
+            python -m distrobuilder_menu.benchmarks.startup [--budget 75] [--runs 5]
+
+    exits 1 if a median time is over budget or if a deferred module is imported
+    by the main menu (so it can be used as a check before a release)
+"""
+import argparse
+import compileall
+from pathlib import Path
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# 'import time: self [us] | cumulative | imported package'
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+# modules imported by app.main() before the main menu is shown
+MENU_MODULES = ('distrobuilder_menu.app', 'distrobuilder_menu.menus.cloudinit',
+                'distrobuilder_menu.menus.common', 'distrobuilder_menu.api.gethub')
+
+# heavy modules which must only be imported on first use
+DEFERRED_MODULES = ('yaml', 'urllib3', 'pprint', 'concurrent.futures',
+                    'distrobuilder_menu.builder', 'distrobuilder_menu.importer',
+                    'distrobuilder_menu.api.incus', 'distrobuilder_menu.api.simplestreams')
+
+
+def measure_imports(modules=MENU_MODULES):
+    """ Runs 'python -X importtime' in a new interpreter
+
+    Returns:
+        tuple: total milliseconds of the imports,
+               dict: module name : (self microseconds, cumulative microseconds)
+    """
+    cmd = [sys.executable, '-X', 'importtime', '-c', f"import {', '.join(modules)}"]
+    output = subprocess.run(cmd, text=True, capture_output=True, check=True)
+    imports = {}
+    total_us = 0
+
+    for line in output.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            imports[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+            # top level imports (nested imports are indented)
+            if len(match.group(3)) == 1 and match.group(4) in modules:
+                total_us += int(match.group(2))
+
+    return total_us / 1000, imports
+
+
+def measure_command(cmd):
+    """ Returns the wall time in milliseconds of a command
+    """
+    start_time = time.perf_counter()
+    subprocess.run(cmd, capture_output=True, check=False)
+    return (time.perf_counter() - start_time) * 1000
+
+
+def show_top_imports(imports, top):
+    """ Prints the slowest imports by self time
+    """
+    print(f"\n{'MODULE':<45} {'SELF ms':>8} {'CUMULATIVE ms':>14}")
+
+    ranked = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (self_us, cumulative_us) in ranked[:top]:
+        print(f"{name:<45} {self_us / 1000:>8.1f} {cumulative_us / 1000:>14.1f}")
+
+
+def run_benchmark(budget, runs, top):
+    """ Measures startup & checks it against the budget
+
+    Returns:
+        int: exit code (0 within budget)
+    """
+    import_times = []
+    imports = {}
+
+    # measure imports like an installed package (pip writes .pyc files)
+    compileall.compile_dir(Path(__file__).parents[1], quiet=1)
+
+    for _ in range(runs):
+        import_ms, imports = measure_imports()
+        import_times.append(import_ms)
+
+    python_times = [measure_command([sys.executable, '-c', 'pass']) for _ in range(runs)]
+    help_times = [measure_command([sys.executable, '-m', 'distrobuilder_menu.app', '--help'])
+                  for _ in range(runs)]
+
+    python_ms = statistics.median(python_times)
+    # time added to python startup
+    results = {'main menu imports': statistics.median(import_times),
+               'dbmenu --help': statistics.median(help_times) - python_ms}
+
+    show_top_imports(imports, top)
+    print(f"\npython startup: {python_ms:.1f} ms (median of {runs} runs)")
+
+    exit_code = 0
+
+    for name, result_ms in results.items():
+        if result_ms > budget:
+            print(f"FAIL: {name}: {result_ms:.1f} ms > {budget} ms budget")
+            exit_code = 1
+        else:
+            print(f"OK: {name}: {result_ms:.1f} ms <= {budget} ms budget")
+
+    eager_modules = [name for name in DEFERRED_MODULES if name in imports]
+
+    if eager_modules:
+        print(f"FAIL: imported by the main menu: {' '.join(eager_modules)}")
+        exit_code = 1
+
+    return exit_code
+
+
+def main():
+    """ Reads the benchmark options & runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description="dbmenu startup benchmark",
+                                     prog="python -m distrobuilder_menu.benchmarks.startup")
+    parser.add_argument("--budget", default=75, type=float, metavar='MS',
+                        help="startup budget in milliseconds (default 75)")
+    parser.add_argument("--runs", default=5, type=int,
+                        help="number of measured runs (default 5)")
+    parser.add_argument("--top", default=15, type=int,
+                        help="number of slowest imports shown (default 15)")
+    args = parser.parse_args()
+
+    sys.exit(run_benchmark(args.budget, max(1, args.runs), args.top))
+
+
+# Start #
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+""" A stand-in for the golang version of yq (mikefarah/yq) implementing only the
+    expressions dbmenu runs (see yaml_merge() / yaml_extract() / yaml_add_content())
+    so the template benchmark runs where yq is not installed.
+
+    usage (via the wrapper script written by the template benchmark):
+            yq -V
+            yq eval-all '. as $item ireduce ({}; . *+ $item )' FILE [FILE ...]
+            yq 'with_entries(select(.key | test("REGEX")))' FILE
+            yq -i '.NODE[INDEX].KEY = "CONTENT"' FILE
+"""
+import re
+import sys
+
+import yaml
+
+VERSION = 'yq (https://github.com/mikefarah/yq/) version v4 (dbmenu benchmark stand-in)'
+
+MERGE_EXPRESSION = '. as $item ireduce ({}; . *+ $item )'
+EXTRACT_EXPRESSION = re.compile(r'^with_entries\(select\(\.key \| test\("(.*)"\)\)\)$')
+ASSIGN_EXPRESSION = re.compile(r'^\.(\w+)\[(\d+)\]\.(\w+) = "(.*)"$', re.DOTALL)
+
+
+def str_presenter(dumper, data):
+    """ Writes multiline strings as literal blocks (like golang-yaml)
+    """
+    if '\n' in data:
+        return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
+    return dumper.represent_scalar('tag:yaml.org,2002:str', data)
+
+
+yaml.add_representer(str, str_presenter, Dumper=yaml.SafeDumper)
+
+
+def read_yaml(file_path):
+    """ Returns the YAML data of a file (an empty file is an empty dict)
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return yaml.load(file, Loader=yaml.CSafeLoader) or {}
+
+
+def dump_yaml(data):
+    """ Returns data as YAML in the order it was read
+    """
+    return yaml.safe_dump(data, sort_keys=False, default_flow_style=False,
+                          allow_unicode=True, width=4096)
+
+
+def deep_merge(base, other):
+    """ Merges other into base like the yq '*+' operator (maps are merged
+        recursively & arrays are appended)
+    """
+    if isinstance(base, dict) and isinstance(other, dict):
+        merged = dict(base)
+        for key, value in other.items():
+            merged[key] = deep_merge(merged[key], value) if key in merged else value
+        return merged
+
+    if isinstance(base, list) and isinstance(other, list):
+        return base + other
+
+    return other
+
+
+def main():
+    """ Runs a yq expression
+    """
+    args = sys.argv[1:]
+
+    if args in (['-V'], ['--version']):
+        print(VERSION)
+        return 0
+
+    if args[:2] == ['eval-all', MERGE_EXPRESSION]:
+        merged = {}
+        for file_path in args[2:]:
+            merged = deep_merge(merged, read_yaml(file_path))
+        sys.stdout.write(dump_yaml(merged))
+        return 0
+
+    if len(args) == 3 and args[0] == '-i' and ASSIGN_EXPRESSION.match(args[1]):
+        node, index, key, content = ASSIGN_EXPRESSION.match(args[1]).groups()
+        data = read_yaml(args[2])
+        items = data.setdefault(node, [])
+
+        while len(items) <= int(index):
+            items.append({})
+        items[int(index)][key] = content
+
+        with open(args[2], 'w', encoding='utf-8') as file:
+            file.write(dump_yaml(data))
+        return 0
+
+    if len(args) == 2 and EXTRACT_EXPRESSION.match(args[0]):
+        regexp = re.compile(EXTRACT_EXPRESSION.match(args[0]).group(1))
+        data = read_yaml(args[1])
+        sys.stdout.write(dump_yaml({key: value for key, value in data.items()
+                                    if regexp.search(key)}))
+        return 0
+
+    print(f"Error: yq stand-in does not support: {' '.join(args)}", file=sys.stderr)
+    return 1
+
+
+# Start #
+if __name__ == "__main__":
+    sys.exit(main())
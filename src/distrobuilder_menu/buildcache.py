@@ -0,0 +1,300 @@
+""" Managed distrobuilder download cache (enabled by cache_dir in the User Config)
+
+    Each distribution / release has it's own distrobuilder --cache-dir under
+    build_cache_dir (e.g cache/alpine/3.19) which is kept between builds
+    (distrobuilder --cleanup=false) so rootfs / package downloads are reused.
+
+    * the distrobuilder work directories (rootfs / overlay) are removed before
+      & after each build so only downloads are kept (& are links into the
+      build workspace when it is on tmpfs - see workspace.py)
+    * files left unchanged / downloaded || changed by each build are counted
+      & added to the build timing record (& the metrics_file) - unchanged files
+      were not necessarily read by the build
+    * when the cache grows over build_cache_max_mb the least recently used
+      entries are removed (entries in use by another dbmenu are skipped)
+
+    usage:
+            cache_dir = buildcache.get_cache_dir(build_options, template_path)
+            with buildcache.use_cache(cache_dir) as cache_stats:
+                run_build()
+"""
+import contextlib
+import json
+import os
+from pathlib import Path
+import shlex
+import time
+# app modules
+from distrobuilder_menu import layers
+from distrobuilder_menu import locks
+from distrobuilder_menu import metrics
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+from distrobuilder_menu.api.progress import format_bytes
+# app classes
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+USER_CONFIG = Settings.lazy()
+
+# distrobuilder working directories inside --cache-dir (not downloads)
+WORK_DIRS = ('rootfs', 'overlay')
+
+# entry name : last_used / bytes / builds / unchanged / changed
+INDEX_FILE = 'index.json'
+
+
+def get_cache_root():
+    """ Returns the managed cache directory (cache_dir may also be set to a path)
+    """
+    if isinstance(USER_CONFIG.cache_dir, str):
+        return Path(USER_CONFIG.cache_dir)
+
+    return Path(USER_CONFIG.build_cache_dir)
+
+
+def get_cache_dir(build_options, template_path):
+    """ Returns the cache entry of the distribution / release of a build
+        (custom templates share the entry of their standard template)
+
+    Args:
+        build_options (dict): see output of menu_versions()
+        template_path (str): absolute path to the template yaml
+
+    Returns:
+        str: cache entry directory (or None when cache_dir is not set)
+    """
+    if not USER_CONFIG.cache_dir:
+        return None
+
+    if USER_CONFIG.subdir_custom in template_path:
+        template_path = layers.find_standard_template(template_path) or template_path
+
+    return str(get_cache_root() / Path(template_path).stem / build_options['release'])
+
+
+def get_entry_name(cache_dir):
+    """ Returns the index name of a cache entry e.g alpine/3.19
+    """
+    return Path(cache_dir).relative_to(get_cache_root()).as_posix()
+
+
+def snapshot(cache_dir):
+    """ Lists the downloaded files of a cache entry
+
+    Returns:
+        dict: relative path : (size, mtime_ns)
+    """
+    files = {}
+    # os.walk() yields str paths (cache_dir may be a Path)
+    cache_dir = os.fspath(cache_dir)
+
+    for dir_path, dir_names, file_names in os.walk(cache_dir):
+        # prune the distrobuilder working directories
+        if dir_path == cache_dir:
+            dir_names[:] = [name for name in dir_names if name not in WORK_DIRS]
+
+        for name in file_names:
+            file_path = os.path.join(dir_path, name)
+            try:
+                stat = os.lstat(file_path)
+            except OSError:
+                continue
+            files[os.path.relpath(file_path, cache_dir)] = (stat.st_size, stat.st_mtime_ns)
+
+    return files
+
+
+def get_size(cache_dir):
+    """ Returns the bytes held by a cache entry
+    """
+    return sum(size for size, _ in snapshot(cache_dir).values())
+
+
+def compare_snapshots(before, after):
+    """ Counts the cached files left unchanged & the files downloaded || changed
+        by a build (distrobuilder does not report which cached files it read so
+        unchanged files are not counted as reused)
+
+    Returns:
+        dict: unchanged / changed / unchanged_bytes / changed_bytes
+    """
+    stats = {'unchanged': 0, 'changed': 0, 'unchanged_bytes': 0, 'changed_bytes': 0}
+
+    for file_path, (size, mtime) in after.items():
+        if before.get(file_path) == (size, mtime):
+            stats['unchanged'] += 1
+            stats['unchanged_bytes'] += size
+        else:
+            stats['changed'] += 1
+            stats['changed_bytes'] += size
+
+    return stats
+
+
+def remove_work_dirs(cache_dir):
+    """ Removes the distrobuilder working directories (owned by root)
+    """
+    for name in WORK_DIRS:
+        work_dir = Path(cache_dir) / name
+
+        # links into a tmpfs workspace are removed without their target
+        if work_dir.exists() or work_dir.is_symlink():
+            utils.check_command(f"sudo rm -rf {shlex.quote(str(work_dir))}",
+                                exit_on_error=True
+                               )
+
+
+def link_work_dirs(cache_dir, work_dir):
+    """ Links the distrobuilder work directories into a tmpfs workspace
+        (removing the links with remove_work_dirs() leaves the workspace)
+    """
+    for name in WORK_DIRS:
+        (Path(work_dir) / name).mkdir(exist_ok=True)
+        (Path(cache_dir) / name).symlink_to(Path(work_dir) / name)
+
+
+@contextlib.contextmanager
+def use_cache(cache_dir, work_dir=None):
+    """ Holds a cache entry for one build & afterwards records it's unchanged /
+        changed files & evicts the least recently used entries over the size cap
+
+    Args:
+        cache_dir (str): see get_cache_dir() (None disables the cache)
+        work_dir (str, optional): tmpfs workspace for the distrobuilder work
+                                  directories. Defaults to None (on disk).
+
+    Yields:
+        dict: unchanged / changed stats of the build (filled in when the build ends)
+    """
+    stats = {}
+
+    if not cache_dir:
+        yield stats
+        return
+
+    name = get_entry_name(cache_dir)
+
+    # builds of the same distribution / release share the working directories
+    with locks.exclusive(f"cache-{name.replace('/', '-')}"):
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        remove_work_dirs(cache_dir)
+        before = snapshot(cache_dir)
+
+        if work_dir:
+            link_work_dirs(cache_dir, work_dir)
+
+        try:
+            yield stats
+        finally:
+            remove_work_dirs(cache_dir)
+            after = snapshot(cache_dir)
+            stats.update(compare_snapshots(before, after))
+            stats['entry'] = name
+
+            update_index(name, stats, sum(size for size, _ in after.values()))
+            show_stats(stats)
+            metrics.record_cache(name, stats)
+
+    evict(keep=name)
+
+
+def show_stats(stats):
+    """ Prints the unchanged / changed files of a build
+    """
+    print(f"\nBuild cache: {stats['entry']} => {stats['unchanged']} files unchanged "
+          f"({format_bytes(stats['unchanged_bytes'])}) / {stats['changed']} files "
+          f"downloaded or changed ({format_bytes(stats['changed_bytes'])})")
+
+
+def read_index():
+    """ Returns the cache index (see INDEX_FILE)
+    """
+    index_file = get_cache_root() / INDEX_FILE
+
+    if not index_file.is_file():
+        return {}
+
+    return utils.read_config(index_file) or {}
+
+
+def write_index(index):
+    """ Writes the cache index (atomically so an interrupted write never truncates it)
+    """
+    utils.write_file_atomic(get_cache_root() / INDEX_FILE, json.dumps(index))
+
+
+def update_index(name, stats, size):
+    """ Marks a cache entry as used now & adds the unchanged / changed files of a build
+    """
+    with locks.exclusive('cache-index'):
+        index = read_index()
+        entry = index.setdefault(name, {'builds': 0})
+
+        entry['last_used'] = round(time.time(), 3)
+        entry['bytes'] = size
+        entry['builds'] += 1
+
+        for key in ('unchanged', 'changed'):
+            entry[key] = entry.get(key, 0) + stats[key]
+
+        write_index(index)
+
+
+def find_entries():
+    """ Returns the names of the cache entries on disk (distribution/release)
+    """
+    cache_root = get_cache_root()
+
+    return [f"{distro}/{release}"
+            for distro in utils.find_subdirs(cache_root)
+            for release in utils.find_subdirs(cache_root / distro)]
+
+
+@tracer.traced()
+def evict(keep=None):
+    """ Removes least recently used cache entries until the cache fits in
+        build_cache_max_mb (0 = no limit)
+
+    Args:
+        keep (str, optional): entry of the current build. Defaults to None.
+    """
+    max_bytes = USER_CONFIG.build_cache_max_mb * 1024 * 1024
+
+    if max_bytes <= 0:
+        return
+
+    with locks.exclusive('cache-index'):
+        index = read_index()
+
+        # entries copied in by hand (or from older indexes) are sized once
+        for name in find_entries():
+            if name not in index:
+                index[name] = {'builds': 0, 'unchanged': 0, 'changed': 0, 'last_used': 0,
+                               'bytes': get_size(get_cache_root() / name)}
+
+        total = sum(entry['bytes'] for entry in index.values())
+
+        for name in sorted(index, key=lambda name: index[name]['last_used']):
+            if total <= max_bytes:
+                break
+
+            if name == keep:
+                continue
+
+            lock_name = f"cache-{name.replace('/', '-')}"
+
+            # entries being built by another dbmenu are kept
+            if not locks.try_acquire(lock_name, writer=True):
+                continue
+
+            try:
+                print(f"Evicting build cache: {name} ({format_bytes(index[name]['bytes'])})")
+                entry_dir = shlex.quote(str(get_cache_root() / name))
+                utils.check_command(f"sudo rm -rf {entry_dir}", exit_on_error=True)
+            finally:
+                locks.release(lock_name)
+
+            total -= index.pop(name)['bytes']
+
+        write_index(index)
@@ -1,25 +1,45 @@
 """ Functions for building the LXD / LXC images.
 """
+import re
 import subprocess
+import tempfile
+import time
 from pathlib import Path
 # app modules
+from distrobuilder_menu import buildcache
+from distrobuilder_menu import buildlog
+from distrobuilder_menu import compression
+from distrobuilder_menu import executors
+from distrobuilder_menu import layers
+from distrobuilder_menu import locks
+from distrobuilder_menu import metrics
+from distrobuilder_menu import store
 from distrobuilder_menu import utils
+from distrobuilder_menu import workspace
+from distrobuilder_menu.api import tracer
 # app classes
+from distrobuilder_menu.api.incus import Incus
 from distrobuilder_menu.config.app import AppConfig
 from distrobuilder_menu.config.user import Settings
+from distrobuilder_menu.importer import ImportQueue
 
 # singleton classes
 # shares config between modules
-ARGS = AppConfig.instance().get()
-USER_CONFIG = Settings.instance()
-DEBUG_TIMER = utils.Timer(ARGS.timer)
+ARGS = AppConfig.lazy()
+USER_CONFIG = Settings.lazy()
+# Incus / LXD API methods
+INCUS = Incus.lazy()
 
-def get_build_user_options(build_options, template_path):
+def get_build_user_options(build_options, template_path, target_dir, source_dir=None,
+                           cache_dir=None):
     """ Used by build_image() to get build options from user config
 
     Args:
         build_options (dict): see output of menu_versions()
         template_path (str): absolute path to template yaml
+        target_dir (str): per build staging directory for the output
+        source_dir (str, optional): rootfs to pack for layered builds. Defaults to None.
+        cache_dir (str, optional): see buildcache.get_cache_dir(). Defaults to None.
 
     Returns:
         str: command line options for distrobuilder
@@ -29,24 +49,33 @@ def get_build_user_options(build_options, template_path):
     # build user configurable distrobuilder flags
     user_cmd_list.append(template_path)
 
-    if USER_CONFIG.target_dir:
-        user_cmd_list.append(USER_CONFIG.target_dir)
+    # pack-incus || pack-lxc take the rootfs before the target dir
+    if source_dir:
+        user_cmd_list.append(source_dir)
+
+    user_cmd_list.append(target_dir)
 
     # image options
     user_cmd_list.append(f"-o image.release={build_options['release']}")
     user_cmd_list.append(f"-o image.variant={build_options['variant']}")
 
-    if USER_CONFIG.cache_dir:
-        user_cmd_list.append(f"--cache-dir={USER_CONFIG.cache_dir}")
+    if cache_dir:
+        user_cmd_list.append(f"--cache-dir={cache_dir}")
+
+    # compression of the active profile (see compression.py)
+    compression_type = compression.get_compression(build_options['type_top_level'])
 
-    if USER_CONFIG.compression:
-        user_cmd_list.append(f"--compression={USER_CONFIG.compression}")
+    if compression_type:
+        user_cmd_list.append(f"--compression={compression_type}")
 
     if USER_CONFIG.timeout:
         user_cmd_list.append(f"--timeout={USER_CONFIG.timeout}")
 
     # boolean image options
-    if USER_CONFIG.cleanup:
+    # (distrobuilder --cleanup defaults to true & would remove the managed cache)
+    if cache_dir:
+        user_cmd_list.append('--cleanup=false')
+    elif USER_CONFIG.cleanup:
         user_cmd_list.append('--cleanup')
 
     if USER_CONFIG.debug:
@@ -64,13 +93,15 @@ def get_build_user_options(build_options, template_path):
     return user_cmd
 
 
-def get_build_options(build_options, template_path):
+def get_build_options(build_options, template_path, queue_imports=False):
     """ Creates a dict with main build options & concatenates
         the user options
 
     Args:
         build_options (dict): see output of menu_versions()
         template_path (str): absolute path to yaml build template
+        queue_imports (bool, optional): images are imported by the import queue
+                                        (not distrobuilder). Defaults to False.
 
     Returns:
         dict: main_opts (i.e build LXC or LXD) & it's subcommand
@@ -105,13 +136,13 @@ def get_build_options(build_options, template_path):
         if USER_CONFIG.lxd_output_type:
             lxd_opts_list.append(f"--type={USER_CONFIG.lxd_output_type}")
 
-        if USER_CONFIG.import_into_lxd:
-            check_lxd_socket()
-
-            # VM alias
-            if build_options['type_top_level'] == 'virtual-machine':
-                image_alias = f"{image_alias}-vm"
+        # VM alias
+        if build_options['type_top_level'] == 'virtual-machine':
+            image_alias = f"{image_alias}-vm"
 
+        # queued imports run after the build (see importer.py)
+        if USER_CONFIG.import_into_lxd and not queue_imports:
+            check_lxd_socket()
             lxd_opts_list.append(f"--import-into-incus={image_alias}")
 
     # concatenate command list
@@ -139,123 +170,510 @@ def check_lxd_socket():
             utils.die(1, "Please run 'dbmenu -s' & set 'import_into_lxd' to False under settings")
 
 
-def check_lxd_image(main_options):
+def check_lxd_image(main_options, assume_yes=False):
     """ Checks for an identically named LXD image & optionally
-        deletes it
+        deletes it (via the Incus / LXD API when the socket is accessible)
 
     Args:
         main_options (dict): output by get_build_options()
+        assume_yes (bool, optional): delete without asking. Defaults to False.
     """
     # check if existing LXD image will be overwritten
     if main_options['container_type'] == 'LXD':
         image_alias = main_options['image_alias']
-        try:
-            # run shell command from python displaying output
-            print(f"\nChecking for existing image: {image_alias}\n")
-            lxd_binary = utils.get_lxd_binary()
-            lxd_cmd = f"sudo {lxd_binary} image get-property {image_alias} os &>/dev/null"
+        print(f"\nChecking for existing image: {image_alias}\n")
 
-            # check=True raises CalledProcessError on non zero returncode
-            subprocess.run(lxd_cmd, shell=True, check=True)
+        if INCUS.check_socket():
+            fingerprint = INCUS.get_alias(image_alias)
+        else:
+            fingerprint = check_lxd_image_cli(image_alias)
+
+        if not fingerprint:
+            print("Image Alias is OK")
+            return
+
+        if assume_yes:
+            choice = 'Y'
+        else:
             choice = utils.get_input(f"Delete existing image: {image_alias} [Y/n]: ? ",
-                                        accept_empty=True, default='Y'
+                                     accept_empty=True, default='Y'
                                     )
-            if choice.startswith('y') or choice.startswith('Y'):
-                try:
-                    # run shell command from python displaying output
-                    print(f"Deleting image: {image_alias}")
-                    lxd_cmd = f"sudo {lxd_binary} image delete {image_alias}"
-                    subprocess.run(lxd_cmd, shell=True, check=True)
-                except subprocess.CalledProcessError:
-                    utils.die(1, f"\nError removing: {image_alias} in build_image()")
+        if choice.startswith('y') or choice.startswith('Y'):
+            print(f"Deleting image: {image_alias}")
+
+            if INCUS.check_socket():
+                INCUS.delete_image(fingerprint)
             else:
-                utils.die(1, f"\nCancelled build of: {image_alias}\n")
-        except subprocess.CalledProcessError:
-            # sudo timeouts also pass here
-            print("Image Alias is OK")
+                delete_lxd_image_cli(image_alias)
+        else:
+            utils.die(1, f"\nCancelled build of: {image_alias}\n")
+
+
+def check_lxd_image_cli(image_alias):
+    """ Fallback for check_lxd_image() when the API socket is not accessible
+
+    Returns:
+        str: the image alias if it exists (or None)
+    """
+    lxd_binary = utils.get_lxd_binary()
+    lxd_cmd = f"sudo {lxd_binary} image get-property {image_alias} os &>/dev/null"
+
+    try:
+        # check=True raises CalledProcessError on non zero returncode
+        subprocess.run(lxd_cmd, shell=True, check=True)
+    except subprocess.CalledProcessError:
+        # sudo timeouts also pass here
+        return None
+
+    return image_alias
 
 
-def build_image(build_options, template_path):
+def delete_lxd_image_cli(image_alias):
+    """ Fallback for check_lxd_image() when the API socket is not accessible
+    """
+    lxd_binary = utils.get_lxd_binary()
+
+    try:
+        # run shell command from python displaying output
+        lxd_cmd = f"sudo {lxd_binary} image delete {image_alias}"
+        subprocess.run(lxd_cmd, shell=True, check=True)
+    except subprocess.CalledProcessError:
+        utils.die(1, f"\nError removing: {image_alias} in build_image()")
+
+
+def build_image(build_options, template_path, assume_yes=False, executor_name=None):
     """ Final stage to build an LXD / LXC container or vm image
         reads the build_options dict & the build flags from user defined YAML
         & concatenates the distrobuilder command.
+
+        assume_yes skips the confirmation prompts (builds submitted to the daemon)
+        executor_name picks the build executor (defaults to dbmenu --executor
+        || build_placement - see executors.py)
     """
-    user_options = get_build_user_options(build_options, template_path)
-    lxd_options, main_options = get_build_options(build_options, template_path)
-    image_alias = main_options['image_alias']
+    executor_name = executor_name or ARGS.executor
 
-    # check if existing LXD image will be overwritten
-    if main_options['container_type'] == 'LXD':
-        check_lxd_image(main_options)
+    # builds submitted to the daemon are placed when a build slot is free
+    if assume_yes:
+        with executors.use_executor(executor_name) as executor:
+            build = plan_build(build_options, template_path, executor, assume_yes)
+            try:
+                run_image_build(build, executor)
+            finally:
+                release_staging_dir(build['staging_dir'])
+        return
 
-    # build image
-    build_cmd = f"sudo distrobuilder {main_options['main_cmd']} {user_options} {lxd_options}"
-    print(f"\ncmd = {build_cmd} \n")
+    # interactive builds are shown for the executor chosen now & only hold
+    # it's build slot (until the build is published) once confirmed
+    executor = executors.choose_executor(executor_name)
+    build = plan_build(build_options, template_path, executor)
 
-    choice = utils.get_input(f"Build {main_options['container_type']} image [Y/n]: ? ",
-                             accept_empty=True, default='Y'
-                            )
-    if choice.startswith('y') or choice.startswith('Y'):
-        # formatting
-        print('')
+    try:
+        if not confirm_build(build['main_options']):
+            cancel_build(build)
+            return
+
+        with executors.use_executor(executor.name) as executor:
+            run_image_build(build, executor)
+    finally:
+        release_staging_dir(build['staging_dir'])
+
+
+def plan_build(build_options, template_path, executor, assume_yes=False):
+    """ Prepares a build on an executor & prints it's distrobuilder command
+
+    Args:
+        build_options (dict): see output of menu_versions()
+        template_path (str): absolute path to the template yaml
+        executor (LocalExecutor || SSHExecutor): see executors.choose_executor()
+        assume_yes (bool, optional): skip the confirmation prompts. Defaults to False.
+
+    Returns:
+        dict: build options / template / main_options / layered_build /
+              staging_dir / build_template / cache_dir / work / build_cmd
+              (see run_image_build())
+    """
+    lxd_options, main_options = get_build_options(build_options, template_path,
+                                                  executor.queue_imports
+                                                 )
+    build = {'build_options': build_options, 'template_path': template_path,
+             'main_options': main_options, 'layered_build': None,
+             'cache_dir': None, 'work': None}
+
+    # optionally build custom templates from a cached base rootfs
+    if USER_CONFIG.layered_builds and executor.local:
+        build['layered_build'] = layers.prepare_layered_build(build_options, template_path)
+
+    # check if existing LXD image will be overwritten (queued imports replace it)
+    if main_options['container_type'] == 'LXD' and not executor.queue_imports:
+        check_lxd_image(main_options, assume_yes)
+
+    # each build writes to it's own staging directory
+    build['staging_dir'] = create_staging_dir(main_options['image_alias'])
+    build['build_template'] = get_build_template(build)
+
+    try:
+        if executor.local:
+            # downloads are kept per distribution / release when cache_dir is set
+            build['cache_dir'] = buildcache.get_cache_dir(build_options, template_path)
+            # the build may run in RAM when tmpfs_workspace is set
+            build['work'] = workspace.plan_workspace(main_options['image_alias'],
+                                                     build['staging_dir'], build['layered_build']
+                                                    )
+
+        build['build_cmd'] = get_build_command(build, executor, lxd_options)
+    # the staging directory lock is not left held (daemon workers run many builds)
+    except BaseException:
+        cancel_build(build)
+        raise
+
+    print(f"\ncmd = {build['build_cmd']} \n")
+
+    return build
+
+
+def get_build_template(build):
+    """ Returns the template a build reads: the delta template of a layered
+        build || a copy of the template in the staging directory (see copy_template())
+    """
+    if build['layered_build']:
+        return build['layered_build']['template']
+
+    return f"{build['staging_dir']}/{Path(build['template_path']).name}"
+
+
+def get_build_command(build, executor, lxd_options):
+    """ Returns the distrobuilder command of a build (see plan_build())
+    """
+    main_options = build['main_options']
+    layered_build = build['layered_build']
+
+    if layered_build:
+        main_options['main_cmd'] = main_options['main_cmd'].replace('build-', 'pack-')
+        user_options = get_build_user_options(build['build_options'], build['build_template'],
+                                              build['staging_dir'],
+                                              source_dir=layered_build['workspace']
+                                             )
+    else:
+        # builds on a node use it's copy of the template & output directory
+        build_template, target_dir = executor.get_paths(build['build_template'],
+                                                        build['staging_dir']
+                                                       )
+        # without the managed cache the workspace is the distrobuilder work directory
+        cache_dir = build['cache_dir'] or workspace.get_path(build['work'])
+        user_options = get_build_user_options(build['build_options'], build_template,
+                                              target_dir, cache_dir=cache_dir
+                                             )
+
+    return f"sudo distrobuilder {main_options['main_cmd']} {user_options} {lxd_options}"
+
+
+def run_image_build(build, executor):
+    """ Runs a planned build with an executor & publishes it (see build_image())
+
+    Args:
+        build (dict): see plan_build()
+        executor (LocalExecutor || SSHExecutor): see executors.use_executor()
+    """
+    image_alias = build['main_options']['image_alias']
+    layered_build = build['layered_build']
+    work_dir = workspace.get_path(build['work'])
+    # formatting
+    print('')
+
+    with workspace.use_workspace(build['work']), \
+         buildcache.use_cache(build['cache_dir'], work_dir) as cache_stats:
+        if layered_build:
+            layers.create_layered_build(layered_build, build['build_options'],
+                                        build['cache_dir']
+                                       )
+        else:
+            copy_template(build)
+
+        start_time = time.perf_counter()
 
         try:
-            # run shell command from python displaying output
-            output = subprocess.run(build_cmd, shell=True, check=True)
+            # run shell command from python displaying output & recording phase timings
+            record = executor.run(build['build_cmd'], image_alias, build['build_template'],
+                                  build['staging_dir']
+                                 )
         except subprocess.CalledProcessError:
+            metrics.record_build(image_alias, time.perf_counter() - start_time)
             utils.die(1, "\nError from distrobuilder: => check template YAML.")
-
-        # rename images
-        if output.returncode == 0:
-            if main_options['container_type'] == 'LXD':
-                rename_lxd_image(image_alias)
+        finally:
+            if layered_build:
+                layers.cleanup_layered_build(layered_build)
             else:
-                rename_lxc_image(image_alias)
+                # the staging directory only holds the artifacts when publishing
+                Path(build['build_template']).unlink(missing_ok=True)
 
+    publish_build(build, record, cache_stats, executor.queue_imports)
+    # staging directory is empty after renaming the build
+    remove_staging_dir(build['staging_dir'])
 
-def rename_lxc_image(image_alias):
-    """ Renames the rootfs / meta archives to include the image_alias
+
+def copy_template(build):
+    """ Copies the template of a build into it's staging directory holding the
+        template lock only while copying (so the template can be edited || synced
+        by another dbmenu while the build runs from the copy)
+    """
+    with locks.shared(locks.template_lock(build['template_path'])):
+        utils.copy_dirs_or_files(build['template_path'], build['build_template'])
+
+
+def publish_build(build, record, cache_stats, queue_imports):
+    """ Keeps the cache / workspace stats of a build with it's phase timings
+        & renames (publishes) a successful build
+
+    Args:
+        build (dict): see plan_build()
+        record (dict): timing record of the build
+        cache_stats (dict): see buildcache.use_cache() (None without the cache)
+        queue_imports (bool): see rename_lxd_image()
+    """
+    # unchanged / changed cache files are kept with the phase timings
+    if cache_stats:
+        buildlog.update_record(record, 'cache', cache_stats)
+
+    if build['work']:
+        buildlog.update_record(record, 'workspace', build['work'])
+
+    # rename images
+    if record['returncode'] == 0:
+        artifacts = rename_image(build['main_options'], build['staging_dir'], queue_imports)
+        metrics.record_build(build['main_options']['image_alias'], record['total'], artifacts)
+
+
+def cancel_build(build):
+    """ Removes the staging directory (& it's lock), tmpfs workspace reservation
+        & layered build work directory of a cancelled build
+    """
+    workspace.release_workspace(build['work'])
+
+    if build['layered_build']:
+        layers.cleanup_layered_build(build['layered_build'])
+
+    remove_staging_dir(build['staging_dir'])
+    release_staging_dir(build['staging_dir'])
+
+
+def confirm_build(main_options, assume_yes=False):
+    """ Asks for confirmation before running a build
+
+    Args:
+        main_options (dict): see get_build_options()
+        assume_yes (bool): skips the prompt (builds submitted to the daemon)
+
+    Returns:
+        bool: True if the build should run
+    """
+    if assume_yes:
+        return True
+
+    choice = utils.get_input(f"Build {main_options['container_type']} image [Y/n]: ? ",
+                             accept_empty=True, default='Y'
+                            )
+    return choice.startswith('y') or choice.startswith('Y')
+
+
+def rename_image(main_options, staging_dir, queue_imports=False):
+    """ Renames a successful build from the staging directory to it's final name
+
+    Args:
+        main_options (dict): see get_build_options()
+        staging_dir (str): staging directory for this build
+        queue_imports (bool): see rename_lxd_image()
+
+    Returns:
+        dict: renamed artifact paths
+    """
+    if main_options['container_type'] == 'LXD':
+        return rename_lxd_image(main_options['image_alias'], staging_dir, queue_imports)
+
+    return rename_lxc_image(main_options['image_alias'], staging_dir)
+
+
+def create_staging_dir(image_alias):
+    """ Creates a unique staging directory under target_dir for a single build
+        (so concurrent builds or unrelated files in target_dir are never renamed)
 
     Args:
         image_alias (str): see get_build_options() for it's format
+
+    Returns:
+        str: staging directory path
     """
-    output = utils.find_latest_files(USER_CONFIG.target_dir, 2)
-    rootfs_path = f"{USER_CONFIG.target_dir}/{output[0]}"
-    meta_path = f"{USER_CONFIG.target_dir}/{output[1]}"
+    staging_root = Path(USER_CONFIG.target_dir or '.') / '.staging'
 
-    rootfs_custom_path = (
-        f"{USER_CONFIG.target_dir}/{image_alias}-rootfs.tar.{USER_CONFIG.compression}"
-    )
-    meta_custom_path = (
-        f"{USER_CONFIG.target_dir}/{image_alias}-meta.tar.{USER_CONFIG.compression}"
-    )
-    utils.move_file(rootfs_path, rootfs_custom_path)
-    utils.move_file(meta_path, meta_custom_path)
+    try:
+        staging_root.mkdir(parents=True, exist_ok=True)
+    # cross platform & also catches permission errors
+    except (OSError, IOError) as err:
+        utils.die(1, f"Error: {err.args[1]} : {staging_root}")
+
+    staging_dir = tempfile.mkdtemp(prefix=f"{image_alias}-", dir=staging_root)
+    # held until the build ends so 'dbmenu --gc' never removes it (see release_staging_dir())
+    locks.acquire(store.get_staging_lock(staging_dir), writer=True)
+
+    return staging_dir
 
-    lxc_paths = f"--metadata {meta_custom_path} --fstree {rootfs_custom_path}"
+
+def remove_staging_dir(staging_dir):
+    """ Removes a staging directory (leftover files are kept for inspection)
+    """
+    try:
+        Path(staging_dir).rmdir()
+    except OSError:
+        print(f"WARN: staging directory is not empty: {staging_dir}")
+
+
+def release_staging_dir(staging_dir):
+    """ Releases the lock of a staging directory when it's build ends (the lock
+        file is removed with the directory - leftovers are removed by 'dbmenu --gc')
+    """
+    lock_name = store.get_staging_lock(staging_dir)
+
+    if lock_name not in locks.get_held():
+        return
+
+    if Path(staging_dir).exists():
+        locks.release(lock_name)
+    else:
+        locks.discard(lock_name)
+
+
+def get_artifact_extension(file_name):
+    """ Returns the extension of a distrobuilder artifact
+
+    Args:
+        file_name (str): e.g alpine-3.19-x86_64-default-20240101_0000.tar.xz
+
+    Returns:
+        str: e.g .tar.xz || .squashfs || .qcow2
+    """
+    match = re.search(r'(\.tar(\.\w+)?|\.squashfs|\.qcow2)$', file_name)
+
+    if not match:
+        utils.die(1, f"Error: unknown distrobuilder output: {file_name}")
+
+    return match.group()
+
+
+def find_artifacts(staging_dir):
+    """ Identifies the artifacts written by distrobuilder to a staging directory
+
+    Args:
+        staging_dir (str): staging directory of the build
+
+    Returns:
+        dict: artifact role ('image' / 'meta' / 'rootfs' / 'disk') : file path
+    """
+    artifacts = {}
+
+    for file_path in sorted(Path(staging_dir).iterdir()):
+        if not file_path.is_file():
+            continue
+
+        name = file_path.name
+
+        # LXC: rootfs.tar.* & meta.tar.* / LXD split: incus.tar.* & rootfs.squashfs
+        if name.startswith('rootfs.'):
+            role = 'rootfs'
+        elif name.startswith(('meta.', 'incus.', 'lxd.')):
+            role = 'meta'
+        elif name.startswith('disk.'):
+            role = 'disk'
+        else:
+            # LXD unified tarballs are named after the image & serial
+            role = 'image'
+
+        if role in artifacts:
+            utils.die(1, f"Error: unexpected distrobuilder output in: {staging_dir}")
+
+        artifacts[role] = str(file_path)
+
+    if not artifacts:
+        utils.die(1, f"Error: no distrobuilder output found in: {staging_dir}")
+
+    return artifacts
+
+
+@tracer.traced()
+def publish_artifacts(image_alias, staging_dir):
+    """ Atomically moves the artifacts of a build from it's staging directory
+        to target_dir renamed to the image alias
+
+    Args:
+        image_alias (str): see get_build_options() for it's format
+        staging_dir (str): staging directory of the build
+
+    Returns:
+        dict: artifact role : published file path
+    """
+    files = {}
+    # staging directories are created under target_dir/.staging
+    target_dir = Path(staging_dir).parent.parent
+
+    for role, file_path in find_artifacts(staging_dir).items():
+        extension = get_artifact_extension(Path(file_path).name)
+
+        if role == 'image':
+            new_path = f"{target_dir}/{image_alias}{extension}"
+        else:
+            new_path = f"{target_dir}/{image_alias}-{role}{extension}"
+
+        files[role] = (file_path, new_path)
+
+    # one dbmenu at a time writes to the build output directory
+    # (artifacts are kept / deduplicated in the artifact store - see store.py)
+    with locks.exclusive('build'):
+        return store.publish(image_alias, files)
+
+
+def rename_lxc_image(image_alias, staging_dir):
+    """ Renames the rootfs / meta archives to include the image_alias
+
+    Args:
+        image_alias (str): see get_build_options() for it's format
+        staging_dir (str): staging directory of the build
+
+    Returns:
+        dict: see output of publish_artifacts()
+    """
+    artifacts = publish_artifacts(image_alias, staging_dir)
+
+    lxc_paths = f"--metadata {artifacts['meta']} --fstree {artifacts['rootfs']}"
     lxc_cmd = f"lxc-create {image_alias} -t local -- {lxc_paths}"
     print(f"LXC image: '{image_alias}' can be installed with:\n\n{lxc_cmd}")
 
+    return artifacts
 
-def rename_lxd_image(image_alias):
+
+def rename_lxd_image(image_alias, staging_dir, queue_imports=False):
     """ LXD image names are timestamped - renames the image to it's
         alias so custom images are differentiated from the distribution
         name & they have a known name format to import into LXD
 
     Args:
         image_alias (str): see get_build_options() for it's format
+        staging_dir (str): staging directory of the build
+        queue_imports (bool, optional): see get_build_options(). Defaults to False.
+
+    Returns:
+        dict: see output of publish_artifacts()
     """
-    output = utils.find_latest_files(USER_CONFIG.target_dir, 1)
-    image_path = f"{USER_CONFIG.target_dir}/{output[0]}"
+    artifacts = publish_artifacts(image_alias, staging_dir)
 
-    # rename custom image to it's alias
-    custom_path = (
-        f"{USER_CONFIG.target_dir}/{image_alias}.tar.{USER_CONFIG.compression}"
-    )
-    utils.move_file(image_path, custom_path)
+    # import in the background while the next build runs
+    if USER_CONFIG.import_into_lxd and queue_imports:
+        ImportQueue.instance().submit(image_alias, artifacts)
+        return artifacts
 
     # show LXD image properties
     if USER_CONFIG.import_into_lxd:
+        if INCUS.check_socket():
+            INCUS.show_images(image_alias)
+            return artifacts
+
         lxd_binary = utils.get_lxd_binary()
         lxd_cmd = f"sudo {lxd_binary} image ls {image_alias}"
         try:
@@ -263,3 +681,5 @@ def rename_lxd_image(image_alias):
         except subprocess.CalledProcessError:
             # sudo timeouts do not give an err.output tuple
             utils.die(1, f"Error: displaying LXD image details: {image_alias}")
+
+    return artifacts
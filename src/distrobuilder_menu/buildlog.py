@@ -0,0 +1,218 @@
+""" Streams distrobuilder output through a parser that recognises the build phases
+    & records per phase timings & a full log file for each build.
+
+    Phases are recognised from the wording of distrobuilder's log lines (see
+    PHASES & tests/data/distrobuilder-build-incus.log) & while distrobuilder is
+    quiet (e.g packing a large rootfs) the phase & elapsed time are shown every
+    TICK_INTERVAL seconds so long phases do not look hung.
+"""
+from datetime import datetime
+from pathlib import Path
+import re
+import subprocess
+import sys
+import threading
+import time
+# app modules
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+
+# distrobuilder (logrus) log lines e.g: 'INFO   [2024-01-01T00:00:00Z] Downloading source'
+LOG_LINE = re.compile(r'^\s*(INFO|DEBU|WARN|ERRO)')
+
+# checked in order (package / hook log lines can also mention downloads)
+PHASES = (
+    ('import', re.compile(r'import', re.IGNORECASE)),
+    ('compression', re.compile(r'compress', re.IGNORECASE)),
+    ('packing', re.compile(r'creating .*image|\bpack(ing)?\b|mksquashfs', re.IGNORECASE)),
+    ('hooks', re.compile(r'hook|trigger|action|generator|generating', re.IGNORECASE)),
+    # 'Unpacking repository tarball' is not a package phase
+    ('unpacking', re.compile(r'unpack|extract', re.IGNORECASE)),
+    ('packages', re.compile(r'package|repositor', re.IGNORECASE)),
+    ('downloading', re.compile(r'download|fetch|gpg|verif|checksum', re.IGNORECASE)),
+)
+
+# seconds without distrobuilder output before the running phase is shown
+TICK_INTERVAL = 30
+
+
+class BuildLog:
+    """ Tracks the current build phase & the time spent in each phase.
+
+        usage:
+                build_log = BuildLog(image_alias, log_dir)
+                for line in output:
+                    build_log.parse_line(line)
+                build_log.finish(returncode)
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, image_alias, log_dir):
+        """ Initialises the phase timings & creates the log file paths
+        """
+        self.image_alias = image_alias
+        self.phase = 'starting'
+        self.phase_times = {}
+        self.start_time = time.perf_counter()
+        self.phase_start = self.start_time
+        self.last_output = self.start_time
+        self.started = datetime.now()
+
+        timestamp = self.started.strftime('%Y%m%d-%H%M%S')
+        self.log_file = Path(log_dir) / f"{image_alias}-{timestamp}.log"
+        self.record_file = Path(log_dir) / f"{image_alias}-{timestamp}.json"
+
+
+    def elapsed(self):
+        """ Returns seconds elapsed since the build started
+        """
+        return time.perf_counter() - self.start_time
+
+
+    def phase_elapsed(self):
+        """ Returns seconds elapsed since the current phase started
+        """
+        return time.perf_counter() - self.phase_start
+
+
+    def set_phase(self, phase):
+        """ Accumulates the time spent in the current phase & starts a new phase
+        """
+        now = time.perf_counter()
+        self.phase_times[self.phase] = self.phase_times.get(self.phase, 0) + now - self.phase_start
+        self.phase = phase
+        self.phase_start = now
+
+
+    def parse_line(self, line):
+        """ Checks a line of distrobuilder output for a phase change
+
+        Returns:
+            boolean: True if the phase changed
+        """
+        self.last_output = time.perf_counter()
+
+        if not LOG_LINE.match(line):
+            return False
+
+        for phase, regexp in PHASES:
+            if regexp.search(line):
+                if phase != self.phase:
+                    self.set_phase(phase)
+                    return True
+                break
+
+        return False
+
+
+    def finish(self, returncode):
+        """ Closes the last phase & writes the timing record
+
+        Returns:
+            dict: timing record for the build
+        """
+        self.set_phase('finished')
+        self.phase_times.pop('finished', None)
+
+        record = {}
+        record['alias'] = self.image_alias
+        record['started'] = self.started.isoformat(timespec='seconds')
+        record['returncode'] = returncode
+        record['total'] = round(self.elapsed(), 3)
+        record['phases'] = {key: round(value, 3) for key, value in self.phase_times.items()}
+        record['log'] = str(self.log_file)
+
+        utils.write_config(self.record_file, record, data_type='json')
+        return record
+
+
+def update_record(record, key, value):
+    """ Adds data to a timing record & rewrites it's file (named after the log)
+    """
+    record[key] = value
+    utils.write_config(Path(record['log']).with_suffix('.json'), record, data_type='json')
+
+
+def show_timings(record):
+    """ Prints the per phase timings of a build
+    """
+    print(f"\nBuild timings: {record['alias']} (total {record['total']:.1f}s)\n")
+
+    for phase, seconds in record['phases'].items():
+        percent = seconds / record['total'] * 100 if record['total'] else 0
+        print(f" {phase:<12} {seconds:>9.1f}s {percent:>5.1f}%")
+
+    print(f"\nBuild log: {record['log']}")
+
+
+def show_ticks(build_log, stop):
+    """ Shows the running phase & elapsed time while distrobuilder is quiet
+        (runs in a thread until stop is set)
+
+    Args:
+        build_log (BuildLog): the running build
+        stop (threading.Event): set when the build ends
+    """
+    delay = TICK_INTERVAL
+
+    while not stop.wait(delay):
+        quiet = time.perf_counter() - build_log.last_output
+
+        if quiet < TICK_INTERVAL:
+            delay = TICK_INTERVAL - quiet
+            continue
+
+        print(f"==> [{build_log.elapsed():7.1f}s] phase: {build_log.phase} "
+              f"(running for {build_log.phase_elapsed():.0f}s)")
+        build_log.last_output = time.perf_counter()
+        delay = TICK_INTERVAL
+
+
+def run_build(build_cmd, image_alias, log_dir):
+    """ Runs a distrobuilder command streaming its output to the console & to
+        a log file while recording the time spent in each build phase
+
+    Args:
+        build_cmd (str): distrobuilder shell command
+        image_alias (str): used to name the log / timing files
+        log_dir (str): directory for the log / timing files
+
+    Raises:
+        subprocess.CalledProcessError: on a non zero returncode (like subprocess.run)
+
+    Returns:
+        dict: timing record for the build
+    """
+    Path(log_dir).mkdir(parents=True, exist_ok=True)
+    build_log = BuildLog(image_alias, log_dir)
+    stop = threading.Event()
+    ticker = threading.Thread(target=show_ticks, args=(build_log, stop), daemon=True)
+
+    with tracer.span('run_build', alias=image_alias), \
+         open(build_log.log_file, 'w', encoding='utf-8') as log_file:
+        # merge stderr as distrobuilder logs to stderr
+        with subprocess.Popen(build_cmd, shell=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, text=True, errors='replace',
+                              bufsize=1) as process:
+            ticker.start()
+
+            try:
+                for line in process.stdout:
+                    log_file.write(line)
+                    sys.stdout.write(line)
+
+                    if build_log.parse_line(line):
+                        print(f"==> [{build_log.elapsed():7.1f}s] phase: {build_log.phase}")
+            finally:
+                stop.set()
+                ticker.join()
+
+        returncode = process.wait()
+
+    record = build_log.finish(returncode)
+    show_timings(record)
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, build_cmd)
+
+    return record
@@ -0,0 +1,82 @@
+""" Thin client for the dbmenu daemon (see daemon.py)
+
+    Only the standard library is imported here so 'dbmenu -q' does not pay for
+    reading the User Config / version cache / templates (the daemon keeps them
+    parsed in memory). Without a running daemon queries are run in process.
+"""
+import json
+import os
+import socket
+import sys
+
+# seconds to wait for a daemon response
+TIMEOUT = 30
+
+
+def get_socket_path():
+    """ Returns the daemon socket path (the client does not read the User Config
+        so the path is set with the environment instead of dbmenu.yaml)
+
+    Returns:
+        str: $DBMENU_SOCKET || $XDG_RUNTIME_DIR/dbmenu.sock || /tmp/dbmenu-<uid>.sock
+    """
+    if os.environ.get('DBMENU_SOCKET'):
+        return os.environ['DBMENU_SOCKET']
+
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return f"{os.environ['XDG_RUNTIME_DIR']}/dbmenu.sock"
+
+    return f"/tmp/dbmenu-{os.getuid()}.sock"
+
+
+def send_request(request, socket_path=None):
+    """ Sends a request to the daemon as a line of JSON & reads the JSON response
+
+    Args:
+        request (dict): keys 'command' & 'args'
+        socket_path (str, optional): defaults to get_socket_path()
+
+    Raises:
+        OSError: if the daemon is not running
+
+    Returns:
+        dict: keys 'status' & 'data' || 'error'
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(TIMEOUT)
+        sock.connect(socket_path or get_socket_path())
+        sock.sendall(f"{json.dumps(request)}\n".encode('utf-8'))
+
+        with sock.makefile('r', encoding='utf-8') as reader:
+            response = reader.readline()
+
+    if not response:
+        return {'status': 'error', 'error': 'no response from the dbmenu daemon'}
+
+    return json.loads(response)
+
+
+def main(query):
+    """ Runs a query & prints the result as JSON (used by 'dbmenu -q')
+
+    Args:
+        query (list): command & it's arguments e.g ['versions', 'alpine']
+    """
+    request = {'command': query[0], 'args': query[1:]}
+
+    try:
+        response = send_request(request)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # no daemon: run the query in this process
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from distrobuilder_menu import daemon
+        response = daemon.handle_request(request)
+    except (OSError, json.decoder.JSONDecodeError) as err:
+        response = {'status': 'error', 'error': f"dbmenu daemon: {err}"}
+
+    if response['status'] != 'ok':
+        print(f"Error: {response['error']}", file=sys.stderr)
+        sys.exit(1)
+
+    print(json.dumps(response['data'], indent=2))
+    sys.exit(0)
@@ -0,0 +1,331 @@
+""" Compression profiles for build outputs & 'dbmenu --bench-compression'
+
+    Builds use the compression of the active profile for their image type
+    (dbmenu --profile NAME || compression_profile in the User Config) & fall back
+    to the compression setting. Profiles are stored in the User Config as:
+
+        compression_profiles:
+          fast-dev:
+            container: zstd-1
+          small-release:
+            container: xz-9
+
+    --bench-compression compresses a sample of a real build (a base layer rootfs,
+    a rootfs / unified tarball || a vm disk) with each algorithm & level that
+    distrobuilder --compression accepts (when the compressor is installed) &
+    recommends a profile for the image type of the sample from the time /
+    throughput / ratio of each. The same command line compressors are used so
+    the results follow the tarball outputs (squashfs outputs are compressed by
+    mksquashfs with the same algorithms).
+
+    usage:
+            dbmenu --bench-compression [SAMPLE]
+            dbmenu --profile small-release
+"""
+from pathlib import Path
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+# app modules
+from distrobuilder_menu import serializers
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+from distrobuilder_menu.api.progress import format_bytes
+# app classes
+from distrobuilder_menu.config.app import AppConfig
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+ARGS = AppConfig.lazy()
+USER_CONFIG = Settings.lazy()
+
+# distrobuilder --compression name : (compressor, levels measured)
+ALGORITHMS = {
+    'lz4': ('lz4', (1, 9)),
+    'lzo': ('lzop', (1, 3, 9)),
+    'gzip': ('gzip', (1, 6, 9)),
+    'zstd': ('zstd', (1, 3, 9, 19)),
+    'xz': ('xz', (1, 3, 6, 9)),
+}
+
+# compressor command line (multi threaded where the compressor supports it)
+COMMANDS = {
+    'lz4': 'lz4 -{level} -c',
+    'lzop': 'lzop -{level} -c',
+    'gzip': 'gzip -{level} -c',
+    'zstd': 'zstd -{level} -T0 -q -c',
+    'xz': 'xz -{level} -T0 -c',
+}
+
+# tarball extension : decompressor (used to sample rootfs tarballs)
+DECOMPRESSORS = {'.gz': 'gzip', '.lz4': 'lz4', '.lzo': 'lzop', '.xz': 'xz', '.zst': 'zstd'}
+
+# bytes of the sample compressed by each measurement
+SAMPLE_SIZE = 128 * 1048576
+CHUNK_SIZE = 1048576
+
+# balanced: smallest output among the compressors at least this fraction as fast as the fastest
+BALANCED_MIN_SPEED = 0.25
+
+
+def get_profile():
+    """ Returns the name of the active compression profile (or None)
+    """
+    return ARGS.profile or USER_CONFIG.compression_profile or None
+
+
+def get_compression(image_type):
+    """ Returns the distrobuilder --compression value of a build
+
+    Args:
+        image_type (str): container || virtual-machine (type_top_level)
+
+    Returns:
+        str: e.g xz || zstd-19 (or an empty string for the distrobuilder default)
+    """
+    profile = get_profile()
+
+    if not profile:
+        return USER_CONFIG.compression
+
+    profiles = USER_CONFIG.compression_profiles or {}
+
+    if profile not in profiles:
+        utils.die(1, f"Error: unknown compression profile: {profile} "
+                     f"(profiles: {' '.join(profiles) or 'none'})")
+
+    # image types missing from a profile use the compression setting
+    return profiles[profile].get(image_type, USER_CONFIG.compression)
+
+
+def find_sample():
+    """ Returns the newest base layer rootfs || rootfs / image tarball of a real build
+    """
+    candidates = [path for path in Path(USER_CONFIG.layers_dir).glob('*')
+                  if path.is_dir() and path.name != 'work']
+
+    target_dir = Path(USER_CONFIG.target_dir or '.')
+    candidates += [path for path in target_dir.glob('*.tar*') if 'meta' not in path.name]
+    candidates += list(target_dir.glob('*.qcow2'))
+    candidates += list(target_dir.glob('*.squashfs'))
+
+    if not candidates:
+        utils.die(1, 'Error: no build found to sample => pass a rootfs directory / tarball '
+                     'to --bench-compression')
+
+    return max(candidates, key=lambda path: path.stat().st_mtime)
+
+
+def get_image_type(sample):
+    """ Returns the image type a sample represents
+    """
+    return 'virtual-machine' if sample.suffix == '.qcow2' else 'container'
+
+
+def get_sample_command(sample):
+    """ Returns the shell command writing the uncompressed sample to stdout
+    """
+    sample_path = shlex.quote(str(sample))
+
+    if sample.is_dir():
+        # rootfs files are owned by root
+        return f"sudo tar -C {sample_path} -cf - ."
+
+    if '.tar' in sample.suffixes and sample.suffix in DECOMPRESSORS:
+        return f"{DECOMPRESSORS[sample.suffix]} -dc {sample_path}"
+
+    # plain tarballs & vm disks are compressed as they are
+    return f"cat {sample_path}"
+
+
+@tracer.traced()
+def create_sample(sample, sample_file):
+    """ Writes up to SAMPLE_SIZE uncompressed bytes of a sample to sample_file
+
+    Returns:
+        int: bytes written
+    """
+    unpack_dir = Path(sample_file).parent / 'rootfs'
+
+    if sample.suffix == '.squashfs':
+        # squashfs images are unpacked first
+        utils.check_command(f"sudo unsquashfs -q -d {shlex.quote(str(unpack_dir))} "
+                            f"{shlex.quote(str(sample))}", exit_on_error=True
+                           )
+        sample = unpack_dir
+
+    written = 0
+
+    with subprocess.Popen(get_sample_command(sample), shell=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL) as process, \
+         open(sample_file, 'wb') as file:
+        while written < SAMPLE_SIZE and (chunk := process.stdout.read(CHUNK_SIZE)):
+            file.write(chunk[:SAMPLE_SIZE - written])
+            written += len(chunk[:SAMPLE_SIZE - written])
+        # the rest of the rootfs is not needed
+        process.kill()
+
+    # unpacked files are owned by root
+    if unpack_dir.exists():
+        utils.check_command(f"sudo rm -rf {shlex.quote(str(unpack_dir))}", exit_on_error=True)
+
+    if not written:
+        utils.die(1, f"Error: could not read a sample from: {sample}")
+
+    return written
+
+
+def measure(sample_file, sample_size, algorithm, level):
+    """ Compresses the sample once
+
+    Returns:
+        dict: compression / seconds / throughput (MiB/s) / ratio
+    """
+    compressor = ALGORITHMS[algorithm][0]
+    command = COMMANDS[compressor].format(level=level)
+    output_size = 0
+    start_time = time.perf_counter()
+
+    with open(sample_file, 'rb') as file, \
+         subprocess.Popen(command, shell=True, stdin=file, stdout=subprocess.PIPE) as process:
+        while chunk := process.stdout.read(CHUNK_SIZE):
+            output_size += len(chunk)
+
+    seconds = time.perf_counter() - start_time
+
+    return {'compression': f"{algorithm}-{level}",
+            'seconds': round(seconds, 3),
+            'throughput': round(sample_size / 1048576 / seconds, 1),
+            'ratio': round(output_size / sample_size, 4)}
+
+
+@tracer.traced()
+def run_benchmark(sample_file, sample_size):
+    """ Measures every installed algorithm & level
+
+    Returns:
+        list: see measure()
+    """
+    results = []
+
+    print(f"\n {'COMPRESSION':<12} {'SECONDS':>8} {'MiB/s':>8} {'RATIO':>7}")
+
+    for algorithm, (compressor, levels) in ALGORITHMS.items():
+        if not shutil.which(compressor):
+            print(f" {algorithm:<12} skipped ({compressor} is not installed)")
+            continue
+
+        for level in levels:
+            with tracer.span('compress', compression=f"{algorithm}-{level}"):
+                result = measure(sample_file, sample_size, algorithm, level)
+
+            print(f" {result['compression']:<12} {result['seconds']:>8.2f} "
+                  f"{result['throughput']:>8.1f} {result['ratio']:>7.3f}")
+            results.append(result)
+
+    return results
+
+
+def recommend(results):
+    """ Picks the compression of each profile from the benchmark results
+
+    Returns:
+        dict: profile name : compression
+    """
+    fastest = max(results, key=lambda result: result['throughput'])
+    smallest = min(results, key=lambda result: (result['ratio'], -result['throughput']))
+    balanced = min((result for result in results
+                    if result['throughput'] >= fastest['throughput'] * BALANCED_MIN_SPEED),
+                   key=lambda result: (result['ratio'], -result['throughput']))
+
+    return {'fast-dev': fastest['compression'],
+            'balanced': balanced['compression'],
+            'small-release': smallest['compression']}
+
+
+def replace_config_key(text, key, value):
+    """ Replaces (or appends) a top level key block in YAML text leaving the
+        rest of the text (comments / key order / quoting) unchanged
+
+    Args:
+        text (str): YAML document
+        key (str): top level key
+        value (object): new value of the key
+
+    Returns:
+        str: YAML document
+    """
+    yaml, _, dumper = serializers.get_yaml()
+    block = yaml.dump({key: value}, Dumper=dumper, default_flow_style=False, sort_keys=False)
+    # the key line & the indented lines (|| blank lines followed by them) below it
+    pattern = re.compile(rf"^{re.escape(key)}:.*\n(?:[ \t]+.*\n|\n(?=[ \t]))*", re.MULTILINE)
+
+    if pattern.search(text):
+        return pattern.sub(lambda match: block, text, count=1)
+
+    if text and not text.endswith('\n'):
+        text += '\n'
+
+    return text + block
+
+
+def write_profiles(image_type, recommended):
+    """ Writes the recommended profiles for an image type to the User Config
+        (only the compression_profiles key is rewritten)
+    """
+    config = utils.read_config(USER_CONFIG.dbmenu_config) or {}
+    profiles = config.get('compression_profiles') or {}
+
+    for profile, compression in recommended.items():
+        profiles.setdefault(profile, {})[image_type] = compression
+
+    config_path = Path(USER_CONFIG.dbmenu_config)
+    text = config_path.read_text(encoding='utf-8') if config_path.is_file() else ''
+
+    utils.write_file_atomic(config_path, replace_config_key(text, 'compression_profiles',
+                                                            profiles
+                                                           ))
+    print(f"Wrote compression_profiles to: {config_path}")
+
+
+def bench_compression(sample=None):
+    """ Benchmarks the compression of a sample of a real build & recommends
+        (& optionally writes) a profile for it's image type
+
+    Args:
+        sample (str, optional): rootfs directory || tarball || vm disk.
+                                Defaults to None (the newest build).
+    """
+    sample = Path(sample) if sample else find_sample()
+
+    if not sample.exists():
+        utils.die(1, f"Error: sample not found: {sample}")
+
+    image_type = get_image_type(sample)
+    print(f"\nSampling {image_type} build: {sample}")
+
+    with tempfile.TemporaryDirectory(prefix='dbmenu-compression-') as tmp_dir:
+        sample_file = Path(tmp_dir) / 'sample'
+        sample_size = create_sample(sample, sample_file)
+        print(f"Sample: {format_bytes(sample_size)} uncompressed")
+
+        results = run_benchmark(sample_file, sample_size)
+
+    if not results:
+        utils.die(1, 'Error: no compressors installed (xz / zstd / gzip / lzop / lz4)')
+
+    recommended = recommend(results)
+
+    print(f"\nRecommended {image_type} profiles:\n")
+    for profile, compression in recommended.items():
+        print(f" {profile:<14} {compression}")
+
+    choice = utils.get_input(f"\nWrite profiles to {USER_CONFIG.dbmenu_config} [y/N]: ? ",
+                             accept_empty=True)
+
+    if choice.startswith('y') or choice.startswith('Y'):
+        write_profiles(image_type, recommended)
+        print('\nChoose a profile with compression_profile or dbmenu --profile NAME')
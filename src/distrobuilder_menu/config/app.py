@@ -77,12 +77,28 @@ def get_args(argv=None):
     group.add_argument("-u", "--update",
                        action="store_true",
                        help="force update templates (default auto weekly)")
+    group.add_argument("--daemon",
+                       action="store_true",
+                       help="run the dbmenu daemon (for dbmenu -q)")
+    group.add_argument("--watch",
+                       action="store_true",
+                       help="regenerate custom templates when their sources change")
+    group.add_argument("--gc",
+                       action="store_true",
+                       help="prune old build artifacts & stale imported images")
+    group.add_argument("--bench-compression", nargs='?', const='', default=None,
+                       metavar='SAMPLE',
+                       help="benchmark build output compression & recommend profiles")
+    group.add_argument("-q", "--query", nargs='+', metavar='CMD',
+                       help="query the dbmenu daemon (see README)")
     parser.add_argument("-s", "--show", default=False,
                         action="store_true",
                         help="show configuration settings")
     parser.add_argument("-t", "--timer", default=False,
                         action="store_true",
-                        help="debug timer used in testing")
+                        help="show a tree of timings when dbmenu exits")
+    parser.add_argument("--trace", default=None, metavar='FILE',
+                        help="write timings as Chrome trace events to FILE")
     parser.add_argument("--rate", default=False,
                         action="store_true",
                         help="show current Github API Rate Limit")
@@ -92,6 +108,12 @@ def get_args(argv=None):
     parser.add_argument("-r", "--regenerate", default=False,
                         action="store_true",
                         help="regenerate custom templates")
+    parser.add_argument("--profile", default=None, metavar='NAME',
+                        help="build with a compression profile e.g fast-dev")
+    parser.add_argument("--executor", default=None, metavar='NAME',
+                        help="build with this build executor e.g local")
+    parser.add_argument("--remote", default=None, metavar='NAME',
+                        help="only show image versions from this image remote")
     parser.add_argument("-v", "--version", default=False,
                         action="store_true",
                         help="show dbmenu version / update to latest release")
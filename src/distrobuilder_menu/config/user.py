@@ -1,11 +1,11 @@
 """ A singleton class to store global configuration for sharing between modules
 """
 # dataclasses requires python 3.7
-from dataclasses import dataclass
+from dataclasses import dataclass, field, MISSING
 from pathlib import Path
-from pprint import pprint
 # app modules
 from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
 # app classes
 from distrobuilder_menu.api.singleton import SingletonThreadSafe
 
@@ -22,13 +22,34 @@ class Settings(SingletonThreadSafe):
         """
         # fix pyint 'super-init-not-called'
         super().__init__()
+        self.load()
 
+
+    @classmethod
+    def reload(cls):
+        """ Used by the dbmenu daemon to reload the configuration when
+            ~/.config/dbmenu.yaml changes. The User Config is read into a new
+            instance which then replaces the singleton (so running builds never
+            see the default values while the file is read).
+
+        Returns:
+            Settings: the new instance
+        """
+        settings = cls()
+        cls.swap(settings)
+        return settings
+
+
+    @tracer.traced('load_settings')
+    def load(self):
+        """ Reads the User Config (see reload() for reloading the configuration)
+        """
         # set default values
         self.set_defaults()
 
         # override defaults with values from yaml
         if Path(self.dbmenu_config).is_file():
-            config = utils.read_config(self.dbmenu_config, False)
+            config = utils.read_config(self.dbmenu_config)
 
             if config:
                 # read a dict into class attributes
@@ -48,9 +69,12 @@ class Settings(SingletonThreadSafe):
         # disable for dynamically generated attributes
         # pylint: disable=no-member
 
-        # read dataclass into object
-        for name, field in self.Default.__dataclass_fields__.items():
-            setattr(self, name, field.default)
+        # read dataclass into object (mutable defaults use a default_factory)
+        for name, data_field in self.Default.__dataclass_fields__.items():
+            if data_field.default is MISSING:
+                setattr(self, name, data_field.default_factory())
+            else:
+                setattr(self, name, data_field.default)
 
 
     def setup_config(self):
@@ -71,6 +95,7 @@ class Settings(SingletonThreadSafe):
                 # display User Config settings
                 # accessing the __dict__ attribute is faster than vars()
                 # https://www.pythondoeswhat.com/2012/01/dict-and-vars.html
+                from pprint import pprint  # pylint: disable=import-outside-toplevel
                 print('')
                 pprint(self.__dict__)
                 print('')
@@ -103,15 +128,64 @@ class Settings(SingletonThreadSafe):
         gh_api_url: str = 'https://api.github.com'
         github_token: str = ''
 
+        # builds kept per image alias in the artifact store (see store.py)
+        artifact_keep: int = 3
+        # older builds are pruned (0 = no limit - the newest build is always kept)
+        artifact_max_days: int = 0
+        # keep distrobuilder downloads between builds (see buildcache.py)
         cache_dir: bool = False
+        build_cache_dir: str = f"{main_dir}/cache"
+        # least recently used entries are removed over this size (0 = no limit)
+        build_cache_max_mb: int = 20480
         cleanup: bool = True
         compression: str = 'xz'
+        # profile : image type : compression (see dbmenu --bench-compression)
+        compression_profiles: dict = field(default_factory=lambda: {
+            'fast-dev': {'container': 'zstd-1', 'virtual-machine': 'zstd-1'},
+            'small-release': {'container': 'xz-9', 'virtual-machine': 'xz-9'}
+            })
+        # active profile ('' uses compression / dbmenu --profile NAME overrides it)
+        compression_profile: str = ''
         console_editor: str = 'nano'
+        # menu lines per page (0 = no paging / -1 = fit the terminal)
+        menu_page_size: int = 0
         debug: bool = False
         disable_overlay: bool = False
         import_into_lxd: bool = True
+        lxd_socket: str = ''
+        queue_imports: bool = False
+        import_workers: int = 2
+        # seconds to wait for a lock held by another dbmenu (see locks.py)
+        lock_timeout: int = 300
+        # build in RAM when free memory exceeds tmpfs_size_multiple x the
+        # expected image size (see workspace.py)
+        tmpfs_workspace: bool = False
+        tmpfs_dir: str = '/dev/shm'
+        tmpfs_size_multiple: int = 8
+
+        # name : slots (& host / dir / ssh for build nodes - see executors.py)
+        build_executors: dict = field(default_factory=lambda: {
+            'local': {'slots': 1}
+            })
+        # round-robin || least-loaded (dbmenu --executor NAME overrides it)
+        build_placement: str = 'round-robin'
+        build_log_dir: str = f"{main_dir}/logs"
+        # node_exporter textfile collector e.g /var/lib/node_exporter/textfile/dbmenu.prom
+        metrics_file: str = ''
+        layered_builds: bool = False
+        layers_dir: str = f"{main_dir}/layers"
 
+        image_source: str = 'simplestreams'
+        # remote name : simplestreams url
+        image_remotes: dict = field(default_factory=lambda: {
+            'images': 'https://images.linuxcontainers.org'
+            })
         json_cachefile: str = f"{template_dir}/cache.json"
+        # resource : seconds before a background refresh (see refresh.py)
+        cache_ttl: dict = field(default_factory=lambda: {
+            'images': 604800,
+            'templates': 604800
+            })
         lxd_json: str = f"{template_dir}/lxd.json"
         lxd_output_type: str = 'unified'
         subdir_custom: str = f"{template_dir}/custom"
@@ -133,6 +207,9 @@ class Settings(SingletonThreadSafe):
             self.files_dir: str = f"{new_dir}/files"
             self.template_dir: str = f"{new_dir}/templates"
             self.cloudinit_dir: str = f"{new_dir}/cloudinit"
+            self.layers_dir: str = f"{new_dir}/layers"
+            self.build_log_dir: str = f"{new_dir}/logs"
+            self.build_cache_dir: str = f"{new_dir}/cache"
 
             # subdirs & files
             self.json_cachefile: str = f"{self.template_dir}/cache.json"
@@ -0,0 +1,464 @@
+""" A long running dbmenu daemon which keeps the User Config, the version cache
+    & the template / distribution indexes parsed in memory (each is reloaded when
+    it's file or directory changes) & answers queries / queues builds sent by the
+    thin client (see client.py) over a unix socket.
+
+    usage:
+            dbmenu --daemon                      (start the daemon)
+            dbmenu -q versions alpine            (query the daemon)
+            dbmenu -q build alpine 3.19 default  (queue a build)
+"""
+import json
+import os
+from pathlib import Path
+import queue
+import socketserver
+import threading
+import time
+# app modules
+from distrobuilder_menu import client
+from distrobuilder_menu import templates
+from distrobuilder_menu import utils
+from distrobuilder_menu.menus import helpers
+# app classes
+from distrobuilder_menu.api.singleton import SingletonThreadSafe
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+USER_CONFIG = Settings.lazy()
+
+# the version cache is checked for it's weekly update at most hourly
+VERSIONS_MAX_AGE = 3600
+
+STARTED = time.monotonic()
+
+
+class FileCache:
+    """ Caches data loaded from a file (or directory) until it's mtime / size changes
+
+        usage:
+                data = CACHE.get(file_path, utils.read_config)
+    """
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+
+    def get(self, file_path, loader, max_age=None):
+        """ Returns the cached data or calls loader(file_path) on a cache miss
+
+        Args:
+            file_path (str): file or directory path
+            loader (callable): loads the data from file_path
+            max_age (int, optional): seconds before reloading. Defaults to None.
+
+        Returns:
+            object: output of loader
+        """
+        file_path = str(file_path)
+
+        # stat before loading (so a file changed while loading is reloaded next time)
+        try:
+            stat = os.stat(file_path)
+            key = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            key = None
+
+        with self._lock:
+            entry = self.entries.get(file_path)
+
+            if entry and key and entry['key'] == key and \
+               (max_age is None or time.monotonic() - entry['loaded'] < max_age):
+                self.hits += 1
+                return entry['data']
+
+            self.misses += 1
+
+        data = loader(file_path)
+
+        with self._lock:
+            self.entries[file_path] = {'key': key, 'loaded': time.monotonic(), 'data': data}
+
+        return data
+
+
+    def stats(self):
+        """ Returns the cache hit / miss counters
+        """
+        with self._lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# shared by the request threads
+CACHE = FileCache()
+
+
+class BuildQueue(SingletonThreadSafe):
+    """ Singleton class running builds submitted to the daemon (one worker
+        thread per build slot of the build executors - see executors.py)
+
+        usage:
+                BuildQueue.instance().submit(build_options, template_path)
+    """
+    def __init__(self):
+
+        # fix pylint 'super-init-not-called'
+        super().__init__()
+
+        self.builds = queue.Queue()
+        self.jobs = []
+        self.workers = []
+        self._jobs_lock = threading.Lock()
+
+
+    def submit(self, build_options, template_path, executor_name=None):
+        """ Queues a build (optionally for one build executor)
+
+        Returns:
+            dict: the queued job
+        """
+        with self._jobs_lock:
+            job = {'id': len(self.jobs) + 1,
+                   'template': template_path,
+                   'release': build_options['release'],
+                   'variant': build_options['variant'],
+                   'type': build_options['type_top_level'],
+                   'executor': executor_name,
+                   'status': 'queued'}
+            self.jobs.append(job)
+
+            if not self.workers:
+                self.start_workers()
+
+        self.builds.put((job, build_options))
+        return dict(job)
+
+
+    def start_workers(self):
+        """ Starts a build worker per build slot (the executors hold the slots)
+        """
+        # pylint: disable=import-outside-toplevel
+        from distrobuilder_menu import executors
+
+        for _ in range(executors.get_worker_count()):
+            worker = threading.Thread(target=self.run_builds, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+
+    def run_builds(self):
+        """ Builds queued images until the daemon stops
+        """
+        # deferred import (builder imports the Incus API client & urllib3)
+        from distrobuilder_menu import builder  # pylint: disable=import-outside-toplevel
+
+        while True:
+            job, build_options = self.builds.get()
+            self.set_status(job, 'building')
+
+            try:
+                # build_image() changes build_options for custom templates
+                builder.build_image(dict(build_options), job['template'], assume_yes=True,
+                                    executor_name=job['executor'])
+                self.set_status(job, 'finished')
+            # utils.die() raises SystemExit which would silently stop the worker
+            except SystemExit as err:
+                self.set_status(job, 'failed', f"build failed (exit code: {err.code})")
+            # any other error would stop the worker & leave the job building
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                print(f"\nError building: {job['template']}: {err!r}")
+                self.set_status(job, 'failed', repr(err))
+            finally:
+                self.builds.task_done()
+
+
+    def set_status(self, job, status, error=None):
+        """ Updates the status (& error) of a job
+        """
+        with self._jobs_lock:
+            job['status'] = status
+
+            if error:
+                job['error'] = error
+
+
+    def get_jobs(self):
+        """ Returns a copy of the jobs
+        """
+        with self._jobs_lock:
+            return [dict(job) for job in self.jobs]
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ Reads a request as a line of JSON & writes the response as a line of JSON
+    """
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        # also invalid UTF-8
+        except ValueError:
+            request = {}
+
+        if not isinstance(request, dict):
+            request = {}
+
+        if request.get('command') == 'stop':
+            response = {'status': 'ok', 'data': 'stopping dbmenu daemon'}
+        else:
+            response = handle_request(request, queue_builds=True)
+
+        self.wfile.write(f"{json.dumps(response)}\n".encode('utf-8'))
+        self.wfile.flush()
+
+        if request.get('command') == 'stop':
+            # shutdown() waits for serve_forever() so call it from another thread
+            threading.Thread(target=self.server.shutdown).start()
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    """ Unix socket server handling each request in a thread
+    """
+    daemon_threads = True
+
+
+def check_config():
+    """ Reloads the User Config when ~/.config/dbmenu.yaml changes
+    """
+    # a missing config would start the interactive setup
+    if Path(USER_CONFIG.dbmenu_config).is_file():
+        CACHE.get(USER_CONFIG.dbmenu_config, lambda _: Settings.reload())
+
+
+def get_versions():
+    """ Returns the version cache (see load_json_cache())
+    """
+    return CACHE.get(USER_CONFIG.json_cachefile, lambda _: templates.load_json_cache(),
+                     max_age=VERSIONS_MAX_AGE
+                    )
+
+
+def get_template_index():
+    """ Indexes the standard & custom templates by name with their distribution &
+        os (parsing a template only when it changes - see find_os())
+
+    Returns:
+        dict: template name : dict with keys 'path' 'type' 'distribution' 'os'
+    """
+    index = {}
+    template_dirs = {'standard': USER_CONFIG.subdir_images, 'custom': USER_CONFIG.subdir_custom}
+    image_dict = {}
+
+    for template_type, template_dir in template_dirs.items():
+        # directory mtimes change when templates are added / removed
+        template_files = CACHE.get(template_dir, lambda path: utils.find_files('*.yaml', path))
+
+        for name, template_path in template_files.items():
+            distribution = CACHE.get(template_path, helpers.get_distribution)
+
+            if template_type == 'standard':
+                image_dict[name] = distribution
+
+            index[name] = {'path': template_path, 'type': template_type,
+                           'distribution': distribution}
+
+    for item in index.values():
+        # first standard template with the same distribution (like find_os())
+        item['os'] = next((key for key, value in image_dict.items()
+                           if value == item['distribution']), None)
+
+    return index
+
+
+def find_template(name):
+    """ Finds a template by name (or path) in the template index
+
+    Returns:
+        dict: see get_template_index() (or None)
+    """
+    index = get_template_index()
+
+    if name in index:
+        return index[name]
+
+    for item in index.values():
+        if item['path'] == name:
+            return item
+
+    return None
+
+
+def get_template_versions(template, remote=None):
+    """ Returns the versions which can be built from a template (like menu_versions())
+    """
+    return templates.select_versions(get_versions(), template['os'], remote)
+
+
+def cmd_ping(_args):
+    """ Returns the daemon status
+    """
+    return {'pid': os.getpid(), 'uptime': round(time.monotonic() - STARTED, 1),
+            'cache': CACHE.stats()}
+
+
+def cmd_config(_args):
+    """ Returns the User Config
+    """
+    # accessing the __dict__ attribute is faster than vars()
+    return dict(Settings.instance().__dict__)
+
+
+def cmd_templates(args):
+    """ Lists templates: [standard || custom]
+    """
+    index = get_template_index()
+
+    return [dict(item, name=name) for name, item in index.items()
+            if not args or item['type'] == args[0]]
+
+
+def cmd_versions(args):
+    """ Lists the versions of a template: TEMPLATE [REMOTE]
+    """
+    if not args:
+        raise ValueError('usage: versions TEMPLATE [REMOTE]')
+
+    template = find_template(args[0])
+
+    if not template:
+        raise ValueError(f"template not found: {args[0]}")
+
+    return get_template_versions(template, args[1] if len(args) > 1 else None)
+
+
+def cmd_build(args, queue_builds=False):
+    """ Builds a template: TEMPLATE RELEASE [VARIANT] [container || vm] [@EXECUTOR]
+        (queued in the daemon or built in process without a daemon)
+    """
+    # a trailing @NAME picks the build executor
+    executor_name = args.pop()[1:] if args and args[-1].startswith('@') else None
+
+    if len(args) < 2:
+        raise ValueError('usage: build TEMPLATE RELEASE [VARIANT] [container || vm] [@EXECUTOR]')
+
+    template = find_template(args[0])
+
+    if not template:
+        raise ValueError(f"template not found: {args[0]}")
+
+    variant = args[2] if len(args) > 2 else 'default'
+    image_type = 'virtual-machine' if args[3:] == ['vm'] else 'container'
+
+    for item in get_template_versions(template):
+        if (item['release'], item['variant'], item['type_top_level']) == \
+           (args[1], variant, image_type):
+            build_options = item
+            break
+    else:
+        raise ValueError(f"no {image_type} version found: {args[0]} {args[1]} {variant}")
+
+    if queue_builds:
+        return BuildQueue.instance().submit(build_options, template['path'], executor_name)
+
+    # deferred import (builder imports the Incus API client & urllib3)
+    from distrobuilder_menu import builder  # pylint: disable=import-outside-toplevel
+    builder.build_image(dict(build_options), template['path'], assume_yes=True,
+                        executor_name=executor_name)
+    return {'template': template['path'], 'status': 'finished'}
+
+
+def cmd_jobs(_args):
+    """ Lists builds queued in the daemon
+    """
+    return BuildQueue.instance().get_jobs()
+
+
+COMMANDS = {
+    'ping': cmd_ping,
+    'config': cmd_config,
+    'templates': cmd_templates,
+    'versions': cmd_versions,
+    'build': cmd_build,
+    'jobs': cmd_jobs,
+}
+
+
+def handle_request(request, queue_builds=False):
+    """ Runs a client request (in the daemon or in process without a daemon)
+
+    Args:
+        request (dict): keys 'command' & 'args'
+        queue_builds (bool, optional): queue builds in the daemon. Defaults to False.
+
+    Returns:
+        dict: keys 'status' & 'data' || 'error'
+    """
+    command = request.get('command')
+    args = [str(arg) for arg in request.get('args') or []]
+
+    if command == 'stop':
+        return {'status': 'error', 'error': 'dbmenu daemon is not running'}
+
+    if command not in COMMANDS:
+        return {'status': 'error',
+                'error': f"unknown command: {command} (commands: {' '.join(COMMANDS)} stop)"}
+
+    try:
+        check_config()
+
+        if command == 'build':
+            data = cmd_build(args, queue_builds)
+        else:
+            data = COMMANDS[command](args)
+    except ValueError as err:
+        return {'status': 'error', 'error': str(err)}
+    # utils.die() prints the error & raises SystemExit which would stop the daemon
+    except SystemExit:
+        return {'status': 'error', 'error': f"{command} failed (see the dbmenu output)"}
+    # clients always get a reply (other errors would drop the connection)
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        return {'status': 'error', 'error': f"{command} failed: {err!r}"}
+
+    return {'status': 'ok', 'data': data}
+
+
+def serve(socket_path=None):
+    """ Runs the daemon until it receives a 'stop' request (or Ctrl-C)
+
+    Args:
+        socket_path (str, optional): defaults to client.get_socket_path()
+    """
+    socket_path = socket_path or client.get_socket_path()
+
+    if Path(socket_path).is_socket():
+        try:
+            client.send_request({'command': 'ping', 'args': []}, socket_path)
+            utils.die(1, f"Error: dbmenu daemon is already running: {socket_path}")
+        except OSError:
+            # stale socket from a daemon which did not exit cleanly
+            Path(socket_path).unlink()
+
+    # warm the caches
+    check_config()
+    get_template_index()
+    get_versions()
+
+    # only the user running the daemon can connect
+    old_umask = os.umask(0o177)
+    try:
+        server = DaemonServer(socket_path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+
+    print(f"\ndbmenu daemon listening on: {socket_path}")
+
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            Path(socket_path).unlink(missing_ok=True)
+
+    print('\ndbmenu daemon stopped')
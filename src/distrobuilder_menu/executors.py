@@ -0,0 +1,432 @@
+""" Build executors running distrobuilder on this host || on build nodes over SSH
+
+    Executors are configured in build_executors in the User Config (entries
+    with a 'host' build over SSH):
+
+        build_executors:
+          local:
+            slots: 1
+          node1:
+            host: builder@node1
+            dir: /var/tmp/dbmenu
+            slots: 2
+        build_placement: round-robin
+
+    Each build holds one slot of an executor (a lock under main_dir/.locks so
+    builds started by other dbmenu instances on this host are counted) & is
+    placed on the executor chosen with 'dbmenu --executor NAME' (|| @NAME in a
+    daemon build query) or by build_placement:
+
+    * round-robin   - the next executor in turn with a free slot
+    * least-loaded  - the executor with the lowest share of busy slots
+
+    SSH builds sync files_dir & the template (with files_dir paths rewritten)
+    into their own build directory on the node (so concurrent builds never
+    share inputs), stream the distrobuilder output back into the build log,
+    fetch the artifacts into the local staging directory & are imported locally
+    (via the import queue - see importer.py). Layered builds, the download
+    cache & tmpfs workspaces only apply to local builds. Nodes need ssh key
+    logins, passwordless sudo for distrobuilder & tar (rsync is used when it is
+    installed on both hosts).
+
+    Interactive builds are shown for the executor chosen by choose_executor() &
+    only hold it's slot (waiting for it when busy) once the build is confirmed.
+
+    usage:
+            with executors.use_executor(name) as executor:
+                template, target_dir = executor.get_paths(template_path, staging_dir)
+                record = executor.run(build_cmd, image_alias, template_path, staging_dir)
+"""
+import contextlib
+import json
+from pathlib import Path
+import shlex
+import shutil
+import tempfile
+import time
+# app modules
+from distrobuilder_menu import buildlog
+from distrobuilder_menu import locks
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+# app classes
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+USER_CONFIG = Settings.lazy()
+
+# seconds between checks for a free build slot
+SLOT_RETRY_DELAY = 2.0
+
+# placement state (the next round-robin executor)
+STATE_FILE = 'executors.json'
+
+# defaults for SSH executors
+REMOTE_DIR = '/var/tmp/dbmenu'
+SSH_COMMAND = 'ssh -o BatchMode=yes'
+
+
+class LocalExecutor:
+    """ Runs distrobuilder on this host (the default)
+    """
+    local = True
+
+    def __init__(self, name, options):
+        """ Initialises the executor
+
+        Args:
+            name (str): executor name in build_executors
+            options (dict): executor settings (slots)
+        """
+        self.name = name
+        self.slots = max(int(options.get('slots', 1)), 1)
+
+
+    def __str__(self):
+        return f"{self.name} (this host)"
+
+
+    @property
+    def queue_imports(self):
+        """ Returns True if images are imported by the import queue (not distrobuilder)
+        """
+        return USER_CONFIG.queue_imports
+
+
+    def get_paths(self, template_path, staging_dir):
+        """ Returns the template & output directory for the distrobuilder command
+
+        Returns:
+            tuple: template path, target directory
+        """
+        return template_path, staging_dir
+
+
+    def run(self, build_cmd, image_alias, template_path, staging_dir):
+        """ Runs a distrobuilder command (see buildlog.run_build())
+
+        Args:
+            build_cmd (str): distrobuilder shell command
+            image_alias (str): used to name the log / timing files
+            template_path (str): absolute path to the template yaml
+            staging_dir (str): staging directory of the build
+
+        Returns:
+            dict: timing record for the build
+        """
+        # pylint: disable=unused-argument
+        record = buildlog.run_build(build_cmd, image_alias, USER_CONFIG.build_log_dir)
+        buildlog.update_record(record, 'executor', self.name)
+
+        return record
+
+
+class SSHExecutor(LocalExecutor):
+    """ Runs distrobuilder on a build node over SSH
+    """
+    local = False
+
+    def __init__(self, name, options):
+        """ Initialises the executor
+
+        Args:
+            name (str): executor name in build_executors
+            options (dict): host / dir / slots / ssh (the ssh command)
+        """
+        super().__init__(name, options)
+        self.host = options['host']
+        self.remote_dir = options.get('dir') or REMOTE_DIR
+        self.ssh = options.get('ssh') or SSH_COMMAND
+
+
+    def __str__(self):
+        return f"{self.name} ({self.host})"
+
+
+    @property
+    def queue_imports(self):
+        """ Images built on a node are always imported here by the import queue
+        """
+        return True
+
+
+    def get_build_dir(self, staging_dir):
+        """ Returns the directory of a build on the node (named like the staging directory)
+        """
+        return f"{self.remote_dir}/builds/{Path(staging_dir).name}"
+
+
+    def get_command(self, command):
+        """ Returns the shell command running command on the node
+        """
+        return f"{self.ssh} {self.host} {shlex.quote(command)}"
+
+
+    def check_command(self, command):
+        """ Runs a command on the node (exits on errors)
+        """
+        utils.check_command(self.get_command(command), exit_on_error=True)
+
+
+    def sync_files(self, remote_files):
+        """ Copies files_dir to a build directory on the node (rsync || a tar stream)
+        """
+        files_dir = Path(USER_CONFIG.files_dir)
+        self.check_command(f"mkdir -p {shlex.quote(remote_files)}")
+
+        if not files_dir.is_dir():
+            return
+
+        # rsync must be installed on the node
+        if shutil.which('rsync'):
+            rsync_cmd = f"rsync -a -e {shlex.quote(self.ssh)} {shlex.quote(f'{files_dir}/')} " \
+                        f"{shlex.quote(f'{self.host}:{remote_files}/')}"
+            if utils.check_command(rsync_cmd):
+                return
+
+        tar_cmd = f"tar -C {shlex.quote(remote_files)} -xf -"
+        utils.check_command(f"tar -C {shlex.quote(str(files_dir))} -cf - . | "
+                            f"{self.get_command(tar_cmd)}", exit_on_error=True)
+
+
+    def get_paths(self, template_path, staging_dir):
+        """ Returns the template & output directory on the node
+
+        Returns:
+            tuple: template path, target directory
+        """
+        build_dir = self.get_build_dir(staging_dir)
+
+        return f"{build_dir}/{Path(template_path).name}", f"{build_dir}/out"
+
+
+    @tracer.traced()
+    def sync_inputs(self, template_path, staging_dir):
+        """ Syncs the build inputs (files_dir & the template) to the node
+        """
+        build_dir = self.get_build_dir(staging_dir)
+        remote_template = self.get_paths(template_path, staging_dir)[0]
+        print(f"\nSyncing build inputs to: {self.host}:{build_dir}")
+
+        self.check_command(f"mkdir -p {shlex.quote(f'{build_dir}/out')}")
+        self.sync_files(f"{build_dir}/files")
+
+        # templates refer to files under files_dir (see menus/helpers.py)
+        template = Path(template_path).read_text(encoding='utf-8')
+        template = template.replace(USER_CONFIG.files_dir, f"{build_dir}/files")
+        copy_cmd = self.get_command(f"cat > {shlex.quote(remote_template)}")
+
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml', encoding='utf-8') as file:
+            file.write(template)
+            file.flush()
+            utils.check_command(f"{copy_cmd} < {shlex.quote(file.name)}", exit_on_error=True)
+
+
+    @tracer.traced()
+    def fetch_artifacts(self, staging_dir):
+        """ Copies the distrobuilder output from the node to the staging directory
+        """
+        build_dir = self.get_build_dir(staging_dir)
+        print(f"\nFetching artifacts from: {self.host}:{build_dir}/out")
+
+        tar_cmd = f"tar -C {shlex.quote(f'{build_dir}/out')} -cf - ."
+        utils.check_command(f"{self.get_command(tar_cmd)} | "
+                            f"tar -C {shlex.quote(str(staging_dir))} -xf -", exit_on_error=True)
+
+
+    def run(self, build_cmd, image_alias, template_path, staging_dir):
+        """ Syncs the build inputs, runs a distrobuilder command on the node
+            streaming it's output back & fetches the artifacts (the build
+            directory on the node is removed)
+
+        Returns:
+            dict: timing record for the build
+        """
+        try:
+            self.sync_inputs(template_path, staging_dir)
+            record = buildlog.run_build(self.get_command(build_cmd), image_alias,
+                                        USER_CONFIG.build_log_dir)
+            self.fetch_artifacts(staging_dir)
+        finally:
+            # distrobuilder output is owned by root
+            build_dir = shlex.quote(self.get_build_dir(staging_dir))
+            utils.check_command(self.get_command(f"sudo rm -rf {build_dir}"))
+
+        buildlog.update_record(record, 'executor', self.name)
+        return record
+
+
+def get_executors(name=None):
+    """ Returns the configured executors (in build_executors order)
+
+    Args:
+        name (str, optional): only return this executor. Defaults to None.
+
+    Returns:
+        dict: name : LocalExecutor || SSHExecutor
+    """
+    executors = {}
+
+    for executor_name, options in (USER_CONFIG.build_executors or {'local': {}}).items():
+        options = options or {}
+        executor_class = SSHExecutor if options.get('host') else LocalExecutor
+        executors[executor_name] = executor_class(executor_name, options)
+
+    if not name:
+        return executors
+
+    if name not in executors:
+        utils.die(1, f"Error: unknown build executor: {name} "
+                     f"(executors: {' '.join(executors)})")
+
+    return {name: executors[name]}
+
+
+def get_worker_count():
+    """ Returns the total build slots (the number of daemon build workers)
+    """
+    return sum(executor.slots for executor in get_executors().values())
+
+
+def get_slot_locks(executor):
+    """ Returns the lock names of an executor's build slots
+    """
+    return [f"executor-{executor.name}-{slot}" for slot in range(1, executor.slots + 1)]
+
+
+def get_busy_slots(executor):
+    """ Counts the slots of an executor held by running builds (on this host)
+    """
+    busy = 0
+
+    for lock_name in get_slot_locks(executor):
+        if locks.try_acquire(lock_name, writer=True):
+            locks.release(lock_name)
+        else:
+            busy += 1
+
+    return busy
+
+
+def try_slot(executor):
+    """ Acquires a free build slot of an executor (never waits)
+
+    Returns:
+        str: slot lock name (or None when every slot is busy)
+    """
+    for lock_name in get_slot_locks(executor):
+        if locks.try_acquire(lock_name, writer=True):
+            return lock_name
+
+    return None
+
+
+def read_state():
+    """ Returns the placement state (see STATE_FILE)
+    """
+    state_file = Path(USER_CONFIG.main_dir) / STATE_FILE
+
+    if not state_file.is_file():
+        return {}
+
+    return utils.read_config(state_file) or {}
+
+
+def get_candidates(executors):
+    """ Orders the executors by build_placement
+
+    Returns:
+        list: executors to try in turn
+    """
+    executors = list(executors.values())
+
+    if USER_CONFIG.build_placement == 'least-loaded':
+        # ties keep the build_executors order
+        return sorted(executors, key=lambda executor: get_busy_slots(executor) / executor.slots)
+
+    if USER_CONFIG.build_placement != 'round-robin':
+        utils.die(1, f"Error: unknown build_placement: {USER_CONFIG.build_placement} "
+                     f"(round-robin || least-loaded)")
+
+    start = read_state().get('next', 0) % len(executors)
+    return executors[start:] + executors[:start]
+
+
+def write_state(executor):
+    """ Makes the executor after executor the next round-robin executor
+        (executors chosen by name also count as their turn)
+    """
+    names = list(get_executors())
+
+    if len(names) > 1:
+        utils.write_file_atomic(Path(USER_CONFIG.main_dir) / STATE_FILE,
+                                json.dumps({'next': names.index(executor.name) + 1}))
+
+
+def reserve_slot(executors):
+    """ Chooses an executor with a free build slot (by build_placement)
+
+    Returns:
+        tuple: executor (or None when every slot is busy), slot lock name
+    """
+    with locks.exclusive('executors'):
+        for executor in get_candidates(executors):
+            lock_name = try_slot(executor)
+
+            if not lock_name:
+                continue
+
+            if USER_CONFIG.build_placement == 'round-robin':
+                write_state(executor)
+
+            return executor, lock_name
+
+    return None, None
+
+
+def choose_executor(name=None):
+    """ Returns the executor build_placement chooses now without holding a
+        slot (the first executor in turn with a free slot || the first in turn)
+
+    Args:
+        name (str, optional): executor name. Defaults to None (build_placement).
+
+    Returns:
+        LocalExecutor || SSHExecutor: see use_executor()
+    """
+    candidates = get_candidates(get_executors(name))
+
+    for executor in candidates:
+        if get_busy_slots(executor) < executor.slots:
+            return executor
+
+    return candidates[0]
+
+
+@contextlib.contextmanager
+def use_executor(name=None):
+    """ Holds a build slot of an executor for one build
+
+    Args:
+        name (str, optional): executor name. Defaults to None (build_placement).
+
+    Yields:
+        LocalExecutor || SSHExecutor: the executor of the build
+    """
+    executors = get_executors(name)
+    executor, lock_name = reserve_slot(executors)
+
+    if not executor:
+        print(f"\nWaiting for a free build slot on: {' '.join(executors)} ...")
+
+        with tracer.span('executor_wait'):
+            while not executor:
+                time.sleep(SLOT_RETRY_DELAY)
+                executor, lock_name = reserve_slot(executors)
+
+    print(f"\nBuild executor: {executor} slot {lock_name.rsplit('-', 1)[1]}/{executor.slots}")
+
+    try:
+        yield executor
+    finally:
+        locks.release(lock_name)
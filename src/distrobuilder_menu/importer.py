@@ -0,0 +1,204 @@
+""" A post build import stage which imports finished images into Incus / LXD
+    in background threads (so the next build can start while images import)
+"""
+import atexit
+import hashlib
+from pathlib import Path
+import queue
+import threading
+import time
+# app modules
+from distrobuilder_menu import utils
+# app classes
+from distrobuilder_menu.api.incus import Incus
+from distrobuilder_menu.api.singleton import SingletonThreadSafe
+from distrobuilder_menu.config.user import Settings
+
+
+class ImportQueue(SingletonThreadSafe):
+    """ Singleton class holding the import queue & it's worker threads.
+
+        usage:
+                ImportQueue.instance().submit(image_alias, artifacts)
+    """
+    def __init__(self):
+
+        # fix pylint 'super-init-not-called'
+        super().__init__()
+
+        # read user settings (Settings is also a singleton)
+        self.user_config = Settings.instance()
+        self.incus = Incus.instance()
+
+        self.jobs = queue.Queue()
+        self.results = []
+        self.workers = []
+        self._results_lock = threading.Lock()
+
+        # wait for queued imports when dbmenu exits
+        atexit.register(self.wait)
+
+
+    def start_workers(self):
+        """ Starts the worker threads on the first submitted import
+        """
+        for _ in range(max(1, int(self.user_config.import_workers))):
+            worker = threading.Thread(target=self.worker, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+
+    def submit(self, image_alias, artifacts):
+        """ Queues the published artifacts of a build for import
+
+        Args:
+            image_alias (str): see get_build_options() for it's format
+            artifacts (dict): see output of publish_artifacts()
+        """
+        if not self.workers:
+            self.start_workers()
+
+        print(f"\nQueued import of: {image_alias} ({self.jobs.qsize() + 1} queued)")
+        self.jobs.put((image_alias, artifacts))
+
+
+    def worker(self):
+        """ Imports queued images until dbmenu exits
+        """
+        while True:
+            image_alias, artifacts = self.jobs.get()
+
+            # task_done() must always be called or wait() blocks dbmenu at exit
+            try:
+                self.run_job(image_alias, artifacts)
+            finally:
+                self.jobs.task_done()
+
+
+    def run_job(self, image_alias, artifacts):
+        """ Imports a single queued image & records the result (failures are
+            recorded instead of stopping the worker)
+        """
+        start_time = time.perf_counter()
+        size = 0
+
+        try:
+            size = sum(Path(file_path).stat().st_size for file_path in artifacts.values())
+
+            if self.incus.check_socket():
+                self.import_api(image_alias, artifacts)
+            else:
+                self.import_cli(image_alias, artifacts)
+            status = 'imported'
+        # utils.die() raises SystemExit which would silently stop the worker
+        except SystemExit:
+            status = 'failed'
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            print(f"\nError importing: {image_alias}: {err!r}")
+            status = 'failed'
+
+        seconds = time.perf_counter() - start_time
+        result = {'alias': image_alias, 'status': status, 'bytes': size, 'seconds': seconds}
+
+        with self._results_lock:
+            self.results.append(result)
+
+        print(f"\n==> {status}: {image_alias} {format_throughput(size, seconds)}")
+
+
+    def import_api(self, image_alias, artifacts):
+        """ Imports an image via the Incus API then moves the alias from any
+            existing image & deletes it (like check_lxd_image())
+        """
+        fingerprint = get_fingerprint(artifacts)
+        old_fingerprint = self.incus.get_alias(image_alias)
+
+        if old_fingerprint == fingerprint:
+            print(f"\nImage already imported: {image_alias}")
+            return
+
+        if not self.incus.get_image(fingerprint):
+            if 'image' in artifacts:
+                self.incus.import_image(None, image_path=artifacts['image'])
+            else:
+                rootfs_path = artifacts.get('rootfs') or artifacts['disk']
+                self.incus.import_image(None, meta_path=artifacts['meta'],
+                                        rootfs_path=rootfs_path
+                                       )
+
+        if old_fingerprint:
+            self.incus.update_alias(image_alias, fingerprint)
+            self.incus.delete_image(old_fingerprint)
+            print(f"\nReplaced image: {image_alias} {old_fingerprint[:12]} => {fingerprint[:12]}")
+        else:
+            self.incus.create_alias(image_alias, fingerprint)
+
+
+    def import_cli(self, image_alias, artifacts):
+        """ Fallback for import_api() when the API socket is not accessible
+        """
+        lxd_binary = utils.get_lxd_binary()
+
+        if utils.check_command(f"sudo {lxd_binary} image get-property {image_alias} os"):
+            utils.check_command(f"sudo {lxd_binary} image delete {image_alias}",
+                                exit_on_error=True
+                               )
+
+        # unified tarball || metadata & rootfs
+        if 'image' in artifacts:
+            file_paths = artifacts['image']
+        else:
+            file_paths = f"{artifacts['meta']} {artifacts.get('rootfs') or artifacts['disk']}"
+
+        utils.check_command(f"sudo {lxd_binary} image import {file_paths} --alias {image_alias}",
+                            exit_on_error=True
+                           )
+
+
+    def wait(self):
+        """ Waits for queued imports to finish & prints the import throughput
+        """
+        if not self.workers:
+            return
+
+        if self.jobs.unfinished_tasks:
+            print(f"\nWaiting for {self.jobs.unfinished_tasks} queued image import(s) ...")
+
+        self.jobs.join()
+
+        with self._results_lock:
+            results = list(self.results)
+
+        if results:
+            print('\nImage import throughput:\n')
+            for result in results:
+                print(f" {result['alias']:<40} {result['status']:<9} "
+                      f"{format_throughput(result['bytes'], result['seconds'])}")
+            print('')
+
+
+def get_fingerprint(artifacts):
+    """ Calculates the Incus image fingerprint (sha256 of the unified tarball
+        or of the metadata & rootfs of split images)
+    """
+    sha256 = hashlib.sha256()
+
+    if 'image' in artifacts:
+        file_paths = [artifacts['image']]
+    else:
+        file_paths = [artifacts['meta'], artifacts.get('rootfs') or artifacts['disk']]
+
+    for file_path in file_paths:
+        with open(file_path, 'rb') as file:
+            while chunk := file.read(1048576):
+                sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def format_throughput(size, seconds):
+    """ Formats bytes transferred / seconds as a string
+    """
+    megabytes = size / 1048576
+    rate = megabytes / seconds if seconds else 0
+    return f"{megabytes:.1f} MiB in {seconds:.1f}s ({rate:.1f} MiB/s)"
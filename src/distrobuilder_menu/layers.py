@@ -0,0 +1,471 @@
+""" Functions for layered builds of custom templates.
+
+    A base rootfs is built once per standard template / release / variant with
+    'distrobuilder build-dir' & kept under Settings.layers_dir. Custom templates
+    are then built from a copy-on-write copy of the base rootfs with
+    'distrobuilder pack-incus || pack-lxc' which only applies the override delta
+    (files / cloud-init / post-files actions & any extra packages).
+
+    Each base layer has a 'layer-<name>' lock: it is built || removed under the
+    exclusive lock & snapshotted under the shared lock so concurrent builds
+    (daemon workers) never rebuild a layer another build is copying. Each
+    layered build has it's own work directory under layers_dir/work.
+"""
+import contextlib
+from datetime import datetime
+import os
+from pathlib import Path
+import subprocess
+# app modules
+from distrobuilder_menu import buildlog
+from distrobuilder_menu import locks
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+# app classes
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes shares config between modules
+USER_CONFIG = Settings.lazy()
+
+# commands used to install the package delta inside the layered rootfs
+PACKAGE_INSTALL = {
+    'apk': 'apk add --no-cache',
+    'apt': 'apt-get update && DEBIAN_FRONTEND=noninteractive apt-get install -y',
+    'dnf': 'dnf install -y',
+    'yum': 'yum install -y',
+    'zypper': 'zypper --non-interactive install',
+    'pacman': 'pacman -Sy --noconfirm --needed',
+    'xbps': 'xbps-install -Sy',
+    'opkg': 'opkg update && opkg install',
+}
+
+# actions run before 'post-files' are baked into the base layer
+BASE_TRIGGERS = ('post-unpack', 'post-update', 'post-packages')
+
+
+def find_standard_template(template_path):
+    """ Follows the dbmenu footers of a custom template back to the standard
+        template it was generated from ('custom' templates may be generated
+        from 'base' templates which are generated from 'standard' templates)
+
+    Args:
+        template_path (str): path to a custom template
+
+    Returns:
+        str: path to the standard template (or None without a dbmenu footer)
+    """
+    footer_data = utils.find_regex(template_path, '#dbmenu.*$', substring='#dbmenu',
+                                   json_dict=True
+                                  )
+    if not footer_data:
+        return None
+
+    source = footer_data['source']
+
+    if footer_data['type'] == 'base':
+        return source
+
+    # guard against footers pointing to the template itself
+    if source == template_path or not Path(source).is_file():
+        return None
+
+    return find_standard_template(source)
+
+
+def get_checksum(file_path):
+    """ Returns the sha256 of a file used to detect changed standard templates
+    """
+    # deferred import (layers is imported by templates at startup)
+    import hashlib  # pylint: disable=import-outside-toplevel
+
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def get_layer_dir(build_options, standard_template):
+    """ Constructs the path of a base layer
+
+    Args:
+        build_options (dict): see output of menu_versions()
+        standard_template (str): path to the standard template
+
+    Returns:
+        Path: e.g ~/distrobuilder/layers/alpine-3.19-default
+    """
+    layer_name = (
+        f"{Path(standard_template).stem}-{build_options['release']}-{build_options['variant']}"
+    )
+    return Path(USER_CONFIG.layers_dir) / layer_name
+
+
+def get_layer_lock(layer_dir):
+    """ Returns the lock name of a base layer
+    """
+    return f"layer-{Path(layer_dir).name}"
+
+
+def check_layer(layer_dir, standard_template):
+    """ Checks a base layer exists & was built from the current standard template
+
+    Returns:
+        boolean: True if the layer can be reused
+    """
+    meta_file = Path(f"{layer_dir}.json")
+
+    if not layer_dir.is_dir() or not meta_file.is_file():
+        return False
+
+    layer_data = utils.read_config(meta_file)
+    return layer_data['checksum'] == get_checksum(standard_template)
+
+
+def check_btrfs(dir_path):
+    """ Checks if a path is on a btrfs filesystem (which supports subvolume snapshots)
+    """
+    cmd = ['stat', '-f', '-c', '%T', str(dir_path)]
+    output = subprocess.run(cmd, text=True, capture_output=True, check=False)
+    return output.stdout.strip() == 'btrfs'
+
+
+def get_packages(template_data, build_options, action='install'):
+    """ Returns the package names in a template applicable to a build
+
+    Args:
+        template_data (dict): template YAML data
+        build_options (dict): see output of menu_versions()
+        action (str): package set action (install || remove)
+
+    Returns:
+        set: package names
+    """
+    package_set = set()
+    packages = template_data.get('packages') or {}
+
+    # package set filters
+    filters = {'releases': build_options['release'],
+               'variants': build_options['variant'],
+               'architectures': build_options['arch'],
+               'types': 'container'}
+
+    for item in packages.get('sets') or []:
+        if item.get('action', 'install') != action:
+            continue
+
+        if any(key in item and value not in item[key] for key, value in filters.items()):
+            continue
+
+        package_set.update(item.get('packages') or [])
+
+    return package_set
+
+
+def get_actions(template_data):
+    """ Returns the actions run before 'post-files' (which pack-* does not run)
+    """
+    actions = set()
+
+    for item in template_data.get('actions') or []:
+        if item.get('trigger') in BASE_TRIGGERS:
+            actions.add((item['trigger'], item.get('action', '')))
+
+    return actions
+
+
+def get_base_data(template_data):
+    """ Returns the template YAML without the package sets & actions (any other
+        difference e.g packages.repositories / files / environment changes the base)
+    """
+    base_data = {key: value for key, value in template_data.items() if key != 'actions'}
+    base_data['packages'] = {key: value for key, value in
+                             (template_data.get('packages') or {}).items() if key != 'sets'}
+    return base_data
+
+
+def get_changed_keys(standard_data, custom_data):
+    """ Returns the top level keys of the base data which differ between templates
+    """
+    standard_base = get_base_data(standard_data)
+    custom_base = get_base_data(custom_data)
+
+    return sorted(key for key in standard_base.keys() | custom_base.keys()
+                  if standard_base.get(key) != custom_base.get(key))
+
+
+def get_layer_delta(standard_template, template_path, build_options):
+    """ Compares a custom template with its standard template to find the delta
+        not applied by pack-incus || pack-lxc
+
+    Returns:
+        set: extra packages to install (or None if a layered build is not possible)
+    """
+    standard_data = utils.read_config(standard_template)
+    custom_data = utils.read_config(template_path)
+    changed_keys = get_changed_keys(standard_data, custom_data)
+
+    if changed_keys:
+        print(f"\nINFO: layered build not possible: override changes: {', '.join(changed_keys)}")
+        return None
+
+    if get_packages(custom_data, build_options, 'remove') != \
+       get_packages(standard_data, build_options, 'remove'):
+        print('\nINFO: layered build not possible: override removes packages')
+        return None
+
+    if get_actions(custom_data) != get_actions(standard_data):
+        print('\nINFO: layered build not possible: override changes pre post-files actions')
+        return None
+
+    delta = get_packages(custom_data, build_options) - get_packages(standard_data, build_options)
+    manager = (custom_data.get('packages') or {}).get('manager')
+
+    if delta and manager not in PACKAGE_INSTALL:
+        print(f"\nINFO: layered build not possible: unsupported package manager: {manager}")
+        return None
+
+    return delta
+
+
+def write_delta_template(template_path, delta_template, packages):
+    """ Copies a custom template & prepends a 'post-files' action to install
+        the package delta inside the layered rootfs
+    """
+    utils.copy_dirs_or_files(template_path, delta_template)
+
+    if not packages:
+        return
+
+    manager = utils.read_config(template_path)['packages']['manager']
+    install_cmd = f"{PACKAGE_INSTALL[manager]} {' '.join(sorted(packages))}"
+    action = f"#!/bin/sh\nset -eux\n{install_cmd}\n"
+
+    # strenv() avoids quoting the action inside the yq expression
+    add_cmd = ("yq -i '.actions = [{\"trigger\": \"post-files\", \"action\": strenv(ACTION)}]"
+               f" + (.actions // [])' {delta_template}")
+    try:
+        subprocess.run(add_cmd, shell=True, check=True, env=dict(os.environ, ACTION=action))
+    except subprocess.CalledProcessError:
+        utils.die(1, f"Error: writing layered build template: {delta_template}")
+
+    print(f"Layered build installs packages: {' '.join(sorted(packages))}")
+
+
+@tracer.traced()
+def build_layer(build_options, standard_template, layer_dir, cache_dir=None):
+    """ Builds a base rootfs from a standard template with 'distrobuilder build-dir'
+        (as a btrfs subvolume when possible so it can be snapshotted)
+    """
+    if layer_dir.exists():
+        delete_layer(layer_dir)
+
+    layer_dir.parent.mkdir(parents=True, exist_ok=True)
+
+    if check_btrfs(layer_dir.parent):
+        utils.check_command(f"sudo btrfs subvolume create {layer_dir}", exit_on_error=True)
+
+    build_cmd_list = ['sudo distrobuilder build-dir', standard_template, str(layer_dir),
+                      f"-o image.release={build_options['release']}",
+                      f"-o image.variant={build_options['variant']}"]
+
+    # managed download cache (see buildcache.py)
+    if cache_dir:
+        build_cmd_list.extend([f"--cache-dir={cache_dir}", '--cleanup=false'])
+
+    if USER_CONFIG.timeout:
+        build_cmd_list.append(f"--timeout={USER_CONFIG.timeout}")
+
+    build_cmd = " ".join(build_cmd_list)
+    print(f"\nBuilding base layer: {layer_dir.name}\n\ncmd = {build_cmd}\n")
+
+    try:
+        buildlog.run_build(build_cmd, f"layer-{layer_dir.name}", USER_CONFIG.build_log_dir)
+    except subprocess.CalledProcessError:
+        delete_layer(layer_dir)
+        utils.die(1, f"\nError from distrobuilder: building base layer: {layer_dir.name}")
+
+    layer_data = {'source': standard_template,
+                  'checksum': get_checksum(standard_template),
+                  'release': build_options['release'],
+                  'variant': build_options['variant'],
+                  'created': datetime.now().isoformat(timespec='seconds')}
+    utils.write_config(f"{layer_dir}.json", layer_data, data_type='json')
+
+
+def check_snapshot(layer_dir, workspace):
+    """ Checks if a base layer can be snapshotted into a workspace (both on the
+        same btrfs filesystem - a tmpfs workspace || other disk needs a copy)
+    """
+    # a subvolume has it's own st_dev so the layers directory is compared
+    try:
+        same_device = layer_dir.parent.stat().st_dev == workspace.parent.stat().st_dev
+    except OSError:
+        return False
+
+    return same_device and check_btrfs(workspace.parent)
+
+
+def snapshot_layer(layer_dir, workspace):
+    """ Creates a copy-on-write copy of a base layer (btrfs snapshot or reflink copy
+        which falls back to a normal copy on filesystems without reflinks)
+    """
+    if workspace.exists():
+        delete_layer(workspace)
+
+    workspace.parent.mkdir(parents=True, exist_ok=True)
+
+    if check_snapshot(layer_dir, workspace):
+        cmd = f"sudo btrfs subvolume snapshot {layer_dir} {workspace}"
+    else:
+        cmd = f"sudo cp -a --reflink=auto {layer_dir} {workspace}"
+
+    with tracer.span('snapshot_layer', layer=layer_dir.name):
+        utils.check_command(cmd, exit_on_error=True)
+
+
+def delete_layer(layer_dir):
+    """ Removes a base layer or workspace (rootfs files are owned by root)
+    """
+    if check_btrfs(layer_dir) and \
+       utils.check_command(f"sudo btrfs subvolume show {layer_dir}"):
+        cmd = f"sudo btrfs subvolume delete {layer_dir}"
+    else:
+        cmd = f"sudo rm -rf {layer_dir}"
+
+    utils.check_command(cmd, exit_on_error=True)
+    Path(f"{layer_dir}.json").unlink(missing_ok=True)
+
+
+def invalidate_layers(changed_templates):
+    """ Removes base layers built from standard templates that have changed
+        called by update_templates() after downloading templates
+
+    Args:
+        changed_templates (list): paths of downloaded standard templates
+    """
+    layers_dir = Path(USER_CONFIG.layers_dir)
+
+    if not layers_dir.is_dir():
+        return
+
+    changed_templates = [str(template) for template in changed_templates]
+
+    for meta_file in layers_dir.glob('*.json'):
+        layer_data = utils.read_config(meta_file)
+
+        if layer_data['source'] in changed_templates:
+            print(f"\nRemoving stale base layer: {meta_file.stem}")
+
+            # waits for builds snapshotting the layer
+            with locks.exclusive(get_layer_lock(meta_file.stem)):
+                delete_layer(layers_dir / meta_file.stem)
+
+
+@tracer.traced()
+def prepare_layered_build(build_options, template_path):
+    """ Checks if a custom template can be built from a base layer & returns
+        the paths used by create_layered_build()
+
+    Args:
+        build_options (dict): see output of menu_versions()
+        template_path (str): path to the custom template
+
+    Returns:
+        dict: keys 'standard' / 'layer' / 'delta' / 'workspace' / 'template'
+              (or None for a full build)
+    """
+    # vm images are packed from a full build
+    if USER_CONFIG.subdir_custom not in template_path or \
+       build_options['type_top_level'] == 'virtual-machine':
+        return None
+
+    standard_template = find_standard_template(template_path)
+
+    if not standard_template or not Path(standard_template).is_file():
+        print(f"\nINFO: layered build not possible: no standard template for: {template_path}")
+        return None
+
+    delta = get_layer_delta(standard_template, template_path, build_options)
+
+    if delta is None:
+        return None
+
+    # deferred import (layers is imported by templates at startup)
+    import tempfile  # pylint: disable=import-outside-toplevel
+
+    # each build has it's own work directory for the workspace & delta template
+    # (named after the custom template / release / variant)
+    work_name = (
+        f"{Path(template_path).stem}-{build_options['release']}-{build_options['variant']}"
+    )
+    work_root = Path(USER_CONFIG.layers_dir) / 'work'
+
+    try:
+        work_root.mkdir(parents=True, exist_ok=True)
+        work_dir = Path(tempfile.mkdtemp(prefix=f"{work_name}-", dir=work_root))
+    # cross platform & also catches permission errors
+    except OSError as err:
+        return utils.die(1, f"Error: {err.strerror} : {work_root}")
+
+    layered_build = {}
+    layered_build['source'] = template_path
+    layered_build['standard'] = standard_template
+    layered_build['layer'] = get_layer_dir(build_options, standard_template)
+    layered_build['delta'] = delta
+    layered_build['work_dir'] = str(work_dir)
+    layered_build['workspace'] = str(work_dir / 'rootfs')
+    layered_build['template'] = str(work_dir / f"{work_name}.yaml")
+
+    return layered_build
+
+
+def create_layered_build(layered_build, build_options, cache_dir=None):
+    """ Creates the workspace for a layered build (building the base layer
+        first if it is missing or stale)
+
+    Args:
+        layered_build (dict): see output of prepare_layered_build()
+        build_options (dict): see output of menu_versions()
+        cache_dir (str, optional): see buildcache.get_cache_dir(). Defaults to None.
+    """
+    layer_dir = layered_build['layer']
+    lock_name = get_layer_lock(layer_dir)
+    workspace = Path(layered_build['workspace'])
+
+    # up to date layers are snapshotted by concurrent builds at the same time
+    with locks.shared(lock_name):
+        reuse = check_layer(layer_dir, layered_build['standard'])
+
+        if reuse:
+            print(f"Reusing base layer: {layer_dir.name}")
+            snapshot_layer(layer_dir, workspace)
+
+    if not reuse:
+        # shared locks are never upgraded (another build may have built it meanwhile)
+        with locks.exclusive(lock_name):
+            if check_layer(layer_dir, layered_build['standard']):
+                print(f"Reusing base layer: {layer_dir.name}")
+            else:
+                build_layer(build_options, layered_build['standard'], layer_dir, cache_dir)
+
+            snapshot_layer(layer_dir, workspace)
+
+    # the build reads the delta template (not the custom template)
+    with locks.shared(locks.template_lock(layered_build['source'])):
+        write_delta_template(layered_build['source'], layered_build['template'],
+                             layered_build['delta']
+                            )
+
+
+def cleanup_layered_build(layered_build):
+    """ Removes the workspace, delta template & work directory after a
+        layered build (|| a cancelled build)
+    """
+    workspace = Path(layered_build['workspace'])
+
+    if workspace.exists():
+        delete_layer(workspace)
+
+    Path(layered_build['template']).unlink(missing_ok=True)
+
+    # the work directory is empty (the workspace may be on tmpfs - see workspace.py)
+    with contextlib.suppress(OSError):
+        Path(layered_build['work_dir']).rmdir()
@@ -0,0 +1,257 @@
+""" Inter-process advisory locks (fcntl.flock) so concurrent dbmenu instances
+    (e.g a cron 'dbmenu -u' during an interactive build) never rewrite a file
+    another instance is reading or writing.
+
+    Each resource has a lock file under main_dir/.locks allowing shared
+    readers & one exclusive writer:
+
+    * versions        - the LXD image listing (lxd.json) & the version cache
+    * images          - the standard templates in subdir_images
+    * custom-<name>   - a custom template (see template_lock())
+    * build           - publishing artifacts to the build output directory
+    * layer-<name>    - building || removing (& snapshotting) a base layer
+    * metrics         - merging & rewriting the metrics textfile
+    * staging-<name>  - a staging directory (held by it's build - see store.py)
+    * workspace       - choosing & reserving tmpfs build workspaces
+
+    Locks are reentrant within a thread (a held exclusive lock also satisfies
+    shared requests but a held shared lock is never upgraded - flock upgrades
+    are not atomic & two upgrading readers deadlock - so writers take the
+    exclusive lock up front) & each thread has it's own lock file descriptors so
+    threads exclude each other like processes. Waits are limited by
+    lock_timeout in the User Config & are timed as lock_wait tracer spans.
+
+    usage:
+            with locks.shared('versions'):
+                data = utils.read_config(USER_CONFIG.json_cachefile)
+"""
+import contextlib
+import fcntl
+import os
+from pathlib import Path
+import threading
+import time
+# app modules
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+# app classes
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+USER_CONFIG = Settings.lazy()
+
+# seconds between lock attempts (doubled up to the maximum while waiting)
+RETRY_DELAY = 0.05
+MAX_RETRY_DELAY = 1.0
+
+# each thread holds: lock name : [file descriptor, writer, count]
+LOCAL = threading.local()
+
+
+def template_lock(template_path):
+    """ Returns the lock name of a template (standard templates share one lock)
+    """
+    if Path(template_path).parent == Path(USER_CONFIG.subdir_images):
+        return 'images'
+
+    return f"custom-{Path(template_path).stem}"
+
+
+def get_held():
+    """ Returns the locks held by the current thread
+    """
+    if not hasattr(LOCAL, 'held'):
+        LOCAL.held = {}
+
+    return LOCAL.held
+
+
+def get_lock_file(name):
+    """ Returns the lock file path of a resource
+    """
+    return Path(USER_CONFIG.main_dir) / '.locks' / f"{name}.lock"
+
+
+def open_lock_file(name):
+    """ Opens (or creates) the lock file of a resource
+
+    Returns:
+        int: file descriptor
+    """
+    lock_file = get_lock_file(name)
+
+    try:
+        lock_file.parent.mkdir(parents=True, exist_ok=True)
+        return os.open(lock_file, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    # cross platform & also catches permission errors
+    except OSError as err:
+        return utils.die(1, f"Error: {err.strerror} : {lock_file}")
+
+
+def flock(fd, name, writer, timeout):
+    """ Locks fd waiting at most timeout seconds (exits on timeout)
+    """
+    operation = fcntl.LOCK_EX if writer else fcntl.LOCK_SH
+
+    try:
+        fcntl.flock(fd, operation | fcntl.LOCK_NB)
+        return
+    except BlockingIOError:
+        pass
+
+    mode = 'exclusive' if writer else 'shared'
+    reported = False
+
+    with tracer.span('lock_wait', lock=name, mode=mode):
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        delay = RETRY_DELAY
+
+        while True:
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    break
+
+            # short waits (e.g threads writing the metrics file) are not reported
+            if not reported and time.monotonic() - start_time >= MAX_RETRY_DELAY:
+                print(f"\nWaiting for the {name} lock ({mode}) held by another dbmenu ...")
+                reported = True
+
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    utils.die(1, f"Error: timed out after {timeout} seconds waiting for the {name} lock")
+
+
+def acquire(name, writer=False, timeout=None):
+    """ Acquires (or re-enters) a lock for the current thread
+
+    Args:
+        name (str): resource name
+        writer (bool, optional): exclusive lock. Defaults to False.
+        timeout (int, optional): seconds to wait. Defaults to lock_timeout.
+    """
+    held = get_held()
+    entry = held.get(name)
+
+    if entry and (entry[1] or not writer):
+        entry[2] += 1
+        return
+
+    if entry:
+        utils.die(1, f"Error: the {name} lock is held shared & can not be upgraded "
+                     '(take the exclusive lock first)')
+
+    if timeout is None:
+        timeout = USER_CONFIG.lock_timeout
+
+    fd = open_lock_file(name)
+
+    try:
+        flock(fd, name, writer, timeout)
+    except SystemExit:
+        os.close(fd)
+        raise
+
+    held[name] = [fd, writer, 1]
+
+
+def try_acquire(name, writer=False):
+    """ Acquires a lock only if no other dbmenu holds it (never waits)
+
+    Returns:
+        bool: True if the lock was acquired (release it with release())
+    """
+    held = get_held()
+    entry = held.get(name)
+
+    if entry and (entry[1] or not writer):
+        entry[2] += 1
+        return True
+
+    if entry:
+        return False
+
+    fd = open_lock_file(name)
+
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_EX if writer else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+
+    held[name] = [fd, writer, 1]
+    return True
+
+
+def release(name):
+    """ Releases a lock of the current thread (unlocked on the last release)
+    """
+    held = get_held()
+    entry = held[name]
+    entry[2] -= 1
+
+    if entry[2] == 0:
+        del held[name]
+        # closing the descriptor also releases the flock
+        os.close(entry[0])
+
+
+def discard(name):
+    """ Removes the lock file of a resource that no longer exists & releases
+        it's exclusive lock (a dbmenu still waiting on the old file finds the
+        resource gone)
+    """
+    get_lock_file(name).unlink(missing_ok=True)
+    release(name)
+
+
+@contextlib.contextmanager
+def lock(name, writer=False, timeout=None):
+    """ Context manager holding a shared || exclusive lock
+    """
+    acquire(name, writer, timeout)
+    try:
+        yield
+    finally:
+        release(name)
+
+
+@contextlib.contextmanager
+def template_copy(source, destination):
+    """ Holds the locks to read a source template & rewrite a destination
+        template (a single exclusive lock when both share one as shared locks are
+        never upgraded). Locks are taken in name order so two copies in opposite
+        directions can not deadlock.
+
+    Args:
+        source (str): path of the template being read
+        destination (str): path of the template being written
+    """
+    source_lock = template_lock(source)
+    destination_lock = template_lock(destination)
+
+    if source_lock == destination_lock:
+        with exclusive(destination_lock):
+            yield
+        return
+
+    with contextlib.ExitStack() as stack:
+        for name in sorted((source_lock, destination_lock)):
+            stack.enter_context(lock(name, writer=name == destination_lock))
+        yield
+
+
+def shared(name, timeout=None):
+    """ Returns a context manager holding a shared (reader) lock
+    """
+    return lock(name, writer=False, timeout=timeout)
+
+
+def exclusive(name, timeout=None):
+    """ Returns a context manager holding an exclusive (writer) lock
+    """
+    return lock(name, writer=True, timeout=timeout)
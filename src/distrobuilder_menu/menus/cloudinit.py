@@ -3,6 +3,7 @@
 from pathlib import Path
 # app modules
 from distrobuilder_menu.menus import shared
+from distrobuilder_menu import locks
 from distrobuilder_menu import utils
 # app classes
 from distrobuilder_menu.menus.menuclass import Menu
@@ -10,7 +11,7 @@ from distrobuilder_menu.config.user import Settings
 
 # globals
 # singleton class shares user config between modules
-USER_CONFIG = Settings.instance()
+USER_CONFIG = Settings.lazy()
 
 def merge_cloudinit(src_template=None, edit=True, update_footer=True):
     """ Merges a cloud-init yaml template into a custom template via
@@ -50,16 +51,19 @@ def merge_cloudinit(src_template=None, edit=True, update_footer=True):
                              accept_empty=True, default='Y'
                             )
     if choice.startswith('y') or choice.startswith('Y'):
-        utils.yaml_add_content(src_file=src_template, node='files', search_key='name',
-                               search_value=node_section, merge_file=cloudinit_file,
-                               new_key='content'
-                              )
-        # tidy up template
-        utils.format_template(src_template)
-
-        # optionally update dbmenu footer (during ad hoc cloudinit config merges)
-        if update_footer:
-            utils.update_footer(src_template, 'cloudinit', cloudinit_file, subkey=node_section)
+        # sole writer of the template (not held while editing)
+        with locks.exclusive(locks.template_lock(src_template)):
+            utils.yaml_add_content(src_file=src_template, node='files', search_key='name',
+                                   search_value=node_section, merge_file=cloudinit_file,
+                                   new_key='content'
+                                  )
+            # tidy up template
+            utils.format_template(src_template)
+
+            # optionally update dbmenu footer (during ad hoc cloudinit config merges)
+            if update_footer:
+                utils.update_footer(src_template, 'cloudinit', cloudinit_file,
+                                    subkey=node_section)
 
         # optionally edit
         if edit:
@@ -2,7 +2,7 @@
 """
 from pathlib import Path
 # app modules
-from distrobuilder_menu import builder
+from distrobuilder_menu import locks
 from distrobuilder_menu import templates
 from distrobuilder_menu import utils
 from distrobuilder_menu.menus import cloudinit
@@ -10,15 +10,15 @@ from distrobuilder_menu.menus import helpers
 from distrobuilder_menu.menus import shared
 # app classes
 from distrobuilder_menu.menus.menuclass import Menu
+from distrobuilder_menu.api import tracer
 from distrobuilder_menu.config.app import AppConfig
 from distrobuilder_menu.config.user import Settings
 
 # singleton classes share config between modules
-USER_CONFIG = Settings.instance()
+USER_CONFIG = Settings.lazy()
 
 # read command line
-ARGS = AppConfig.instance().get()
-DEBUG_TIMER = utils.Timer(ARGS.timer)
+ARGS = AppConfig.lazy()
 
 # main event loop
 def menu_default():
@@ -75,25 +75,38 @@ def menu_versions(template, version_list, template_path):
         Returns: [for the chosen option]
         dict: 'arch_top_level' 'type_top_level' 'os' 'type' 'arch' 'release' 'variant'
     """
-    DEBUG_TIMER.start()
+    menu, os_list = get_versions_menu(template, version_list, template_path)
+    choice_index = menu.get_choice()
+
+    # return to main event loop
+    if choice_index == 'user_quit':
+        return choice_index
+
+    # dictionary with build options
+    return os_list[choice_index]
+
+
+@tracer.traced('menu_versions')
+def get_versions_menu(template, version_list, template_path):
+    """ Generates the version menu of menu_versions() (timed without waiting for input)
 
-    # initialize multiple lists
-    os_list, menu_list = [], []
+        Returns:
+        tuple: (Menu, list of version dicts in menu order)
+    """
+    menu_list = []
     real_os = helpers.find_os(template_path)
 
-    # filter versions by os choice & virtualization
+    # filter versions by os choice & virtualization (optionally by image remote)
     # version_list is slimmed down JSON data with only the info we need
-    for item in version_list:
+    os_list = templates.select_versions(version_list, real_os, ARGS.remote)
+    show_remote = len(USER_CONFIG.image_remotes) > 1 and not ARGS.remote
 
-        if item['os'] == real_os:
-            # vm's are LXD only
-            if ARGS.lxc and item['type_top_level'] == 'virtual-machine':
-                pass
-            else:
-                os_list.append(item)
-                menu_list.append(
-                    f"{real_os} {item['release']} {item['variant']} {item['type_top_level']}"
-                    )
+    for item in os_list:
+        menu_line = f"{real_os} {item['release']} {item['variant']} {item['type_top_level']}"
+        # tag entries when versions are merged from multiple remotes
+        if show_remote:
+            menu_line = f"{menu_line} ({item.get('remote', 'images')})"
+        menu_list.append(menu_line)
 
     # sanity checks
     if len(menu_list) == 0:
@@ -119,15 +132,8 @@ def menu_versions(template, version_list, template_path):
     # generate menu (see menus.py)
     # get_choice() returns a list index here
     menu = Menu(title, question, menu_list)
-    DEBUG_TIMER.stop()
-    choice_index = menu.get_choice()
 
-    # return to main event loop
-    if choice_index == 'user_quit':
-        return choice_index
-
-    # dictionary with build options
-    return os_list[choice_index]
+    return menu, os_list
 
 
 def menu_override():
@@ -432,7 +438,8 @@ def generate_custom_template():
     if choice.startswith('y') or choice.startswith('Y'):
         try:
             # yq_check = True checks for a golang version of yq
-            utils.yaml_merge(USER_CONFIG.yq_check, dest_custom, *merge_files)
+            with locks.template_copy(src_template, dest_custom):
+                utils.yaml_merge(USER_CONFIG.yq_check, dest_custom, *merge_files)
 
         # cross platform & also catches permission errors
         except (OSError, IOError) as err:
@@ -450,13 +457,15 @@ def generate_custom_template():
                                                        )
         else:
             # tidy up template
-            utils.format_template(dest_custom)
+            with locks.exclusive(locks.template_lock(dest_custom)):
+                utils.format_template(dest_custom)
 
         footer_data = create_footer_data(src_template, override_template, custom_template,
                        dest_custom, cloudinit_file)
 
         # add data for regenerating custom templates
-        utils.add_custom_footer(dest_custom, footer_data)
+        with locks.exclusive(locks.template_lock(dest_custom)):
+            utils.add_custom_footer(dest_custom, footer_data)
 
         # optionally edit template
         question = 'Edit new custom template [Y/n]: ? '
@@ -596,4 +605,6 @@ def menu_build():
         return
 
     # run distrobuilder
+    # deferred import (builder imports the Incus API client & urllib3)
+    from distrobuilder_menu import builder  # pylint: disable=import-outside-toplevel
     builder.build_image(build_options, template_path)
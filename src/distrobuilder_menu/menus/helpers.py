@@ -8,7 +8,7 @@ from distrobuilder_menu.config.user import Settings
 
 # globals
 # singleton class shares user config between modules
-USER_CONFIG = Settings.instance()
+USER_CONFIG = Settings.lazy()
 
 def find_os(template):
     """ loops through the image_dict & returns the os_name (key) of the template (value)
@@ -47,7 +47,7 @@ def get_distribution(template):
     """ Convenience function used by build_image() find_os() get_image_dict()
         Returns the inner distribution name from template YAML
     """
-    data = utils.read_config(template, False)
+    data = utils.read_config(template)
     return data['image']['distribution']
 
 
@@ -1,15 +1,29 @@
 """ A simple class to generate console menus
 """
+import shutil
+import sys
+# app modules
+from distrobuilder_menu import refresh
 from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+# app classes
+from distrobuilder_menu.config.user import Settings
 
-class Menu:
+# lines kept free for the title / page footer / prompt when paging automatically
+PAGE_MARGIN = 6
+
+class Menu:  # pylint: disable=too-many-instance-attributes
     """A class that accepts lists & dictionaries as data sources to display
        a console menu & validate integer user input.
 
        * For list data the real index of the choice is returned.
        * For dict data a dict is returned with the choice in 2 keys 'key' / 'value'
+
+       Text input filters the menu (every word must match a line as a substring
+       or failing that as a fuzzy subsequence e.g 'noble cloud vm') & a single
+       match is chosen straight away. Long menus are paged with '>' / '<'.
     """
-    def __init__(self, title, question, data, display=None):
+    def __init__(self, title, question, data, display=None, page_size=None):
         """ Initialises the Menu class with positional args:
 
             * title, question, data, [ display ]
@@ -17,62 +31,92 @@ class Menu:
 
             the optional arg for 'display' can be 'keys' / 'values' or 'both'
             to specifiy their values to show from the data dictionary.
+
+            the optional arg for 'page_size' defaults to menu_page_size in the
+            User Config (0 disables paging / -1 fits the terminal height)
         """
         self.title = title
         self.question = question
         self.data = data
         self.display = display
 
-        # this menu processes integer choices only
-        self.question_regex = '[0-9]+'
+        # numbers choose a menu line (any other text filters the menu)
+        self.question_regex = '.*'
         self.choice = None
 
+        if page_size is None:
+            page_size = Settings.instance().menu_page_size
+
+        if page_size < 0:
+            page_size = max(shutil.get_terminal_size().lines - PAGE_MARGIN, 1)
+
+        self.page_size = page_size
+
+        # menu line text & it's lowercase search index (built once per menu)
+        if isinstance(self.data, dict):
+            self.lines = self.menu_from_dict(self.data, self.display)
+        else:
+            self.lines = self.menu_from_list(self.data)
+
+        self.search_index = [line.lower() for line in self.lines]
+
         # sometimes the choice line is a single item
         if len(self.data) > 1:
-            self.choice_line = f"{self.question} [ 1 - {len(self.data)} ] : "
+            self.choice_line = f"{self.question} [ 1 - {len(self.data)} / filter ] : "
         else:
             self.choice_line = f"{self.question} [ 1 ] : "
 
 
     def get_choice(self):
-        """ Displays the console menu via instance methods:
+        """ Displays the console menu & reuses get_input() from the utils class.
 
-        * menu_from_list (overrides)
-        * menu_from_dict (templates)
-
-        & reuses get_input() from the utils class
+            Empty input quits (or clears an active filter).
         """
         data_type = type(self.data)
-        print(f"\n{self.title}\n")
-
-        # print menu lines
-        if data_type is list:
-            self.menu_from_list(self.data)
+        # indexes of the lines shown (all lines || the filter matches)
+        shown = list(range(len(self.lines)))
+        query = ''
+        page = 0
 
-        # print menu lines (optionally keys / values or both)
-        if data_type is dict:
-            self.menu_from_dict(self.data, self.display)
-
-        # formatting
-        print('')
-
-        # validate integer input (quit on empty input)
         while True:
-            try:
-                self.choice = utils.get_input(self.choice_line, self.question_regex,
-                                              accept_empty=True, convert=int
-                                              )
-                if self.choice < 1 or self.choice > len(self.data):
-                    # restart the loop
+            self.render(shown, page, query)
+
+            answer = utils.get_input(self.choice_line, self.question_regex,
+                                     accept_empty=True, default='')
+            if not answer:
+                if query:
+                    shown, query, page = list(range(len(self.lines))), '', 0
                     continue
-                break
-            except ValueError:
                 if data_type is dict:
                     # functions passing data here as a dict expect a dict response
                     return {'key': 'user_quit', 'value': 'user_quit'}
                 # functions passing a list don't access an index immediately
                 return 'user_quit'
 
+            if answer in ('>', '<'):
+                last_page = max(len(shown) - 1, 0) // self.page_size if self.page_size else 0
+                page = min(page + 1, last_page) if answer == '>' else max(page - 1, 0)
+                continue
+
+            # numbers are the original line numbers (also when filtered)
+            if answer.isdigit():
+                if 1 <= int(answer) <= len(self.data):
+                    self.choice = int(answer)
+                    break
+                continue
+
+            matches = self.filter_lines(answer)
+
+            if len(matches) == 1:
+                self.choice = matches[0] + 1
+                break
+
+            if not matches:
+                print(f"\nNo match for: {answer}")
+                continue
+
+            shown, query, page = matches, answer, 0
+
         # convert dict to list to find the key by index
         if data_type is dict:
             index_dict = list(self.data)
@@ -89,47 +133,101 @@ class Menu:
         return 'unhandled data_type in menus.get_choice()'
 
 
+    def filter_lines(self, query):
+        """ Matches the words of query against the search index. A word matches
+            a line as a substring or failing that as a subsequence (fuzzy) &
+            only the lines with the fewest fuzzy matched words are returned.
+
+        Returns:
+            list: indexes of the matching lines
+        """
+        words = query.lower().split()
+        # number of fuzzy matched words : line indexes
+        matches = {}
+
+        for index, text in enumerate(self.search_index):
+            fuzzy = 0
+            for word in words:
+                if word in text:
+                    continue
+                if is_subsequence(word, text):
+                    fuzzy += 1
+                    continue
+                break
+            else:
+                matches.setdefault(fuzzy, []).append(index)
+
+        return matches[min(matches)] if matches else []
+
+
+    def render(self, shown, page, query):
+        """ Writes the title & a page of the numbered menu lines with a
+            single buffered write (fewer round trips on slow terminals)
+        """
+        max_spacer = len(str(len(self.lines)))
+
+        if self.page_size:
+            start = page * self.page_size
+            page_lines = shown[start:start + self.page_size]
+        else:
+            page_lines = shown
+
+        # time printing the menu (not waiting for input)
+        with tracer.span('menu_display', lines=len(page_lines)):
+            # notices of background refreshes which finished since the last menu
+            output = [f"\n{notice}" for notice in refresh.take_notices()]
+            output.append(f"\n{self.title}\n")
+
+            if query:
+                output.append(f"Filter: {query} ({len(shown)} of {len(self.lines)})\n")
+
+            for index in page_lines:
+                line_num = index + 1
+                space_length = max_spacer - len(str(line_num))
+                output.append(f"{space_length*' '} {line_num} : {self.lines[index]}")
+
+            if self.page_size and len(shown) > self.page_size:
+                pages = (len(shown) - 1) // self.page_size + 1
+                output.append(f"\nPage {page + 1} / {pages} ( '>' next / '<' previous )")
+
+            # formatting
+            sys.stdout.write('\n'.join(output) + '\n\n')
+            sys.stdout.flush()
+
+
     def menu_from_dict(self, line_dict, display_types):
-        """ Instance method to print numbered menu lines from a dictionary
+        """ Instance method returning the menu lines from a dictionary
             with the option to show keys / values or both.
 
             Used by all menu functions except menu_versions().
         """
-        line_num = 1
-        max_spacer = len(str(len(line_dict)))
-
         # match / case requires python 3.10+
         # Debian Stable (Bookworm) is on 3.11 so use new features
         match display_types:
             case 'both':
-                for key, value in line_dict.items():
-                    space_length = max_spacer - len(str(line_num))
-                    print(f"{space_length*' '} {line_num} : {key} {value}")
-                    line_num += 1
+                return [f"{key} {value}" for key, value in line_dict.items()]
             case 'keys':
-                for key in line_dict:
-                    space_length = max_spacer - len(str(line_num))
-                    print(f"{space_length*' '} {line_num} : {key}")
-                    line_num += 1
+                return [str(key) for key in line_dict]
             case 'values':
-                for key in line_dict:
-                    space_length = max_spacer - len(str(line_num))
-                    print(f"{space_length*' '} {line_num} : {line_dict[key]}")
-                    line_num += 1
+                return [str(value) for value in line_dict.values()]
             case _:
                 utils.die(1, 'Param Error: Menu class "display" != keys || values || both')
 
+        # pylint inconsistent-return-statements (PEP8)
+        return []
+
 
     def menu_from_list(self, lines):
-        """Simple instance method to loop through a list
-           & print menu lines with numbers.
+        """ Simple instance method returning the menu lines of a list.
 
-           Used by menu_versions() whose data is a list.
+            Used by menu_versions() whose data is a list.
         """
-        line_num = 1
-        max_spacer = len(str(len(lines)))
+        return [str(item) for item in lines]
 
-        for item in lines:
-            space_length = max_spacer - len(str(line_num))
-            print(f"{space_length*' '} {line_num} : {item}")
-            line_num += 1
+
+def is_subsequence(word, text):
+    """ Returns True when the characters of word appear in text in order
+        (e.g 'vm' in 'virtual-machine')
+    """
+    chars = iter(text)
+    return all(char in chars for char in word)
@@ -4,16 +4,16 @@
 from distrobuilder_menu.config.app import AppConfig
 from distrobuilder_menu.config.user import Settings
 from distrobuilder_menu.menus.menuclass import Menu
+from distrobuilder_menu.api import tracer
 # app modules
 from distrobuilder_menu.menus import helpers
 from distrobuilder_menu import templates
 from distrobuilder_menu import utils
 
 # singleton classes shares config between modules
-USER_CONFIG = Settings.instance()
+USER_CONFIG = Settings.lazy()
 # read command line
-ARGS = AppConfig.instance().get()
-DEBUG_TIMER = utils.Timer(ARGS.timer)
+ARGS = AppConfig.lazy()
 
 def select_src_template(title, custom_question):
     """ Returns the source template os name
@@ -78,9 +78,22 @@ def menu_templates(template_dict, template_dir, action, custom_question=None):
     """ Displays the 2nd menu with distribution template / override choices.
         NB: Menu class accepts lists & dicts as data
     """
-    # speedtest
-    DEBUG_TIMER.start()
+    menu = get_templates_menu(template_dict, template_dir, action, custom_question)
 
+    # display menu: get_choice() returns a dict with 2 x keys of key / value
+    choice_dict = menu.get_choice()
+
+    os_name = choice_dict['key']
+    template_path = choice_dict['value']
+
+    # return multiple values (tuple)
+    return os_name, template_path
+
+
+@tracer.traced('menu_templates')
+def get_templates_menu(template_dict, template_dir, action, custom_question=None):
+    """ Generates the template menu of menu_templates() (timed without waiting for input)
+    """
     # sanity checks
     if len(template_dict) == 0:
 
@@ -122,14 +135,4 @@ def menu_templates(template_dict, template_dir, action, custom_question=None):
     # generate menu (see menus.py)
     menu = Menu(title, question, template_dict, 'keys')
 
-    # speedtest
-    DEBUG_TIMER.stop(newline=True)
-
-    # display menu: get_choice() returns a dict with 2 x keys of key / value
-    choice_dict = menu.get_choice()
-
-    os_name = choice_dict['key']
-    template_path = choice_dict['value']
-
-    # return multiple values (tuple)
-    return os_name, template_path
+    return menu
@@ -0,0 +1,360 @@
+""" Writes dbmenu metrics in the Prometheus text format for the node_exporter
+    textfile collector (set metrics_file in the User Config to enable).
+
+    The file is rewritten atomically after each build / template sync /
+    regeneration & also holds the metrics of earlier runs & other dbmenu
+    processes: it is read back under the 'metrics' lock before each write &
+    only the gauges set / counter increments of this process since it's last
+    write are merged in (so each image alias keeps it's last build metrics &
+    concurrent processes never overwrite each other's counts).
+
+    usage:
+            metrics.record_build(image_alias, seconds, artifacts)
+"""
+import atexit
+import os
+from pathlib import Path
+import re
+import threading
+import time
+# app modules
+from distrobuilder_menu import locks
+from distrobuilder_menu import utils
+# app classes
+from distrobuilder_menu.api.singleton import SingletonThreadSafe
+from distrobuilder_menu.config.user import Settings
+
+# metric name : (type, help) - written in this order
+METRICS = {
+    'dbmenu_build_duration_seconds':
+        ('gauge', 'Duration of the last build of an image alias'),
+    'dbmenu_build_artifact_bytes':
+        ('gauge', 'Size of the published artifacts of the last build of an image alias'),
+    'dbmenu_build_success':
+        ('gauge', '1 if the last build of an image alias succeeded'),
+    'dbmenu_build_timestamp_seconds':
+        ('gauge', 'Unix time the last build of an image alias finished'),
+    'dbmenu_builds_total':
+        ('counter', 'Builds finished by dbmenu'),
+    'dbmenu_template_sync_downloads':
+        ('gauge', 'Templates downloaded by the last template sync'),
+    'dbmenu_template_sync_bytes':
+        ('gauge', 'Bytes downloaded by the last template sync'),
+    'dbmenu_template_sync_timestamp_seconds':
+        ('gauge', 'Unix time of the last template sync'),
+    'dbmenu_template_downloads_total':
+        ('counter', 'Templates downloaded by dbmenu'),
+    'dbmenu_template_download_bytes_total':
+        ('counter', 'Template bytes downloaded by dbmenu'),
+    'dbmenu_github_rate_limit_remaining':
+        ('gauge', 'Github API requests remaining in the current rate limit window'),
+    'dbmenu_github_rate_limit':
+        ('gauge', 'Github API requests allowed per rate limit window'),
+    'dbmenu_github_rate_limit_reset_timestamp_seconds':
+        ('gauge', 'Unix time the Github API rate limit window resets'),
+    'dbmenu_regenerated_templates':
+        ('gauge', 'Templates regenerated by the last regeneration'),
+    'dbmenu_regeneration_duration_seconds':
+        ('gauge', 'Duration of the last template regeneration'),
+    'dbmenu_regenerations_total':
+        ('counter', 'Template regenerations run by dbmenu'),
+    'dbmenu_build_cache_unchanged_files_total':
+        ('counter', 'Build download cache files left unchanged by builds'),
+    'dbmenu_build_cache_changed_files_total':
+        ('counter', 'Files downloaded or changed in the build download cache'),
+    'dbmenu_build_cache_unchanged_bytes_total':
+        ('counter', 'Bytes of build download cache files left unchanged by builds'),
+    'dbmenu_build_cache_changed_bytes_total':
+        ('counter', 'Bytes downloaded or changed in the build download cache'),
+    # the age is time() - timestamp (an age gauge would stop ageing between writes)
+    'dbmenu_cache_updated_timestamp_seconds':
+        ('gauge', 'Unix time a dbmenu cache file was last updated'),
+}
+
+# e.g: dbmenu_build_success{alias="alpine-3.19"} 1
+SAMPLE_LINE = re.compile(r'^(\w+)(?:\{(.*)\})?\s+(\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+class Metrics(SingletonThreadSafe):
+    """ Singleton class holding the metric samples & writing the textfile
+
+        usage:
+                Metrics.instance().set('dbmenu_build_success', 1, alias=image_alias)
+                Metrics.instance().write()
+    """
+    def __init__(self):
+
+        # fix pylint 'super-init-not-called'
+        super().__init__()
+
+        # read user settings (Settings is also a singleton)
+        self.user_config = Settings.instance()
+        self.metrics_file = self.user_config.metrics_file
+
+        # metric name : {labels tuple : value} (as last written)
+        self.samples = {name: {} for name in METRICS}
+        # changes since the last write: (metric name, labels tuple) : value
+        self.gauges = {}
+        self.counters = {}
+        self.write_scheduled = False
+        self._samples_lock = threading.Lock()
+
+
+    def load(self):
+        """ Reads back the samples written by earlier runs / other processes
+            (unknown metrics are dropped)
+        """
+        self.samples = {name: {} for name in METRICS}
+
+        try:
+            lines = Path(self.metrics_file).read_text(encoding='utf-8').splitlines()
+        except OSError:
+            return
+
+        for line in lines:
+            match = SAMPLE_LINE.match(line)
+
+            if not match or match.group(1) not in self.samples:
+                continue
+
+            labels = tuple((key, unescape(value))
+                           for key, value in LABEL.findall(match.group(2) or ''))
+            try:
+                self.samples[match.group(1)][labels] = float(match.group(3))
+            except ValueError:
+                continue
+
+
+    def set(self, name, value, **labels):
+        """ Sets the value of a gauge
+        """
+        with self._samples_lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+    def inc(self, name, value=1, **labels):
+        """ Increments a counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._samples_lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def merge(self):
+        """ Applies the gauges / counter increments since the last write to the
+            samples read back by load()
+        """
+        with self._samples_lock:
+            for (name, labels), value in self.gauges.items():
+                self.samples[name][labels] = value
+
+            for (name, labels), value in self.counters.items():
+                self.samples[name][labels] = self.samples[name].get(labels, 0) + value
+
+            self.gauges.clear()
+            self.counters.clear()
+
+
+    def set_cache_timestamps(self):
+        """ Sets the update time of the version cache & the LXD image listing
+        """
+        cache_files = {'versions': self.user_config.json_cachefile,
+                       'images': self.user_config.lxd_json}
+
+        for cache, file_path in cache_files.items():
+            try:
+                mtime = os.stat(file_path).st_mtime
+            except OSError:
+                continue
+
+            self.set('dbmenu_cache_updated_timestamp_seconds', round(mtime, 3), cache=cache)
+
+
+    def format(self):
+        """ Formats the samples in the Prometheus text format
+
+        Returns:
+            str: textfile content
+        """
+        lines = []
+
+        with self._samples_lock:
+            for name, (metric_type, help_text) in METRICS.items():
+                if not self.samples[name]:
+                    continue
+
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+                for labels, value in sorted(self.samples[name].items()):
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+    def write(self):
+        """ Atomically rewrites the textfile merging this process's changes into
+            the file on disk (a write error only prints a warning as metrics are
+            never worth failing a build for)
+        """
+        if not self.metrics_file:
+            return
+
+        self.set_cache_timestamps()
+
+        # other dbmenu processes re-read & rewrite the file under the same lock
+        with locks.exclusive('metrics'):
+            self.load()
+            self.merge()
+
+            try:
+                utils.write_file_atomic(self.metrics_file, self.format())
+            except OSError as err:
+                print(f"WARN: could not write metrics to: {self.metrics_file} => {err.strerror}")
+
+
+    def write_later(self):
+        """ Defers writing until the next record_*() write or dbmenu exits
+            (used for values updated on every API call)
+        """
+        with self._samples_lock:
+            if self.write_scheduled:
+                return
+            self.write_scheduled = True
+
+        atexit.register(self.write)
+
+
+def format_labels(labels):
+    """ Formats a labels tuple e.g {alias="alpine-3.19"}
+    """
+    if not labels:
+        return ''
+
+    pairs = ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+    return f"{{{pairs}}}"
+
+
+def format_value(value):
+    """ Formats a sample value (whole numbers without a decimal point)
+    """
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+def escape(value):
+    """ Escapes a label value (backslash / double quote / newline)
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def unescape(value):
+    """ Reverses escape()
+    """
+    return re.sub(r'\\(.)', lambda match: '\n' if match.group(1) == 'n' else match.group(1),
+                  value)
+
+
+def enabled():
+    """ Returns True when metrics_file is set in the User Config
+        (checked before creating the Metrics singleton)
+    """
+    return bool(Settings.instance().metrics_file)
+
+
+def record_build(image_alias, seconds, artifacts=None):
+    """ Records a finished build (artifacts is None for failed builds)
+
+    Args:
+        image_alias (str): see get_build_options() for it's format
+        seconds (float): build duration
+        artifacts (dict, optional): see output of publish_artifacts(). Defaults to None.
+    """
+    if not enabled():
+        return
+
+    metrics = Metrics.instance()
+    status = 'success' if artifacts is not None else 'failed'
+
+    metrics.set('dbmenu_build_duration_seconds', round(seconds, 3), alias=image_alias)
+    metrics.set('dbmenu_build_success', int(status == 'success'), alias=image_alias)
+    metrics.set('dbmenu_build_timestamp_seconds', round(time.time(), 3), alias=image_alias)
+    metrics.inc('dbmenu_builds_total', status=status)
+
+    if artifacts:
+        size = sum(Path(file_path).stat().st_size for file_path in artifacts.values())
+        metrics.set('dbmenu_build_artifact_bytes', size, alias=image_alias)
+
+    metrics.write()
+
+
+def record_sync(downloads, size):
+    """ Records a template sync (number of downloaded templates & their bytes)
+    """
+    if not enabled():
+        return
+
+    metrics = Metrics.instance()
+
+    metrics.set('dbmenu_template_sync_downloads', downloads)
+    metrics.set('dbmenu_template_sync_bytes', size)
+    metrics.set('dbmenu_template_sync_timestamp_seconds', round(time.time(), 3))
+    metrics.inc('dbmenu_template_downloads_total', downloads)
+    metrics.inc('dbmenu_template_download_bytes_total', size)
+    metrics.write()
+
+
+def record_rate_limit(headers):
+    """ Records the Github API rate limit from the X-RateLimit-* response headers
+    """
+    if not enabled() or 'X-RateLimit-Remaining' not in headers:
+        return
+
+    metrics = Metrics.instance()
+    header_metrics = {'X-RateLimit-Remaining': 'dbmenu_github_rate_limit_remaining',
+                      'X-RateLimit-Limit': 'dbmenu_github_rate_limit',
+                      'X-RateLimit-Reset': 'dbmenu_github_rate_limit_reset_timestamp_seconds'}
+
+    for header, name in header_metrics.items():
+        try:
+            metrics.set(name, int(headers[header]))
+        except (KeyError, ValueError):
+            continue
+
+    # written with the next build / sync / regeneration or when dbmenu exits
+    metrics.write_later()
+
+
+def record_regeneration(template_type, count, seconds):
+    """ Records a regeneration of base || custom templates
+    """
+    if not enabled():
+        return
+
+    metrics = Metrics.instance()
+
+    metrics.set('dbmenu_regenerated_templates', count, type=template_type)
+    metrics.set('dbmenu_regeneration_duration_seconds', round(seconds, 3), type=template_type)
+    metrics.inc('dbmenu_regenerations_total', type=template_type)
+    metrics.write()
+
+
+def record_cache(entry, stats):
+    """ Records the unchanged / changed build cache files of a build (see buildcache.py)
+    """
+    if not enabled():
+        return
+
+    metrics = Metrics.instance()
+
+    metric_names = {'unchanged': 'unchanged_files', 'changed': 'changed_files',
+                    'unchanged_bytes': 'unchanged_bytes', 'changed_bytes': 'changed_bytes'}
+
+    for key, metric_name in metric_names.items():
+        metrics.inc(f"dbmenu_build_cache_{metric_name}_total", stats[key], entry=entry)
+
+    metrics.write()
@@ -0,0 +1,220 @@
+""" Stale-while-revalidate refreshes of the dbmenu caches.
+
+    When a cache is older than it's TTL (cache_ttl in the User Config) the
+    stale data is used straight away & a background thread refreshes it:
+
+    * images    - the LXD image listing (lxd.json) & the version cache (cache.json)
+    * templates - the standard template sync with Github
+
+    The output of the background thread (sys.stdout / sys.stderr & the output
+    of commands run with utils.run_command()) is kept out of the menus & a
+    notice is shown at the top of the next menu once the fresh data has landed
+    (|| the refresh failed).
+
+    usage:
+            refresh.Refresher.instance().start(refresh.get_stale(), refreshers)
+"""
+import os
+import sys
+import threading
+import time
+# app classes
+from distrobuilder_menu.api.singleton import SingletonThreadSafe
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+USER_CONFIG = Settings.lazy()
+
+RESOURCES = ('images', 'templates')
+
+# seconds (used for resources missing from cache_ttl)
+DEFAULT_TTL = 7 * 24 * 3600
+
+# notices of finished refreshes shown by the next menu
+NOTICES = []
+NOTICES_LOCK = threading.Lock()
+
+
+def get_stamp(resource):
+    """ Returns the file whose mtime is the time a resource was last refreshed
+    """
+    # touched by update_lxd_json() once the version cache is written
+    # (not lxd.json itself which is written before the cache)
+    if resource == 'images':
+        return f"{USER_CONFIG.template_dir}/.images_refreshed"
+
+    # touched by update_templates()
+    return f"{USER_CONFIG.template_dir}/.templates_synced"
+
+
+def touch_stamp(resource):
+    """ Marks a resource as refreshed now
+    """
+    stamp = get_stamp(resource)
+
+    try:
+        with open(stamp, 'a', encoding='utf-8'):
+            os.utime(stamp)
+    except OSError as err:
+        print(f"WARN: could not update: {stamp} => {err.strerror}")
+
+
+def get_ttl(resource):
+    """ Returns the TTL of a resource in seconds
+    """
+    return int((USER_CONFIG.cache_ttl or {}).get(resource, DEFAULT_TTL))
+
+
+def get_stale():
+    """ Returns the resources older than their TTL (or never refreshed)
+    """
+    stale = []
+
+    for resource in RESOURCES:
+        try:
+            age = time.time() - os.stat(get_stamp(resource)).st_mtime
+        except OSError:
+            age = None
+
+        if age is None or age > get_ttl(resource):
+            stale.append(resource)
+
+    return stale
+
+
+class ThreadOutput:
+    """ sys.stdout / sys.stderr proxy keeping the output of capturing threads
+        in a buffer (all other threads write to the real stream)
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        # thread ident : list of output
+        self.buffers = {}
+
+
+    def write(self, text):
+        """ Writes to the buffer of the current thread (or the real stream)
+        """
+        buffer = self.buffers.get(threading.get_ident())
+
+        if buffer is None:
+            return self.stream.write(text)
+
+        buffer.append(text)
+        return len(text)
+
+
+    def is_captured(self):
+        """ Returns True if the output of the current thread is kept in a buffer
+        """
+        return threading.get_ident() in self.buffers
+
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Refresher(SingletonThreadSafe):
+    """ Singleton class refreshing stale resources in a background thread
+
+        usage:
+                Refresher.instance().start(['images'], {'images': update_images})
+    """
+    def __init__(self):
+
+        # fix pylint 'super-init-not-called'
+        super().__init__()
+
+        self.thread = None
+        self.output = None
+        self.errors = None
+
+
+    def start(self, resources, refreshers):
+        """ Starts refreshing resources unless a refresh is already running
+
+        Args:
+            resources (list): resource names (see RESOURCES)
+            refreshers (dict): resource : function refreshing it
+
+        Returns:
+            bool: True if a refresh was started
+        """
+        if not resources or (self.thread and self.thread.is_alive()):
+            return False
+
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+        if not isinstance(sys.stderr, ThreadOutput):
+            sys.stderr = ThreadOutput(sys.stderr)
+        self.output = sys.stdout
+        self.errors = sys.stderr
+
+        # a daemon thread never delays exiting dbmenu
+        self.thread = threading.Thread(target=self.run,
+                                       args=(list(resources), refreshers),
+                                       name='dbmenu-refresh', daemon=True)
+        self.thread.start()
+        return True
+
+
+    def run(self, resources, refreshers):
+        """ Refreshes each resource (runs in the background thread)
+        """
+        ident = threading.get_ident()
+        # stdout & stderr share one buffer
+        output = self.output.buffers.setdefault(ident, [])
+        self.errors.buffers[ident] = output
+
+        try:
+            for resource in resources:
+                self.refresh(resource, refreshers[resource], output)
+        finally:
+            del self.output.buffers[ident]
+            del self.errors.buffers[ident]
+
+
+    @staticmethod
+    def refresh(resource, refresher, output):
+        """ Refreshes a resource & queues a notice (any error is only shown
+            as a notice so the next resource is still refreshed)
+        """
+        start_time = time.perf_counter()
+        output.clear()
+        error = None
+
+        try:
+            refresher()
+        except SystemExit as err:
+            # utils.die() (update_templates() exits 0 when templates are up to date)
+            if err.code:
+                lines = ''.join(output).strip().splitlines() or ['unknown error']
+                error = lines[-1]
+        # network / JSON errors would print a traceback over the menu
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            error = repr(err)
+
+        seconds = time.perf_counter() - start_time
+
+        if error:
+            add_notice(f"WARN: background refresh of {resource} failed => {error}")
+        else:
+            add_notice(f"INFO: {resource} refreshed in the background "
+                       f"({seconds:.1f} seconds)")
+
+
+def add_notice(notice):
+    """ Queues a notice for the next menu
+    """
+    with NOTICES_LOCK:
+        NOTICES.append(notice)
+
+
+def take_notices():
+    """ Returns & clears the queued notices (see menuclass.Menu.render())
+    """
+    with NOTICES_LOCK:
+        notices = NOTICES[:]
+        NOTICES.clear()
+
+    return notices
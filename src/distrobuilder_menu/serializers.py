@@ -0,0 +1,138 @@
+""" Format-aware serializer layer used by utils.read_config() / write_config()
+
+    * the format is chosen from the file extension or sniffed from the content
+    * JSON is parsed with the json module (the C scanner) without trying YAML first
+    * YAML uses the libyaml C loader / dumper when pyyaml was built with libyaml
+    * data is written straight to the file object (not built as one big string)
+
+    Loads & dumps run inside tracer spans (load_json / load_yaml / dump_json /
+    dump_yaml) so they show up in the -t tree & --trace events.
+
+    usage:
+            data_type = serializers.get_format(file_path, file)
+            data = serializers.load(file, data_type)
+"""
+import functools
+import json
+import os
+# app modules
+from distrobuilder_menu.api import tracer
+
+# file extension : data type
+FORMATS = {'.json': 'json', '.yaml': 'yaml', '.yml': 'yaml'}
+
+# characters read to sniff the format of files without a known extension
+SNIFF_SIZE = 64
+
+
+@functools.cache
+def get_yaml():
+    """ Returns the yaml module & the fastest safe loader / dumper classes
+
+    Returns:
+        tuple: yaml module, Loader class, Dumper class
+    """
+    # deferred import (yaml is slow to import & not needed for dbmenu --help)
+    # python-yaml / libyaml (prevents pypy working)
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    # yaml.load() python implementation is 15 times slower
+    # CBaseLoader is around 20% faster than the other C classes
+    # but does not support boolean data types:
+    # https://stackoverflow.com/a/72496031/555451
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    # yaml.dump() default Dumper (the C emitter writes identical output)
+    dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
+    return yaml, loader, dumper
+
+
+def parse_errors():
+    """ Returns the exceptions raised by load() for invalid data
+        (json.JSONDecodeError is a ValueError)
+    """
+    return (ValueError, get_yaml()[0].YAMLError)
+
+
+def get_format(file_path, file=None):
+    """ Returns the data type of a file from it's extension or (for other
+        extensions) by sniffing the first characters of an open file
+
+    Args:
+        file_path (str): file path
+        file (file object, optional): open text file to sniff. Defaults to None.
+
+    Returns:
+        str: json || yaml
+    """
+    suffix = os.path.splitext(file_path)[1].lower()
+
+    if suffix in FORMATS:
+        return FORMATS[suffix]
+
+    if file is None:
+        return 'yaml'
+
+    sample = file.read(SNIFF_SIZE).lstrip()
+    file.seek(0)
+
+    return 'json' if sample.startswith(('{', '[')) else 'yaml'
+
+
+def load(file, data_type):
+    """ Parses an open text file as json || yaml
+
+    Raises:
+        json.JSONDecodeError / yaml.YAMLError: on invalid data
+    """
+    if data_type == 'json':
+        with tracer.span('load_json'):
+            return json.load(file)
+
+    yaml, loader, _ = get_yaml()
+
+    with tracer.span('load_yaml'):
+        return yaml.load(file, Loader=loader)
+
+
+def dump(data, file, data_type, sort_keys=False):
+    """ Writes data to an open text file as json || yaml
+
+    Args:
+        data (dict || list): data to write
+        file (file object): open text file
+        data_type (str): json || yaml
+        sort_keys (bool, optional): alpha sort YAML keys. Defaults to False.
+    """
+    if data_type == 'json':
+        with tracer.span('dump_json'):
+            dump_json(data, file)
+        return
+
+    yaml, _, dumper = get_yaml()
+
+    # YAML not alpha sorted by default to preserve dictionary insertion order
+    with tracer.span('dump_yaml'):
+        yaml.dump(data, file, Dumper=dumper, sort_keys=sort_keys)
+
+
+def dump_json(data, file):
+    """ Writes json identical to json.dumps(data) one top level item at a time
+
+        json.dump() streams through the pure python encoder (several times
+        slower) so each item is encoded by the C encoder & written in turn.
+    """
+    if isinstance(data, dict) and all(isinstance(key, str) for key in data):
+        file.write('{')
+        for index, (key, value) in enumerate(data.items()):
+            file.write(f"{', ' if index else ''}{json.dumps(key)}: {json.dumps(value)}")
+        file.write('}')
+
+    elif isinstance(data, list):
+        file.write('[')
+        for index, value in enumerate(data):
+            file.write(f"{', ' if index else ''}{json.dumps(value)}")
+        file.write(']')
+
+    else:
+        file.write(json.dumps(data))
@@ -0,0 +1,431 @@
+""" Artifact store for the build output directory (target_dir)
+
+    Published artifacts keep their usual names in target_dir (e.g alpine-3.19.tar.xz)
+    as hard links into a content addressed store under target_dir/.store:
+
+    * objects/<sha256>                  - one copy of each distinct artifact
+    * <alias>/<created>/<file name>     - the artifacts of every kept build
+    * manifest.json                     - alias / fingerprint / size / created of each build
+
+    Identical outputs (e.g unchanged metadata tarballs) share one object.
+    Builds beyond artifact_keep per alias (or older than artifact_max_days) are
+    pruned when an alias is published & by 'dbmenu --gc' which also removes
+    unused objects, stale staging directories & images built by dbmenu that no
+    longer have an alias in Incus / LXD. Running builds hold the lock of their
+    staging directory (see get_staging_lock()) so it is never removed by gc.
+
+    usage:
+            published = store.publish(image_alias, {role: (staging_file, new_path)})
+"""
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+from pathlib import Path
+import shlex
+import shutil
+import subprocess
+import time
+# app modules
+from distrobuilder_menu import locks
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+from distrobuilder_menu.api.progress import format_bytes
+# app classes
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+USER_CONFIG = Settings.lazy()
+
+# timestamp format of the per build directories
+CREATED_FORMAT = '%Y%m%d-%H%M%S'
+
+# seconds before a leftover staging directory is removed by gc()
+STAGING_MAX_AGE = 24 * 3600
+
+# bytes read at a time while hashing artifacts
+CHUNK_SIZE = 1048576
+
+
+def get_store_dir():
+    """ Returns the store directory under target_dir
+    """
+    return Path(USER_CONFIG.target_dir or '.') / '.store'
+
+
+def read_manifest():
+    """ Returns the manifest (builds & the fingerprints of every build ever published)
+    """
+    manifest_file = get_store_dir() / 'manifest.json'
+
+    if not manifest_file.is_file():
+        return {'builds': [], 'fingerprints': {}}
+
+    return utils.read_config(manifest_file)
+
+
+def write_manifest(manifest):
+    """ Writes the manifest
+    """
+    utils.write_config(get_store_dir() / 'manifest.json', manifest, data_type='json')
+
+
+def hash_artifacts(files):
+    """ Hashes each artifact & the Incus / LXD image fingerprint of the build
+        (sha256 of the unified tarball || of the metadata & rootfs) in one pass
+
+    Args:
+        files (dict): role : file path
+
+    Returns:
+        tuple: {role : sha256}, fingerprint
+    """
+    # same order as importer.get_fingerprint()
+    if 'image' in files:
+        image_roles = ['image']
+    else:
+        image_roles = ['meta', 'rootfs' if 'rootfs' in files else 'disk']
+
+    fingerprint = hashlib.sha256()
+    digests = {}
+
+    # image files first (in fingerprint order) then any others
+    for role in image_roles + [role for role in files if role not in image_roles]:
+        sha256 = hashlib.sha256()
+
+        with open(files[role], 'rb') as file:
+            while chunk := file.read(CHUNK_SIZE):
+                sha256.update(chunk)
+                if role in image_roles:
+                    fingerprint.update(chunk)
+
+        digests[role] = sha256.hexdigest()
+
+    return digests, fingerprint.hexdigest()
+
+
+def take_ownership(file_paths):
+    """ Changes the owner of build artifacts written by 'sudo distrobuilder' to
+        the user running dbmenu (with fs.protected_hardlinks=1 users can not
+        hard link files owned by root)
+    """
+    uid, gid = os.getuid(), os.getgid()
+    foreign = [str(file_path) for file_path in file_paths
+               if os.stat(file_path).st_uid != uid]
+
+    if foreign:
+        utils.check_command(f"sudo chown {uid}:{gid} {' '.join(map(shlex.quote, foreign))}",
+                            exit_on_error=True
+                           )
+
+
+def link_file(object_path, new_path):
+    """ Atomically replaces new_path with a hard link to a store object
+        (the store is inside target_dir so both are on the same filesystem)
+        or with a copy when the object can not be linked
+    """
+    # rename() does nothing when both paths are links to the same file
+    if Path(new_path).exists() and os.path.samefile(object_path, new_path):
+        return
+
+    tmp_path = f"{new_path}.tmp"
+    Path(tmp_path).unlink(missing_ok=True)
+
+    try:
+        os.link(object_path, tmp_path)
+    # EPERM: objects owned by another user (fs.protected_hardlinks=1)
+    except PermissionError:
+        print(f"WARN: could not link: {object_path} => copying to: {new_path}")
+        shutil.copy2(object_path, tmp_path)
+
+    os.replace(tmp_path, new_path)
+
+
+def create_build_dir(image_alias):
+    """ Creates the store directory of a new build
+
+    Returns:
+        tuple: created timestamp, build directory
+    """
+    now = datetime.now()
+
+    # rebuilds within the same second get the next free timestamp
+    while (get_store_dir() / image_alias / now.strftime(CREATED_FORMAT)).exists():
+        now += timedelta(seconds=1)
+
+    build_dir = get_store_dir() / image_alias / now.strftime(CREATED_FORMAT)
+    build_dir.mkdir(parents=True)
+
+    return now.strftime(CREATED_FORMAT), build_dir
+
+
+@tracer.traced()
+def publish(image_alias, files):
+    """ Moves the artifacts of a build into the store & links them into
+        target_dir under their published names (the caller holds the build lock)
+
+    Args:
+        image_alias (str): see get_build_options() for it's format
+        files (dict): role : (staging file path, published file path)
+
+    Returns:
+        dict: role : published file path
+    """
+    # pylint: disable=too-many-locals
+    store_dir = get_store_dir()
+    objects_dir = store_dir / 'objects'
+    objects_dir.mkdir(parents=True, exist_ok=True)
+    created, build_dir = create_build_dir(image_alias)
+
+    # the artifacts are written by 'sudo distrobuilder'
+    take_ownership(paths[0] for paths in files.values())
+    digests, fingerprint = hash_artifacts({role: paths[0] for role, paths in files.items()})
+    build = {'alias': image_alias, 'created': created, 'fingerprint': fingerprint,
+             'size': 0, 'files': {}}
+    published = {}
+
+    try:
+        for role, (file_path, new_path) in files.items():
+            object_path = objects_dir / digests[role]
+
+            if object_path.exists():
+                # identical output => reuse the existing copy
+                print(f"\nDeduplicated: {Path(new_path).name} (identical to an earlier build)")
+                os.unlink(file_path)
+            else:
+                os.replace(file_path, object_path)
+
+            link_file(object_path, build_dir / Path(new_path).name)
+            link_file(object_path, new_path)
+            print(f"\nPublished:\n\n {file_path}\n =======> {new_path}\n")
+
+            size = object_path.stat().st_size
+            build['size'] += size
+            build['files'][role] = {'path': str(build_dir / Path(new_path).name),
+                                    'sha256': digests[role], 'size': size}
+            published[role] = new_path
+    # cross platform & also catches permission errors
+    except (OSError, IOError) as err:
+        utils.die(1, f"Error: {err.strerror} : publishing {image_alias} to {store_dir}")
+
+    manifest = read_manifest()
+    manifest['builds'].append(build)
+    manifest['fingerprints'][fingerprint] = image_alias
+    prune_builds(manifest, image_alias)
+    write_manifest(manifest)
+
+    return published
+
+
+def get_expired(builds):
+    """ Returns the builds of one alias beyond artifact_keep || older than
+        artifact_max_days (the newest build is always kept)
+    """
+    builds = sorted(builds, key=lambda build: build['created'], reverse=True)
+    keep = max(int(USER_CONFIG.artifact_keep), 1)
+    expired = builds[keep:]
+
+    if USER_CONFIG.artifact_max_days:
+        oldest = datetime.now() - timedelta(days=USER_CONFIG.artifact_max_days)
+        expired += [build for build in builds[1:keep]
+                    if datetime.strptime(build['created'], CREATED_FORMAT) < oldest]
+
+    return expired
+
+
+def prune_builds(manifest, alias=None):
+    """ Removes expired builds from the store & the manifest
+
+    Args:
+        manifest (dict): see read_manifest()
+        alias (str, optional): only prune one alias. Defaults to None (all).
+
+    Returns:
+        int: number of pruned builds
+    """
+    aliases = {alias} if alias else {build['alias'] for build in manifest['builds']}
+    expired = []
+
+    for name in sorted(aliases):
+        expired += get_expired([build for build in manifest['builds'] if build['alias'] == name])
+
+    for build in expired:
+        print(f"Pruning build: {build['alias']} {build['created']} "
+              f"({format_bytes(build['size'])})")
+
+        for item in build['files'].values():
+            Path(item['path']).unlink(missing_ok=True)
+            remove_unused_object(get_store_dir() / 'objects' / item['sha256'])
+
+        build_dir = get_store_dir() / build['alias'] / build['created']
+        if build_dir.is_dir() and not any(build_dir.iterdir()):
+            build_dir.rmdir()
+
+        manifest['builds'].remove(build)
+
+    return len(expired)
+
+
+def remove_unused_object(object_path):
+    """ Removes a store object no longer linked from a build || target_dir
+
+    Returns:
+        int: bytes freed
+    """
+    try:
+        stat = object_path.stat()
+    except FileNotFoundError:
+        return 0
+
+    # the object itself is the only link left
+    if stat.st_nlink > 1:
+        return 0
+
+    object_path.unlink()
+    return stat.st_size
+
+
+def remove_unused_objects():
+    """ Removes every unused store object (e.g replaced in target_dir by a rebuild)
+
+    Returns:
+        int: bytes freed
+    """
+    return sum(remove_unused_object(object_path)
+               for object_path in (get_store_dir() / 'objects').glob('*'))
+
+
+def get_staging_lock(staging_dir):
+    """ Returns the lock name of a staging directory (held exclusively by it's
+        build from builder.create_staging_dir() until the build ends)
+    """
+    return f"staging-{Path(staging_dir).name}"
+
+
+def remove_staging_dirs():
+    """ Removes staging directories left behind by failed builds (owned by root)
+        skipping the staging directories of running builds
+
+    Returns:
+        int: number of removed directories
+    """
+    staging_root = Path(USER_CONFIG.target_dir or '.') / '.staging'
+    removed = 0
+
+    if not staging_root.is_dir():
+        return removed
+
+    for staging_dir in staging_root.iterdir():
+        lock_name = get_staging_lock(staging_dir)
+
+        if not locks.try_acquire(lock_name, writer=True):
+            continue
+
+        try:
+            stale = time.time() - staging_dir.stat().st_mtime > STAGING_MAX_AGE
+        except OSError:
+            # removed by it's build meanwhile
+            locks.discard(lock_name)
+            continue
+
+        if not stale:
+            locks.release(lock_name)
+            continue
+
+        print(f"Removing stale staging directory: {staging_dir.name}")
+        utils.check_command(f"sudo rm -rf {shlex.quote(str(staging_dir))}",
+                            exit_on_error=True
+                           )
+        locks.discard(lock_name)
+        removed += 1
+
+    return removed
+
+
+def list_images():
+    """ Lists the Incus / LXD images (API || client)
+
+    Returns:
+        list: image dicts with 'fingerprint' & 'aliases'
+    """
+    # deferred import (the Incus API client imports urllib3)
+    from distrobuilder_menu.api.incus import Incus  # pylint: disable=import-outside-toplevel
+
+    if Incus.instance().check_socket():
+        return Incus.instance().list_images()
+
+    lxd_binary = utils.get_lxd_binary()
+
+    try:
+        output = subprocess.run(f"sudo {lxd_binary} image ls -f json", shell=True, check=True,
+                                text=True, capture_output=True
+                               )
+        return json.loads(output.stdout)
+    except (subprocess.CalledProcessError, ValueError):
+        print(f"WARN: could not list images with: {lxd_binary}")
+        return []
+
+
+def delete_image(fingerprint):
+    """ Deletes an Incus / LXD image (API || client)
+    """
+    # pylint: disable=import-outside-toplevel
+    from distrobuilder_menu.api.incus import Incus
+
+    if Incus.instance().check_socket():
+        Incus.instance().delete_image(fingerprint)
+    else:
+        lxd_binary = utils.get_lxd_binary()
+        utils.check_command(f"sudo {lxd_binary} image delete {fingerprint}", exit_on_error=True)
+
+
+def remove_stale_images(manifest):
+    """ Deletes images built by dbmenu (fingerprints in the manifest) that no
+        longer have an alias e.g images replaced by a rebuild of their alias
+
+    Returns:
+        int: number of deleted images
+    """
+    fingerprints = manifest['fingerprints']
+    current = {build['fingerprint'] for build in manifest['builds']}
+    present = set()
+    deleted = 0
+
+    for image in list_images():
+        fingerprint = image['fingerprint']
+
+        if fingerprint not in fingerprints:
+            continue
+
+        if image.get('aliases'):
+            present.add(fingerprint)
+            continue
+
+        print(f"Deleting stale image: {fingerprints[fingerprint]} {fingerprint[:12]}")
+        delete_image(fingerprint)
+        deleted += 1
+
+    # forget images that are gone (unless the build is still in the store)
+    manifest['fingerprints'] = {fingerprint: alias for fingerprint, alias in fingerprints.items()
+                                if fingerprint in present or fingerprint in current}
+
+    return deleted
+
+
+@tracer.traced()
+def gc():
+    """ Applies the retention policy to every alias & removes unused objects,
+        stale staging directories & stale Incus / LXD images
+    """
+    print(f"\nArtifact store: {get_store_dir()}\n")
+
+    with locks.exclusive('build'):
+        manifest = read_manifest()
+        pruned = prune_builds(manifest)
+        freed = remove_unused_objects()
+        staging = remove_staging_dirs()
+        deleted = remove_stale_images(manifest)
+        write_manifest(manifest)
+
+    print(f"\nPruned {pruned} build(s) / freed {format_bytes(freed)} / removed {staging} "
+          f"staging dir(s) / deleted {deleted} image(s)")
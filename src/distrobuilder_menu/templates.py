@@ -1,27 +1,35 @@
 """ Template functions to manipulate LXD JSON data
 """
-from datetime import datetime, timedelta
+import contextlib
+import json
+import os
 from pathlib import Path
 import platform
-from pprint import pprint
 import subprocess
+import time
 # app modules
+from distrobuilder_menu import layers
+from distrobuilder_menu import locks
+from distrobuilder_menu import metrics
+from distrobuilder_menu import refresh
 from distrobuilder_menu import utils
 # app classes
 from distrobuilder_menu.config.app import AppConfig
 from distrobuilder_menu.config.user import Settings
+from distrobuilder_menu.api import tracer
 from distrobuilder_menu.api.gethub import Gethub
+from distrobuilder_menu.api.progress import Progress
 from distrobuilder_menu.api.spinner import Spinner
 
 # globals
 # singleton class shares user config between modules
-USER_CONFIG = Settings.instance()
+# (lazy proxies create the instances on first use)
+USER_CONFIG = Settings.lazy()
 # singleton class for Github API methods
-GETHUB = Gethub.instance()
+GETHUB = Gethub.lazy()
 # read command line
 # ARGS are global to query building LXC or LXD images
-ARGS = AppConfig.instance()
-DEBUG_TIMER = utils.Timer(ARGS.timer)
+ARGS = AppConfig.lazy()
 
 
 def get_user_config():
@@ -29,9 +37,13 @@ def get_user_config():
     """
     print('\nDistrobuilder Menu settings:\n')
 
+    # deferred import (only needed with the -s option)
+    from pprint import pprint  # pylint: disable=import-outside-toplevel
+
     # accessing the __dict__ attribute is faster than vars()
     # https://www.pythondoeswhat.com/2012/01/dict-and-vars.html
-    pprint(USER_CONFIG.__dict__)
+    # (of the instance as USER_CONFIG is a lazy proxy)
+    pprint(Settings.instance().__dict__)
     print(f"\nUser Configuration: {USER_CONFIG.dbmenu_config}")
 
     # edit configuration
@@ -43,14 +55,17 @@ def get_user_config():
     Settings.instance()
 
 
-def update_lxd_json():
+@tracer.traced()
+def update_lxd_json(sync_templates=True, quiet=False):
     """ Refreshes JSON data from LXD.
         the file age check remains in load_json_cache() so the JSON
         data can be force updated if needed.
+
+    Args:
+        sync_templates (bool, optional): also run update_templates(). Defaults to True.
+        quiet (bool, optional): no spinner (background refresh). Defaults to False.
     """
     msg = f"\nUpdating LXD version data: {USER_CONFIG.lxd_json} ..."
-    lxd_binary = utils.get_lxd_binary()
-    lxd_command = f"{lxd_binary} image ls -f json images: > {USER_CONFIG.lxd_json}"
     json_file = Path(USER_CONFIG.lxd_json)
     output_dir = json_file.parent
 
@@ -62,21 +77,80 @@ def update_lxd_json():
         except (OSError, IOError) as err:
             utils.die(1, f"Error: {err.args[1]} : {output_dir}")
 
+    # one dbmenu at a time rewrites lxd.json & the version cache
+    with locks.exclusive('versions'):
+        if USER_CONFIG.image_source == 'simplestreams':
+            # no lxc / incus client or daemon needed (shows download progress)
+            print(msg)
+            # deferred import (only needed when updating image data)
+            # pylint: disable=import-outside-toplevel
+            from distrobuilder_menu.api.simplestreams import Simplestreams
+            Simplestreams.instance().update_lxd_json(USER_CONFIG.lxd_json)
+        else:
+            # nice simple activity indicator
+            with contextlib.nullcontext() if quiet else Spinner(msg):
+                update_lxd_json_cli()
+
+        # update cache
+        lxd_json = utils.read_config(USER_CONFIG.lxd_json)
+        json_data = process_data(lxd_json)
+        cache_to_json(json_data, USER_CONFIG.json_cachefile)
+        # only a complete refresh resets the 'images' TTL
+        refresh.touch_stamp('images')
+
+    if sync_templates:
+        # keep templates in sync
+        update_templates()
+
+
+@tracer.traced()
+def update_lxd_json_cli():
+    """ Writes the image remotes listing with the lxc || incus client
+        (used when image_source is set to 'cli' - remotes must exist in the client)
+    """
+    # deferred import (only needed when updating image data)
+    from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+
+    lxd_images = []
+
+    # one client process per remote run concurrently
+    with ThreadPoolExecutor(max_workers=max(1, len(USER_CONFIG.image_remotes))) as executor:
+        for images in executor.map(list_remote_cli, USER_CONFIG.image_remotes):
+            lxd_images.extend(images)
+
+    # renamed into place (a background refresh may be stopped when dbmenu exits)
+    utils.write_file_atomic(USER_CONFIG.lxd_json, json.dumps(lxd_images))
+
+
+@tracer.traced()
+def list_remote_cli(remote):
+    """ Lists the images of a remote with 'lxc || incus image ls -f json'
+
+    Args:
+        remote (str): remote name (from image_remotes)
+
+    Returns:
+        list: image dicts tagged with the remote name
+    """
+    lxd_binary = utils.get_lxd_binary()
+    lxd_command = f"{lxd_binary} image ls -f json {remote}:"
+
     try:
-        # nice simple activity indicator
-        with Spinner(msg):
-            subprocess.check_call(lxd_command, shell=True)
+        output = subprocess.run(lxd_command, shell=True, check=True, text=True,
+                                capture_output=True
+                               )
     except subprocess.CalledProcessError as err:
-        utils.die(1, f"Updating failed with error: {err.returncode}")
+        utils.die(1, f"Updating {remote} failed with error: {err.returncode}")
+
+    images = json.loads(output.stdout)
+
+    for image in images:
+        image['remote'] = remote
 
-    # update cache
-    lxd_json = utils.read_config(USER_CONFIG.lxd_json, ARGS.timer)
-    json_data = process_data(lxd_json)
-    cache_to_json(json_data, USER_CONFIG.json_cachefile)
-    # keep templates in sync
-    update_templates()
+    return images
 
 
+@tracer.traced()
 def cache_to_json(data, outfile):
     """ Used to cache dictionary data from process_data() to json.
         LXD json typically doesn't change often so cache the data
@@ -84,45 +158,72 @@ def cache_to_json(data, outfile):
         serialises faster but is a security risk. JSON is fast enough.
     """
     print(f"\nCaching JSON data to: {outfile}")
-    utils.write_config(outfile, data, data_type='json', enabled=ARGS.timer)
+    # renamed into place so menus never read a half written cache
+    # (the cache is rewritten by background refreshes - see refresh.py)
+    tmp_file = f"{outfile}.tmp"
+    utils.write_config(tmp_file, data, data_type='json')
+    os.replace(tmp_file, outfile)
 
 
+@tracer.traced()
 def load_json_cache():
     """ Reading LXD_JSON takes 0.65 sec versus 0.0083 sec
         with a cached version containing just the data we need
-        (which changes infrequently & is automatically updated here weekly)
+        (which changes infrequently & is automatically updated here
+        when older than cache_ttl)
+
+        A stale cache is returned straight away while a background thread
+        refreshes it (see refresh.py) - only new installs wait for the update.
     """
-    DEBUG_TIMER.start()
+    stale = refresh.get_stale()
+    background = False
 
-    one_week_ago = datetime.now() - timedelta(days=7)
-    json_file = Path(USER_CONFIG.lxd_json)
+    if stale and Path(USER_CONFIG.json_cachefile).is_file():
+        refreshers = {'images': lambda: update_lxd_json(sync_templates=False, quiet=True),
+                      'templates': lambda: update_templates(interactive=False)}
 
-    # on new installs no json cache exists yet
-    if json_file.is_file():
-        filetime = datetime.fromtimestamp(json_file.stat().st_mtime)
-    else:
-        # so trigger an update
-        filetime = datetime.now() - timedelta(days=8)
+        if refresh.Refresher.instance().start(stale, refreshers):
+            print(f"\nRefreshing in the background: {' / '.join(stale)}")
+            background = 'images' in stale
 
-    if filetime < one_week_ago:
-        print('\nJSON data is over 1 week old.')
+    elif 'images' in stale:
+        # on new installs no json cache exists yet
+        print('\nNo JSON cache found.')
 
         # also runs main computation: process_data() & caches json
+        # & queries the Github API for template updates
         update_lxd_json()
 
-        # queries the Github API for updates
-        update_templates()
+    if background:
+        # the stale cache is wanted now (not after our own refresh) & cache_to_json()
+        # renames a complete file into place
+        return utils.read_config(USER_CONFIG.json_cachefile)
 
-    json_data = utils.read_config(USER_CONFIG.json_cachefile, ARGS.timer)
+    # waits while another dbmenu rewrites the cache
+    with locks.shared('versions'):
+        json_data = utils.read_config(USER_CONFIG.json_cachefile)
 
-    DEBUG_TIMER.stop(post_msg=USER_CONFIG.json_cachefile)
     return json_data
 
 
-def update_templates():
+@tracer.traced()
+def update_templates(interactive=True):
     """ Checks the local template sizes against the list of dicts returned
         by custom class method Gethub.check_file_list()
         Finally passes a list of url's to Gethub.download_files()
+
+    Args:
+        interactive (bool, optional): False never prompts (background refresh).
+                                      Defaults to True.
+    """
+    # one dbmenu at a time syncs the standard templates
+    with locks.exclusive('images'):
+        download_templates(interactive)
+
+
+def download_templates(interactive=True):
+    """ Downloads changed standard templates (called by update_templates()
+        holding the images lock)
     """
     download_list = []
     # lxc/lxc-ci/images API endpoint
@@ -148,13 +249,18 @@ def update_templates():
 
     # download files
     if download_list:
-        GETHUB.download_files(download_list)
+        GETHUB.download_files(download_list, interactive)
+        # base layers built from changed standard templates are stale
+        layers.invalidate_layers([item['file'] for item in download_list])
         # regenerate base / custom templates
         process_updates(download_list)
+        refresh.touch_stamp('templates')
     else:
+        refresh.touch_stamp('templates')
         utils.die(0, f"Template files are up to date: {USER_CONFIG.subdir_images}\n")
 
 
+@tracer.traced()
 def process_updates(download_list):
     """ Takes the list of dictionaries generated by update_templates() & compares
         destination files with the 'source' key from JSON footers now added to
@@ -186,13 +292,13 @@ def process_updates(download_list):
     regenerate_template(regenerate_custom)
 
 
+@tracer.traced()
 def process_data(lxd_json_data):
     """Parses LXD json data & Returns a list of dicts with
        relevant template build options.
 
        Used by menu_versions() to display build options.
     """
-    DEBUG_TIMER.start()
     build_option_list = []
 
     # sanity checks
@@ -243,20 +349,59 @@ def process_data(lxd_json_data):
                     item_dict['arch'] = properties['architecture']
                     item_dict['release'] = properties['release']
                     item_dict['variant'] = properties['variant']
+                    # listings from before multiple remotes are from images:
+                    item_dict['remote'] = item.get('remote', 'images')
 
                     # add to list (append is fast)
                     build_option_list.append(item_dict)
 
-    DEBUG_TIMER.stop()
     return build_option_list
 
 
-def create_custom_lists():
+def filter_versions(version_list, remote=None):
+    """ Filters the version list by the image remote each entry was listed from
+        used by menu_versions() (--remote option)
+
+    Args:
+        version_list (list): see output of process_data()
+        remote (str, optional): remote name (from image_remotes). Defaults to None.
+
+    Returns:
+        list: version dicts from the remote (or all versions)
+    """
+    if not remote:
+        return version_list
+
+    return [item for item in version_list if item.get('remote', 'images') == remote]
+
+
+def select_versions(version_list, real_os, remote=None):
+    """ Selects the versions of an os which can be built (used by menu_versions()
+        & the dbmenu daemon)
+
+    Args:
+        version_list (list): see output of process_data()
+        real_os (str): os of the template (see find_os())
+        remote (str, optional): remote name (from image_remotes). Defaults to None.
+
+    Returns:
+        list: version dicts of the os (vm's are LXD only)
+    """
+    return [item for item in filter_versions(version_list, remote)
+            if item['os'] == real_os and
+            not (ARGS.lxc and item['type_top_level'] == 'virtual-machine')]
+
+
+@tracer.traced()
+def create_custom_lists(msg=True):
     """Generates lists of 'base' / 'custom' / 'fail' custom templates
 
        * Over time custom templates become stale as standard templates change
        * Regenerate 'base' templates that depend on 'standard' templates first
        * Regenerate 'custom' templates afterwards that depend on 'base' templates
+
+       Templates without a dbmenu footer are always reported (msg=False hides
+       the INFO line when they all have one)
     """
     # initialize multiple lists
     base_list, custom_list, fail_list = [], [], []
@@ -277,12 +422,13 @@ def create_custom_lists():
 
     if fail_list:
         print(f"\nWARN: unable to regenerate templates: {fail_list} => no dbmenu footer")
-    else:
+    elif msg:
         print("\nINFO: all custom templates have a dbmenu footer")
 
     return base_list, custom_list
 
 
+@tracer.traced()
 def regenerate_template(json_data_list):
     """ Over time as standard templates change custom templates can become stale
 
@@ -292,40 +438,55 @@ def regenerate_template(json_data_list):
     Args:
         json_data_list (list): list of json data dicts (created from dbmenu footers)
     """
-    for json_dict in json_data_list:
-
-        name = json_dict['name']
-        template_type = json_dict['type']
-        source = json_dict['source']
-        destination = json_dict['destination']
-        override = json_dict['override']
-        try:
-            cloudinit = json_dict['cloudinit']
-        except KeyError:
-            cloudinit = None
-
-        # merge override
-        print(f"\nRegenerating {template_type} template: {name}")
-        merge_files = [source, override]
-        utils.yaml_merge(USER_CONFIG.yq_check, destination, *merge_files)
-
-        # optionally merge cloudinit
-        if cloudinit:
+    # pylint: disable=too-many-locals
+    if not json_data_list:
+        return
+
+    start_time = time.perf_counter()
+    # item count / rate / ETA (periodic plain lines when stdout is not a TTY)
+    with Progress(f"Regenerating {json_data_list[0]['type']}", total=len(json_data_list),
+                  unit='templates') as progress:
+        for json_dict in json_data_list:
+
+            name = json_dict['name']
+            template_type = json_dict['type']
+            source = json_dict['source']
+            destination = json_dict['destination']
+            override = json_dict['override']
             try:
-                for key, value in cloudinit.items():
-                    node_section = key
-                    cloudinit_file = value
-                    print(f"==> merging cloudinit {node_section}")
-
-                    utils.yaml_add_content(src_file=destination, node='files',
-                            search_key='name', search_value=node_section,
-                            merge_file=cloudinit_file, new_key='content'
-                        )
-            except (TypeError, AttributeError) as err:
-                print(f"{err.args[1]} while regenerating template: {name}")
-
-        # tidy up template
-        utils.format_template(destination)
-
-        # write json footer comment
-        utils.add_custom_footer(destination, json_dict)
+                cloudinit = json_dict['cloudinit']
+            except KeyError:
+                cloudinit = None
+
+            # reader of the source (standard || base) template / sole writer of the destination
+            with locks.template_copy(source, destination):
+                # merge override
+                print(f"\nRegenerating {template_type} template: {name}")
+                merge_files = [source, override]
+                utils.yaml_merge(USER_CONFIG.yq_check, destination, *merge_files)
+
+                # optionally merge cloudinit
+                if cloudinit:
+                    try:
+                        for key, value in cloudinit.items():
+                            node_section = key
+                            cloudinit_file = value
+                            print(f"==> merging cloudinit {node_section}")
+
+                            utils.yaml_add_content(src_file=destination, node='files',
+                                    search_key='name', search_value=node_section,
+                                    merge_file=cloudinit_file, new_key='content'
+                                )
+                    except (TypeError, AttributeError) as err:
+                        print(f"{err.args[1]} while regenerating template: {name}")
+
+                # tidy up template
+                utils.format_template(destination)
+
+                # write json footer comment
+                utils.add_custom_footer(destination, json_dict)
+            progress.update()
+
+    metrics.record_regeneration(json_data_list[0]['type'], len(json_data_list),
+                                time.perf_counter() - start_time
+                               )
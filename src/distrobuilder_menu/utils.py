@@ -2,47 +2,27 @@
     various modules to prevent cyclic imports
 """
 import fileinput
-import inspect
+import fnmatch
+import functools
 import json
+import os
 from pathlib import Path
 import platform
 import re
 import shutil
 import subprocess
 import sys
+import threading
 import time
-# python-yaml / libyaml (prevents pypy working)
-import yaml
+# app modules
+from distrobuilder_menu import serializers
+from distrobuilder_menu.api import tracer
 
-class Timer:
-    """ Convenience class for timing code execution """
-
-    def __init__(self, enabled):
-        """ Prints execution time """
-        self._start_time = None
-        self.enabled = enabled
-
-    def start(self):
-        """ Start the Timer """
-        if self.enabled:
-            self._start_time = time.perf_counter()
-
-    def stop(self, newline=None, post_msg=None):
-        """Stop the timer, and report the elapsed time"""
-
-        if self.enabled:
-            elapsed_time = str(time.perf_counter() - self._start_time)
-            # identify calling method
-            caller = inspect.currentframe().f_back.f_code.co_name
-            msg = f"DEBUG: {caller} executed in:{elapsed_time}"
-
-            if post_msg:
-                msg = f"{msg} {post_msg}"
-
-            if newline:
-                print('')
-
-            print(msg)
+# directory path : (mtime_ns, racy, entries) see scan_dir()
+DIR_SNAPSHOTS = {}
+SNAPSHOT_LOCK = threading.Lock()
+# coarse filesystem timestamp granularity (NFS / FAT can be 1 - 2 seconds)
+RACY_SNAPSHOT_NS = 2_000_000_000
 
 
 def die(exit_code, *args):
@@ -94,42 +74,40 @@ def edit_file(file_path, console_editor, regex='[a-zA-Z]+', question=None):
             die(1, f"Error: {err.args[1]}")
 
 
-def read_config(file_path, enabled=False):
+def read_config(file_path):
     """ JSON / YAML config file loader in a single function.
+
+        The parser is chosen from the file extension (or the content) by
+        serializers.get_format() & the other parser is tried on a parse error.
     """
-    # speedtest
-    timer = Timer(enabled)
-    timer.start()
+    errors = serializers.parse_errors()
 
-    try:
-        with open(file_path, 'r', encoding="utf-8") as config_file:
-            # yaml.load() python implementation is 15 times slower
-            # CBaseLoader is around 20% faster than the other C classes
-            # but does not support boolean data types:
-            # https://stackoverflow.com/a/72496031/555451
-            config_data = yaml.load(config_file, Loader=yaml.CSafeLoader)
-    except yaml.YAMLError as yaml_err:
+    with tracer.span('read_config', file=file_path):
         try:
             with open(file_path, 'r', encoding="utf-8") as config_file:
-                config_data = json.load(config_file)
-        except json.decoder.JSONDecodeError as json_err:
-            die(1, f"Error: reading: {file_path} => {yaml_err} {json_err}")
-    except IOError:
-        die(1, f"Error: file does not exist ?: {file_path}")
-
-    # speedtest
-    timer.stop(newline=True, post_msg=file_path)
-    return config_data
-
-
-def write_config(outfile, data, data_type='yaml', yaml_sort=False, enabled=False):
+                data_type = serializers.get_format(file_path, config_file)
+                try:
+                    return serializers.load(config_file, data_type)
+                except errors as err:
+                    first_err = err
+
+                # a .json file holding YAML (or the reverse) is still read
+                config_file.seek(0)
+                try:
+                    return serializers.load(config_file, 'yaml' if data_type == 'json' else 'json')
+                except errors as other_err:
+                    die(1, f"Error: reading: {file_path} => {first_err} {other_err}")
+        except IOError:
+            die(1, f"Error: file does not exist ?: {file_path}")
+
+    # pylint inconsistent-return-statements (PEP8)
+    return None
+
+
+def write_config(outfile, data, data_type='yaml', yaml_sort=False):
     """ Write objects to yaml or json
     used by merge functions & user_config class
     """
-    # speedtest
-    timer = Timer(enabled)
-    timer.start()
-
     # sanity check
     if len(data) == 0:
         die(1, f"Error: No data to write to: {outfile}")
@@ -140,25 +118,21 @@ def write_config(outfile, data, data_type='yaml', yaml_sort=False, enabled=False
         print(f"Creating dirs: {dir_path}")
         dir_path.mkdir(parents=True)
 
-    # write file as JSON or YAML
-    try:
-        with open(outfile, 'w', encoding="utf-8") as file:
-            if data_type == 'json':
-                file.write(json.dumps(data))
-            else:
-                # YAML not alpha sorted to preserve dictionary insertion order
-                file.write(yaml.dump(data, sort_keys=yaml_sort))
-            print(f"Wrote configuration as {data_type} to: {outfile}")
+    yaml = serializers.get_yaml()[0]
 
-    except IOError:
-        print(f"Error: could not write {data_type} to: {outfile}")
-    except json.decoder.JSONDecodeError as json_err:
-        print(f"JSON error: {json_err}")
-    except yaml.YAMLError as yaml_err:
-        print(f"YAML error: {yaml_err}")
+    # write file as JSON or YAML (streamed to the file object)
+    with tracer.span('write_config', file=outfile):
+        try:
+            with open(outfile, 'w', encoding="utf-8") as file:
+                serializers.dump(data, file, data_type, sort_keys=yaml_sort)
+                print(f"Wrote configuration as {data_type} to: {outfile}")
 
-    # speedtest
-    timer.stop(newline=True, post_msg=outfile)
+        except IOError:
+            print(f"Error: could not write {data_type} to: {outfile}")
+        except (TypeError, ValueError) as json_err:
+            print(f"JSON error: {json_err}")
+        except yaml.YAMLError as yaml_err:
+            print(f"YAML error: {yaml_err}")
 
 
 def write_footer(data, outfile, prepend):
@@ -210,23 +184,55 @@ def count_lines(input_file, search_str):
     return len(result_list)
 
 
+def scan_dir(dir_path):
+    """ Returns a sorted snapshot of the entries of a directory from os.scandir()
+        which is cached until the directory mtime changes (so repeated listings
+        of the template directories cost one stat).
+
+        Snapshots taken within RACY_SNAPSHOT_NS of the directory mtime are
+        never trusted as an entry added in the same mtime tick (e.g on NFS)
+        would otherwise be missed.
+
+    Args:
+        dir_path (str): directory path
+
+    Returns:
+        tuple: (name, path, is_dir) of each entry sorted by name
+    """
+    dir_path = str(dir_path)
+    mtime_ns = os.stat(dir_path).st_mtime_ns
+
+    with SNAPSHOT_LOCK:
+        snapshot = DIR_SNAPSHOTS.get(dir_path)
+
+    if snapshot and snapshot[0] == mtime_ns and not snapshot[1]:
+        return snapshot[2]
+
+    with os.scandir(dir_path) as dir_entries:
+        entries = tuple(sorted((entry.name, entry.path, entry.is_dir())
+                               for entry in dir_entries))
+
+    racy = time.time_ns() - mtime_ns < RACY_SNAPSHOT_NS
+
+    with SNAPSHOT_LOCK:
+        DIR_SNAPSHOTS[dir_path] = (mtime_ns, racy, entries)
+
+    return entries
+
+
 def find_files(file_or_pattern, dir_path):
     """ Returns a dictionary with filename without the extension
         as the key (as template files are named after the os) &
         the filepath as the value.
     """
-    file_data = {}
-    filepath_list = list(Path(dir_path).glob(file_or_pattern))
-
-    if len(filepath_list) > 1:
-        filepath_list.sort()
-
-    for file_path in filepath_list:
-        # stem is filename without the extension
-        os_name = Path(file_path).stem
-        file_data[os_name] = str(file_path)
+    try:
+        entries = scan_dir(dir_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
 
-    return file_data
+    # stem is filename without the extension
+    return {Path(name).stem: path for name, path, _ in entries
+            if fnmatch.fnmatchcase(name, file_or_pattern)}
 
 
 def find_subdirs(dir_path, append_file=None):
@@ -238,47 +244,20 @@ def find_subdirs(dir_path, append_file=None):
     """
     subdir_data = {}
 
-    # fast dir searches: https://stackoverflow.com/a/40347279/555451
-    # os module is faster but was replaced with pathlib
-    subdir_list = [x for x in Path(dir_path).iterdir() if x.is_dir()]
-
-    if len(subdir_list) > 1:
-        subdir_list.sort()
-
-    for subdir_path in subdir_list:
-        subdir_name = Path(subdir_path).name
+    for subdir_name, subdir_path, is_dir in scan_dir(dir_path):
+        if not is_dir:
+            continue
 
         # cloudinit needs file paths for menu_edit()
         if append_file:
             subdir_data[subdir_name] = f"{subdir_path}/{append_file}"
         else:
             # cloudinit needs dir paths for menu_copy / rename / delete()
-            # str returned here so move_files() doesn't break checking for \n
-            subdir_data[subdir_name] = str(subdir_path)
+            subdir_data[subdir_name] = subdir_path
 
     return subdir_data
 
 
-def find_latest_files(target_dir, count):
-    """ Finds the latest files in a directory
-
-    Args:
-        target_dir (str): search dir path
-        count (int): number of items to return
-
-    Returns:
-        list: filenames found
-    """
-    cmd = f"ls -t {target_dir} | head -n{count}"
-
-    try:
-        output = subprocess.run(cmd, shell=True, text=True, capture_output=True, check=False)
-    except subprocess.CalledProcessError as err:
-        die(1, f"Error: finding last modified file {err.output[1]}")
-
-    return output.stdout.splitlines()
-
-
 def check_filepath(file_path):
     """ Convenience function for checking vars contain a valid path
     """
@@ -288,6 +267,28 @@ def check_filepath(file_path):
         die(1, f"Error: invalid path: {file_path}")
 
 
+def run_command(command, check=False, **kwargs):
+    """ subprocess.run() of a shell command whose output (stdout unless it's
+        redirected & stderr) goes to sys.stdout when the output of the current
+        thread is kept out of the terminal (background refreshes - see refresh.py)
+
+    Returns:
+        subprocess.CompletedProcess: see subprocess.run()
+    """
+    if not getattr(sys.stdout, 'is_captured', lambda: False)():
+        return subprocess.run(command, shell=True, check=check, **kwargs)
+
+    kwargs.setdefault('stdout', subprocess.PIPE)
+    result = subprocess.run(command, shell=True, check=check, stderr=subprocess.PIPE,
+                            text=True, errors='replace', **kwargs)
+
+    for output in (result.stdout, result.stderr):
+        if output:
+            sys.stdout.write(output)
+
+    return result
+
+
 def check_command(command, exit_on_error=False):
     """ Simple function to run a shell command with error trapping
         & optionally halt execution
@@ -303,10 +304,12 @@ def check_command(command, exit_on_error=False):
     return retval
 
 
+@functools.cache
 def get_lxd_binary():
     """ Convenience function to find the installed LXD or Incus binary
 
-        used by builder.py / templates.py
+        used by builder.py / templates.py (cached so the client is only
+        spawned once per run)
 
     Returns:
         str: lxc || incus
@@ -331,6 +334,7 @@ def preprend_lines(file, line_str):
         print(f"Error: {err.args[1]} : {file}")
 
 
+@tracer.traced()
 def yaml_extract(check_yq, input_file, out_file, node_key_regex):
     """ Extracts YAML node data from templates with the golang version of yq
         used to create template overrides
@@ -349,7 +353,7 @@ def yaml_extract(check_yq, input_file, out_file, node_key_regex):
     try:
         # write in append mode
         with open(out_file, "a", encoding="utf-8") as file_handle:
-            subprocess.run(extract_cmd, shell=True, check=False, stdout=file_handle)
+            run_command(extract_cmd, check=False, stdout=file_handle)
 
     # cross platform & also catches permission errors
     except (OSError, IOError) as err:
@@ -359,6 +363,7 @@ def yaml_extract(check_yq, input_file, out_file, node_key_regex):
     preprend_lines(out_file, '---\n')
 
 
+@tracer.traced()
 def yaml_merge(check_yq, out_file, *input_files):
     """ Merges multiple YAML files with the golang version of yq
         python-yaml was problematic with multline strings - custom literal representers
@@ -381,7 +386,7 @@ def yaml_merge(check_yq, out_file, *input_files):
                           *input_files])
     try:
         with open(out_file, "w", encoding="utf-8") as file_handle:
-            subprocess.run(merge_cmd, shell=True, check=False, stdout=file_handle)
+            run_command(merge_cmd, check=False, stdout=file_handle)
 
     # cross platform & also catches permission errors
     except (OSError, IOError) as err:
@@ -410,6 +415,7 @@ def yaml_find_index(file, node, search_key, search_value):
     return counter
 
 
+@tracer.traced()
 def yaml_add_content(*, src_file, node, search_key, search_value, merge_file, new_key):
     """ Adds the contents of a file as a multiline string to a YAML node
 
@@ -425,7 +431,7 @@ def yaml_add_content(*, src_file, node, search_key, search_value, merge_file, ne
     add_cmd = f"""yq -i '.{node}[{arr_index}].{new_key} = "'"$(< {merge_file})"'"' {src_file}"""
 
     try:
-        subprocess.run(add_cmd, shell=True, check=False)
+        run_command(add_cmd, check=False)
     # cross platform & also catches permission errors
     except (OSError, IOError) as err:
         die(1, f"Error: {err.args[1]}")
@@ -483,6 +489,63 @@ def move_file(file_path, new_path):
         print(f"Error: source file does not exist: {file_path}")
 
 
+def replace_file(file_path, new_path):
+    """ Atomically renames a file (replacing any existing file) - both paths
+        must be on the same filesystem
+
+    Args:
+        file_path (str): source file path
+        new_path (str): new file path
+    """
+    try:
+        os.replace(file_path, new_path)
+        print(f"\nRenamed:\n\n {file_path}")
+        print(f" =======> {new_path}\n")
+    # cross platform & also catches permission errors
+    except (OSError, IOError) as err:
+        die(1, f"Error: {err.args[1]} : {file_path} => {new_path}")
+
+
+def write_file_atomic(outfile, text, mode=0o644):
+    """ Writes text to a temporary file in the same directory which is renamed
+        over outfile (so readers never see a partially written file)
+
+    Args:
+        outfile (str): file path
+        text (str): file content
+        mode (int, optional): file permissions. Defaults to 0o644.
+
+    Raises:
+        OSError: on write errors (the temporary file is removed)
+    """
+    # deferred import (utils is imported at startup)
+    import tempfile  # pylint: disable=import-outside-toplevel
+
+    out_path = Path(outfile)
+    tmp_path = None
+
+    try:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        # unique per process & thread, hidden & without the outfile suffix
+        # (so it's ignored by readers globbing *.prom)
+        tmp_fd, tmp_name = tempfile.mkstemp(prefix=f".{out_path.name}.", suffix='.tmp',
+                                            dir=out_path.parent
+                                           )
+        tmp_path = Path(tmp_name)
+
+        with os.fdopen(tmp_fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, out_path)
+    except OSError:
+        if tmp_path:
+            tmp_path.unlink(missing_ok=True)
+        raise
+
+
 def copy_dirs_or_files(src, dest):
     """ Copy files or folders
 
@@ -577,6 +640,7 @@ def find_regex(input_file, regexp, substring=None, json_dict=False):
     return result
 
 
+@tracer.traced()
 def format_template(template):
     """ the current implementation of golang-yaml (used by yaml_merge() via yq)
         removes blank lines from YAML configuration & distrobuilder expects a blank line
@@ -0,0 +1,225 @@
+""" Watches the overrides, standard templates & cloud-init directories with
+    inotify & regenerates only the custom templates whose dbmenu footer depends
+    on a changed file (bursts of events are debounced into one batch).
+
+    Base templates are regenerated first & custom templates built from a
+    regenerated base template are regenerated after it.
+
+    usage:
+            dbmenu --watch  (Ctrl-C to stop)
+"""
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import time
+# app modules
+from distrobuilder_menu import templates
+from distrobuilder_menu import utils
+from distrobuilder_menu.api import tracer
+# app classes
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+USER_CONFIG = Settings.lazy()
+
+# seconds without events before a batch is regenerated
+DEBOUNCE = 0.5
+
+# inotify(7) event masks (editors either rewrite a file or rename over it)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO
+
+# struct inotify_event: wd, mask, cookie, len (followed by the name)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """ Minimal inotify(7) wrapper using libc through ctypes
+
+        usage:
+                with Inotify() as inotify:
+                    inotify.add_watch(dir_path)
+                    for file_path in inotify.read_events(): ...
+    """
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+
+        try:
+            self.libc = ctypes.CDLL(libc_name, use_errno=True)
+            self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            utils.die(1, 'Error: --watch needs inotify (Linux)')
+
+        if self.fd < 0:
+            utils.die(1, f"Error: inotify_init1() failed => {os.strerror(ctypes.get_errno())}")
+
+        # watch descriptor : directory path
+        self.watches = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        os.close(self.fd)
+
+
+    def add_watch(self, dir_path):
+        """ Watches a directory for written / renamed files
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+
+        if wd < 0:
+            print(f"WARN: cannot watch: {dir_path} => {os.strerror(ctypes.get_errno())}")
+            return
+
+        self.watches[wd] = str(dir_path)
+
+
+    def read_events(self):
+        """ Reads the pending events
+
+        Returns:
+            set: paths of the changed files (None is added on a queue overflow)
+        """
+        changed = set()
+        buffer = os.read(self.fd, 65536)
+        offset = 0
+
+        while offset < len(buffer):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                changed.add(None)
+            elif wd in self.watches and name:
+                changed.add(f"{self.watches[wd]}/{name}")
+
+        return changed
+
+
+    def wait_for_batch(self, debounce=DEBOUNCE):
+        """ Blocks until files change & then collects events until none arrive
+            for debounce seconds
+
+        Returns:
+            set: paths of the changed files
+        """
+        select.select([self.fd], [], [])
+        changed = self.read_events()
+
+        while select.select([self.fd], [], [], debounce)[0]:
+            changed |= self.read_events()
+
+        return changed
+
+
+def get_watch_dirs():
+    """ Returns the directories holding the files custom templates are built from
+    """
+    return [USER_CONFIG.subdir_overrides, USER_CONFIG.subdir_images,
+            USER_CONFIG.cloudinit_user_dir, USER_CONFIG.cloudinit_network_dir,
+            USER_CONFIG.cloudinit_vendor_dir]
+
+
+def get_dependencies(footer):
+    """ Returns the normalised paths a custom template is built from
+    """
+    paths = [footer['source'], footer['override']]
+    paths.extend((footer.get('cloudinit') or {}).values())
+
+    return {os.path.realpath(path) for path in paths}
+
+
+def find_affected(changed, base_list, custom_list):
+    """ Maps changed files through the dbmenu footers to the custom templates
+        depending on them (custom templates built from an affected base
+        template are affected too)
+
+    Args:
+        changed (set): normalised paths of the changed files
+        base_list (list): footers of 'base' templates (see create_custom_lists())
+        custom_list (list): footers of 'custom' templates
+
+    Returns:
+        tuple: affected base footers, affected custom footers
+    """
+    base_affected = [footer for footer in base_list if get_dependencies(footer) & changed]
+    changed = changed | {os.path.realpath(footer['destination']) for footer in base_affected}
+    custom_affected = [footer for footer in custom_list if get_dependencies(footer) & changed]
+
+    return base_affected, custom_affected
+
+
+def regenerate_changed(changed):
+    """ Regenerates the custom templates depending on the changed files
+        & prints the timing of the batch
+    """
+    # footers are read again for each batch as templates may have been added
+    base_list, custom_list = templates.create_custom_lists(msg=False)
+
+    if None in changed:
+        print('\nWARN: inotify queue overflow => regenerating all custom templates')
+        base_affected, custom_affected = base_list, custom_list
+    else:
+        changed = {os.path.realpath(path) for path in changed}
+        base_affected, custom_affected = find_affected(changed, base_list, custom_list)
+
+    names = [Path(path).name for path in sorted(path for path in changed if path)]
+    print(f"\nChanged: {' '.join(names) or 'unknown files'}")
+
+    if not base_affected and not custom_affected:
+        print('==> no custom templates depend on these files')
+        return
+
+    start_time = time.perf_counter()
+
+    with tracer.span('watch_batch', templates=len(base_affected) + len(custom_affected)):
+        templates.regenerate_template(base_affected)
+        templates.regenerate_template(custom_affected)
+
+    print(f"\nRegenerated {len(base_affected) + len(custom_affected)} template(s) in "
+          f"{time.perf_counter() - start_time:.2f} seconds")
+
+
+def watch():
+    """ Regenerates affected custom templates whenever their source files
+        change until interrupted with Ctrl-C
+    """
+    with Inotify() as inotify:
+        for dir_path in get_watch_dirs():
+            if Path(dir_path).is_dir():
+                inotify.add_watch(dir_path)
+
+        if not inotify.watches:
+            utils.die(1, 'Error: no template / cloud-init directories to watch')
+
+        print('\nWatching for changes (Ctrl-C to stop):\n')
+        for dir_path in inotify.watches.values():
+            print(f"==> {dir_path}")
+
+        try:
+            while True:
+                changed = {path for path in inotify.wait_for_batch()
+                           if path is None or path.endswith('.yaml')}
+                if not changed:
+                    continue
+
+                # utils.die() raises SystemExit (e.g invalid YAML in an edited file)
+                try:
+                    regenerate_changed(changed)
+                except SystemExit as err:
+                    print(f"\nERROR: regeneration failed (exit code: {err.code}) => "
+                          'still watching for changes')
+        except KeyboardInterrupt:
+            pass
+
+    print('\nStopped watching.')
@@ -0,0 +1,273 @@
+""" RAM backed build workspaces (enabled by tmpfs_workspace in the User Config)
+
+    distrobuilder unpacks the rootfs & installs packages in it's work directory
+    which is I/O bound on slow disks. When enabled each build gets a workspace
+    under tmpfs_dir (e.g /dev/shm) if the free memory exceeds tmpfs_size_multiple
+    x the expected image size (estimated from earlier artifacts in the store):
+
+    * normal builds use the workspace as distrobuilder --cache-dir
+    * builds with the managed download cache keep downloads on disk & link the
+      distrobuilder work directories into the workspace (see buildcache.py)
+    * layered builds snapshot their base layer into the workspace
+
+    Otherwise (|| when tmpfs_dir is not a tmpfs) builds fall back to disk. The
+    placement is shown before each build & kept in the build timing record.
+
+    Placements are decided one at a time (under the 'workspace' lock) & each
+    tmpfs workspace reserves it's expected size until the build ends (a
+    tmpfs_dir/dbmenu-*.reserved file whose workspace lock is held) so
+    concurrent builds never count the same free memory twice.
+
+    usage:
+            work = workspace.plan_workspace(image_alias, staging_dir)
+            with workspace.use_workspace(work):
+                run_build()
+"""
+import contextlib
+from pathlib import Path
+import shlex
+import shutil
+# app modules
+from distrobuilder_menu import locks
+from distrobuilder_menu import store
+from distrobuilder_menu import utils
+from distrobuilder_menu.api.progress import format_bytes
+# app classes
+from distrobuilder_menu.config.user import Settings
+
+# singleton classes share config between modules
+USER_CONFIG = Settings.lazy()
+
+
+def get_expected_size(image_alias):
+    """ Estimates the size of a build from the artifacts of earlier builds
+        (the newest build of the alias || the largest build of the same image type)
+
+    Returns:
+        int: bytes (or None without earlier builds)
+    """
+    builds = read_builds()
+    same_alias = [build for build in builds if build['alias'] == image_alias]
+
+    if same_alias:
+        return max(same_alias, key=lambda build: build['created'])['size']
+
+    # vm aliases end in -vm (see builder.get_build_options())
+    is_vm = image_alias.endswith('-vm')
+    same_type = [build['size'] for build in builds if build['alias'].endswith('-vm') == is_vm]
+
+    return max(same_type) if same_type else None
+
+
+def read_builds():
+    """ Returns the builds kept in the artifact store (see store.py)
+    """
+    try:
+        return store.read_manifest()['builds']
+    # an unreadable manifest only disables the estimate
+    except (OSError, ValueError, KeyError, TypeError):
+        return []
+
+
+def get_free_memory():
+    """ Returns the memory available without swapping (MemAvailable)
+
+    Returns:
+        int: bytes (0 when /proc/meminfo is unreadable)
+    """
+    try:
+        with open('/proc/meminfo', encoding='utf-8') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return 0
+
+
+def is_tmpfs(dir_path):
+    """ Returns True if dir_path is on a tmpfs (the longest matching mount point)
+    """
+    dir_path = Path(dir_path).resolve()
+    fs_type = None
+    mount_length = -1
+
+    try:
+        with open('/proc/mounts', encoding='utf-8') as file:
+            mounts = [line.split()[1:3] for line in file]
+    except OSError:
+        return False
+
+    for mount_point, mount_type in mounts:
+        if dir_path.is_relative_to(mount_point) and len(mount_point) > mount_length:
+            fs_type = mount_type
+            mount_length = len(mount_point)
+
+    return fs_type == 'tmpfs'
+
+
+def get_reservation_lock(reservation):
+    """ Returns the lock name held by the build of a workspace reservation
+    """
+    return f"workspace-{Path(reservation).stem}"
+
+
+def get_reserved_bytes():
+    """ Sums the expected sizes of the active tmpfs workspaces (reservations
+        left by builds that ended without removing them are removed)
+
+    Returns:
+        int: bytes
+    """
+    reserved = 0
+
+    for reservation in Path(USER_CONFIG.tmpfs_dir).glob('dbmenu-*.reserved'):
+        lock_name = get_reservation_lock(reservation)
+
+        # the lock is free when the build has ended
+        if locks.try_acquire(lock_name, writer=True):
+            locks.release(lock_name)
+            reservation.unlink(missing_ok=True)
+            continue
+
+        try:
+            reserved += int(reservation.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            pass
+
+    return reserved
+
+
+def choose_placement(image_alias):
+    """ Decides whether a build fits in RAM (the expected sizes of other
+        tmpfs workspaces are reserved)
+
+    Returns:
+        dict: placement (tmpfs || disk) / reason / expected_bytes / free_bytes
+    """
+    work = {'placement': 'disk', 'expected_bytes': None, 'free_bytes': None}
+
+    if not Path(USER_CONFIG.tmpfs_dir).is_dir() or not is_tmpfs(USER_CONFIG.tmpfs_dir):
+        work['reason'] = f"{USER_CONFIG.tmpfs_dir} is not a tmpfs"
+        return work
+
+    expected = get_expected_size(image_alias)
+    work['expected_bytes'] = expected
+
+    if not expected:
+        work['reason'] = 'no earlier builds to estimate the image size'
+        return work
+
+    # the tmpfs may be smaller than the available memory
+    free = min(get_free_memory(), shutil.disk_usage(USER_CONFIG.tmpfs_dir).free)
+    free = max(free - get_reserved_bytes(), 0)
+    needed = expected * USER_CONFIG.tmpfs_size_multiple
+    work['free_bytes'] = free
+
+    if free > needed:
+        work['placement'] = 'tmpfs'
+        work['reason'] = f"{format_bytes(free)} free > {format_bytes(needed)} " \
+                         f"({USER_CONFIG.tmpfs_size_multiple} x {format_bytes(expected)})"
+    else:
+        work['reason'] = f"{format_bytes(free)} free <= {format_bytes(needed)} " \
+                         f"({USER_CONFIG.tmpfs_size_multiple} x {format_bytes(expected)})"
+
+    return work
+
+
+def plan_workspace(image_alias, staging_dir, layered_build=None):
+    """ Chooses the workspace placement of a build & prints it (layered builds
+        in RAM snapshot their base layer into the workspace)
+
+    Args:
+        image_alias (str): see get_build_options() for it's format
+        staging_dir (str): staging directory of the build (names the workspace)
+        layered_build (dict, optional): see layers.prepare_layered_build().
+                                        Defaults to None.
+
+    Returns:
+        dict: see choose_placement() & 'path' (the tmpfs workspace || None)
+              (None when tmpfs_workspace is disabled)
+    """
+    if not USER_CONFIG.tmpfs_workspace:
+        return None
+
+    with locks.exclusive('workspace'):
+        work = choose_placement(image_alias)
+        work['path'] = None
+
+        if work['placement'] == 'tmpfs':
+            # staging directories have unique names
+            work['path'] = str(Path(USER_CONFIG.tmpfs_dir) / f"dbmenu-{Path(staging_dir).name}")
+            reserve_workspace(work)
+
+    if work['placement'] == 'tmpfs':
+        print(f"\nBuild workspace: tmpfs {work['path']} ({work['reason']})")
+
+        # (not <workspace>/rootfs - the distrobuilder work directory of the cache)
+        if layered_build:
+            layered_build['workspace'] = f"{work['path']}/layer/rootfs"
+    else:
+        print(f"\nBuild workspace: disk ({work['reason']})")
+
+    return work
+
+
+def reserve_workspace(work):
+    """ Reserves the expected size of a tmpfs workspace until release_workspace()
+    """
+    reservation = Path(f"{work['path']}.reserved")
+    locks.try_acquire(get_reservation_lock(reservation), writer=True)
+
+    try:
+        reservation.write_text(str(work['expected_bytes']), encoding='utf-8')
+    # cross platform & also catches permission errors
+    except OSError as err:
+        utils.die(1, f"Error: {err.strerror} : {reservation}")
+
+
+def release_workspace(work):
+    """ Releases the reservation of a tmpfs workspace (cancelled builds)
+    """
+    work_dir = get_path(work)
+
+    if work_dir:
+        reservation = Path(f"{work_dir}.reserved")
+        reservation.unlink(missing_ok=True)
+        locks.release(get_reservation_lock(reservation))
+
+
+def get_path(work):
+    """ Returns the tmpfs workspace of a build (or None for disk builds)
+    """
+    return work['path'] if work else None
+
+
+@contextlib.contextmanager
+def use_workspace(work):
+    """ Creates the tmpfs workspace of a build & removes it afterwards
+        (files written by distrobuilder are owned by root)
+
+    Args:
+        work (dict): see plan_workspace() (None || disk placements do nothing)
+    """
+    work_dir = get_path(work)
+
+    if not work_dir:
+        yield
+        return
+
+    try:
+        Path(work_dir).mkdir(mode=0o700)
+    # cross platform & also catches permission errors
+    except OSError as err:
+        utils.die(1, f"Error: {err.strerror} : {work_dir}")
+
+    try:
+        yield
+    finally:
+        try:
+            utils.check_command(f"sudo rm -rf {shlex.quote(work_dir)}", exit_on_error=True)
+        finally:
+            release_workspace(work)
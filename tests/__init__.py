@@ -0,0 +1,24 @@
+""" Tests for dbmenu - run with: python -m pytest tests (or python -m unittest)
+
+    dbmenu reads ~/.config/dbmenu.yaml & parses sys.argv when it's singletons are
+    first used, so tests run with a temporary HOME & a default User Config.
+"""
+from pathlib import Path
+import os
+import sys
+import tempfile
+
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+TEST_HOME = tempfile.mkdtemp(prefix='dbmenu-tests-')
+
+# set before importing distrobuilder_menu (default paths are based on HOME)
+os.environ['HOME'] = TEST_HOME
+sys.argv = ['dbmenu']
+
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+Path(TEST_HOME, '.config').mkdir()
+Path(TEST_HOME, '.config', 'dbmenu.yaml').write_text(
+    f"main_dir: {TEST_HOME}/distrobuilder\nimport_into_lxd: false\n", encoding='utf-8'
+)
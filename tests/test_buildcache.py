@@ -0,0 +1,39 @@
+""" Tests the managed download cache
+"""
+from pathlib import Path
+import tempfile
+import unittest
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import buildcache
+# app classes
+from distrobuilder_menu.config.user import Settings
+
+
+class TestBuildCache(unittest.TestCase):
+    """ Cache entry tests
+    """
+    def test_snapshot_prunes_work_dirs(self):
+        """ The distrobuilder work directories are never listed (for str || Path entries)
+        """
+        cache_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+
+        for name in ('alpine.tar.gz', 'rootfs/etc/hosts', 'overlay/upper/file'):
+            (cache_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (cache_dir / name).write_text(name, encoding='utf-8')
+
+        for entry in (cache_dir, str(cache_dir)):
+            self.assertEqual(list(buildcache.snapshot(entry)), ['alpine.tar.gz'])
+
+    def test_reset_moves_cache(self):
+        """ A new base directory also moves the managed cache
+        """
+        defaults = Settings.Default()
+        defaults.reset('/srv/dbmenu')
+
+        self.assertEqual(defaults.build_cache_dir, '/srv/dbmenu/cache')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+""" Tests running a planned build (with a stand-in executor)
+"""
+from pathlib import Path
+import tempfile
+import threading
+import unittest
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import builder
+from distrobuilder_menu import locks
+
+SETTINGS = ('main_dir', 'target_dir')
+
+
+class FakeExecutor:
+    """ Executor recording what a build could see while it ran
+    """
+    queue_imports = False
+
+    def __init__(self, template_path):
+        self.template_lock = locks.template_lock(template_path)
+        self.seen = {}
+
+    def try_template_lock(self):
+        """ Takes the template lock for writing in another thread (like another dbmenu)
+        """
+        if locks.try_acquire(self.template_lock, writer=True):
+            locks.release(self.template_lock)
+            self.seen['lock_free'] = True
+
+    def run(self, build_cmd, image_alias, template_path, staging_dir):
+        """ Stands in for a failed distrobuilder run
+        """
+        # pylint: disable=unused-argument
+        self.seen['template'] = Path(template_path).read_text(encoding='utf-8')
+        self.seen['in_staging_dir'] = Path(template_path).parent == Path(staging_dir)
+
+        thread = threading.Thread(target=self.try_template_lock)
+        thread.start()
+        thread.join(30)
+
+        return {'returncode': 1}
+
+
+class TestRunImageBuild(unittest.TestCase):
+    """ run_image_build() tests
+    """
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+        self.saved = {name: getattr(builder.USER_CONFIG, name) for name in SETTINGS}
+        builder.USER_CONFIG.main_dir = str(self.tmp_dir / 'main')
+        builder.USER_CONFIG.target_dir = str(self.tmp_dir / 'out')
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(builder.USER_CONFIG, name, value)
+
+    def test_builds_from_template_copy(self):
+        """ The template lock is only held while copying & the copy is removed
+        """
+        template_path = self.tmp_dir / 'alpine.yaml'
+        template_path.write_text('image:\n  distribution: alpine\n', encoding='utf-8')
+        staging_dir = builder.create_staging_dir('alpine-3.20-default')
+
+        build = {'template_path': str(template_path), 'build_options': {},
+                 'main_options': {'image_alias': 'alpine-3.20-default'},
+                 'layered_build': None, 'cache_dir': None, 'work': None,
+                 'staging_dir': staging_dir, 'build_template': f"{staging_dir}/alpine.yaml",
+                 'build_cmd': 'true'}
+        executor = FakeExecutor(template_path)
+
+        builder.run_image_build(build, executor)
+        builder.release_staging_dir(staging_dir)
+
+        self.assertEqual(executor.seen, {'template': 'image:\n  distribution: alpine\n',
+                                         'in_staging_dir': True, 'lock_free': True})
+        # the empty staging directory was removed (with it's lock)
+        self.assertFalse(Path(staging_dir).exists())
+        self.assertNotIn(builder.store.get_staging_lock(staging_dir), locks.get_held())
+        self.assertFalse(locks.get_lock_file(builder.store.get_staging_lock(staging_dir)).exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+""" Tests build phase detection & the quiet phase ticks
+"""
+import contextlib
+import io
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import buildlog
+
+# an alpine build-incus run in distrobuilder's log format (with the apk & gpg output)
+BUILD_LOG = Path(__file__).parent / 'data' / 'distrobuilder-build-incus.log'
+
+
+class TestBuildLog(unittest.TestCase):
+    """ BuildLog tests
+    """
+    def setUp(self):
+        self.log_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+
+    def test_phases_of_build_log(self):
+        """ The phase heuristics follow distrobuilder's log lines (other output is ignored)
+        """
+        build_log = buildlog.BuildLog('alpine', self.log_dir)
+        phases = []
+
+        with open(BUILD_LOG, encoding='utf-8') as file:
+            for line in file:
+                if build_log.parse_line(line):
+                    phases.append(build_log.phase)
+
+        self.assertEqual(phases, ['downloading', 'unpacking', 'hooks', 'packages', 'hooks',
+                                  'packages', 'hooks', 'packing', 'compression'])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            record = build_log.finish(0)
+
+        self.assertEqual(set(record['phases']), {'starting', 'downloading', 'unpacking', 'hooks',
+                                                 'packages', 'packing', 'compression'})
+
+    def test_quiet_phases_tick(self):
+        """ The running phase is shown while distrobuilder is quiet
+        """
+        build_cmd = f"head -n 24 {BUILD_LOG}; sleep 0.5; tail -n +25 {BUILD_LOG}"
+
+        with mock.patch.object(buildlog, 'TICK_INTERVAL', 0.2), \
+             contextlib.redirect_stdout(io.StringIO()) as output:
+            record = buildlog.run_build(build_cmd, 'alpine', self.log_dir)
+
+        ticks = [line for line in output.getvalue().splitlines() if 'running for' in line]
+
+        self.assertEqual(record['returncode'], 0)
+        self.assertGreaterEqual(len(ticks), 1)
+        self.assertIn('phase: packing (running for 0s)', ticks[0])
+        # ticks are not written to the build log
+        self.assertEqual(Path(record['log']).read_text(encoding='utf-8'),
+                         BUILD_LOG.read_text(encoding='utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
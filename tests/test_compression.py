@@ -0,0 +1,90 @@
+""" Tests compression profile writing & build sample discovery
+"""
+import os
+from pathlib import Path
+import tempfile
+import unittest
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import compression
+from distrobuilder_menu import utils
+
+USER_CONFIG_TEXT = """# dbmenu settings
+main_dir: /srv/distrobuilder
+# profile : image type : compression
+compression_profiles:
+  fast-dev:
+    container: zstd-1
+
+  small-release:
+    container: xz-9
+# builds in RAM
+tmpfs_workspace: true
+console_editor: vim
+"""
+
+
+class TestCompression(unittest.TestCase):
+    """ Compression profile tests
+    """
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+        self.config_file = self.tmp_dir / 'dbmenu.yaml'
+        self.config_file.write_text(USER_CONFIG_TEXT, encoding='utf-8')
+
+        self.saved = {name: getattr(compression.USER_CONFIG, name)
+                      for name in ('dbmenu_config', 'layers_dir', 'target_dir')}
+        compression.USER_CONFIG.dbmenu_config = str(self.config_file)
+        compression.USER_CONFIG.layers_dir = str(self.tmp_dir / 'layers')
+        compression.USER_CONFIG.target_dir = str(self.tmp_dir / 'build')
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(compression.USER_CONFIG, name, value)
+
+    def test_write_profiles_keeps_other_keys(self):
+        """ Only the compression_profiles block is rewritten
+        """
+        compression.write_profiles('virtual-machine', {'fast-dev': 'zstd-3',
+                                                       'small-release': 'xz-6'})
+        text = self.config_file.read_text(encoding='utf-8')
+        config = utils.read_config(str(self.config_file))
+
+        self.assertEqual(config['compression_profiles'], {
+            'fast-dev': {'container': 'zstd-1', 'virtual-machine': 'zstd-3'},
+            'small-release': {'container': 'xz-9', 'virtual-machine': 'xz-6'}})
+        # comments & key order outside the block are unchanged
+        self.assertTrue(text.startswith('# dbmenu settings\nmain_dir: /srv/distrobuilder\n'
+                                        '# profile : image type : compression\n'))
+        self.assertTrue(text.endswith('# builds in RAM\ntmpfs_workspace: true\n'
+                                      'console_editor: vim\n'))
+
+    def test_write_profiles_appends_missing_key(self):
+        """ User Configs without profiles get the key appended
+        """
+        self.config_file.write_text('# dbmenu settings\nconsole_editor: vim', encoding='utf-8')
+        compression.write_profiles('container', {'fast-dev': 'zstd-1'})
+
+        self.assertEqual(self.config_file.read_text(encoding='utf-8'),
+                         '# dbmenu settings\nconsole_editor: vim\ncompression_profiles:\n'
+                         '  fast-dev:\n    container: zstd-1\n')
+
+    def test_find_sample_squashfs(self):
+        """ split container builds are sampled from their squashfs rootfs
+        """
+        build_dir = self.tmp_dir / 'build'
+        build_dir.mkdir()
+        (build_dir / 'meta.tar.xz').write_bytes(b'meta')
+        tarball = build_dir / 'rootfs.tar.xz'
+        tarball.write_bytes(b'rootfs')
+        os.utime(tarball, (1, 1))
+        squashfs = build_dir / 'rootfs.squashfs'
+        squashfs.write_bytes(b'squashfs')
+
+        self.assertEqual(compression.find_sample(), squashfs)
+        self.assertEqual(compression.get_image_type(squashfs), 'container')
+
+
+if __name__ == '__main__':
+    unittest.main()
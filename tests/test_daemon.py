@@ -0,0 +1,60 @@
+""" Tests the daemon keeps answering & building when a request or build fails
+"""
+import contextlib
+import io
+import unittest
+from unittest import mock
+# test environment (must be imported before distrobuilder_menu)
+import tests  # pylint: disable=unused-import
+# app modules
+from distrobuilder_menu import builder
+from distrobuilder_menu import daemon
+
+BUILD_OPTIONS = {'release': '3.19', 'variant': 'default', 'type_top_level': 'container'}
+
+
+class TestDaemon(unittest.TestCase):
+    """ Daemon error handling tests
+    """
+    def test_failed_builds_keep_workers(self):
+        """ Unexpected build errors fail the job without stopping it's worker
+        """
+        def build_image(build_options, template_path, **kwargs):
+            # pylint: disable=unused-argument
+            if template_path == 'oserror':
+                raise OSError(28, 'No space left on device')
+            if template_path == 'die':
+                raise SystemExit(1)
+
+        build_queue = daemon.BuildQueue()
+
+        with mock.patch.object(builder, 'build_image', build_image), \
+             contextlib.redirect_stdout(io.StringIO()):
+            for template in ('oserror', 'die', 'alpine', 'oserror', 'alpine'):
+                build_queue.submit(BUILD_OPTIONS, template)
+
+            build_queue.builds.join()
+
+        jobs = build_queue.get_jobs()
+
+        self.assertEqual([job['status'] for job in jobs],
+                         ['failed', 'failed', 'finished', 'failed', 'finished'])
+        self.assertEqual(jobs[0]['error'], "OSError(28, 'No space left on device')")
+        self.assertEqual(jobs[1]['error'], 'build failed (exit code: 1)')
+        self.assertNotIn('error', jobs[2])
+
+    def test_failed_requests_reply(self):
+        """ Unexpected request errors are returned as an error response
+        """
+        def cmd_jobs(args):
+            raise KeyError(args[0])
+
+        with mock.patch.object(daemon, 'check_config'), \
+             mock.patch.dict(daemon.COMMANDS, {'jobs': cmd_jobs}):
+            response = daemon.handle_request({'command': 'jobs', 'args': ['missing']})
+
+        self.assertEqual(response, {'status': 'error', 'error': "jobs failed: KeyError('missing')"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+""" Tests build placement & SSH builds (with a stand-in ssh & distrobuilder)
+"""
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import executors
+
+# runs the command on this host (ssh [options] HOST COMMAND)
+FAKE_SSH = """#!/bin/sh
+shift
+exec sh -c "$*"
+"""
+
+# the stand-in build copies the template & the file it refers to into the output
+FAKE_DISTROBUILDER = """#!/bin/sh
+echo "INFO   [x] Downloading source"
+cp "$2" "$3/template.yaml"
+cat "$(sed -n 's/^source: //p' "$2")" > "$3/source.out"
+echo "INFO   [x] Creating image"
+"""
+
+FAKE_SUDO = """#!/bin/sh
+exec "$@"
+"""
+
+SETTINGS = ('build_executors', 'build_placement', 'main_dir', 'files_dir', 'build_log_dir')
+
+
+class TestExecutors(unittest.TestCase):
+    """ Executor tests (each test has it's own main_dir so lock & state files are not shared)
+    """
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+        self.saved = {name: getattr(executors.USER_CONFIG, name) for name in SETTINGS}
+        executors.USER_CONFIG.main_dir = str(self.tmp_dir / 'main')
+        executors.USER_CONFIG.files_dir = str(self.tmp_dir / 'main' / 'files')
+        executors.USER_CONFIG.build_log_dir = str(self.tmp_dir / 'main' / 'logs')
+        executors.USER_CONFIG.build_placement = 'round-robin'
+
+        bin_dir = self.tmp_dir / 'bin'
+        bin_dir.mkdir()
+
+        for name, script in (('ssh', FAKE_SSH), ('distrobuilder', FAKE_DISTROBUILDER),
+                             ('sudo', FAKE_SUDO)):
+            (bin_dir / name).write_text(script, encoding='utf-8')
+            (bin_dir / name).chmod(0o755)
+
+        self.saved_path = os.environ['PATH']
+        os.environ['PATH'] = f"{bin_dir}:{self.saved_path}"
+        self.done = threading.Event()
+        self.threads = []
+
+    def tearDown(self):
+        self.done.set()
+
+        for thread in self.threads:
+            thread.join()
+
+        os.environ['PATH'] = self.saved_path
+
+        for name, value in self.saved.items():
+            setattr(executors.USER_CONFIG, name, value)
+
+    def set_executors(self, **slots):
+        """ Configures local executors name=slots
+        """
+        executors.USER_CONFIG.build_executors = {name: {'slots': count}
+                                                 for name, count in slots.items()}
+
+    def hold_slot(self, name=None):
+        """ Holds a build slot in another thread (like a running build) until tearDown()
+
+        Returns:
+            str: name of the executor holding the slot
+        """
+        held = {'ready': threading.Event()}
+
+        def build():
+            with executors.use_executor(name) as executor:
+                held['name'] = executor.name
+                held['ready'].set()
+                self.done.wait()
+
+        thread = threading.Thread(target=build)
+        self.threads.append(thread)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread.start()
+            held['ready'].wait()
+
+        return held['name']
+
+    def place(self, name=None):
+        """ Returns the executor a build is placed on (the slot is released)
+        """
+        with contextlib.redirect_stdout(io.StringIO()), \
+             executors.use_executor(name) as executor:
+            return executor.name
+
+    def test_round_robin(self):
+        """ Builds take turns & busy executors are skipped
+        """
+        self.set_executors(a=1, b=1, c=1)
+
+        self.assertEqual([self.place() for _ in range(4)], ['a', 'b', 'c', 'a'])
+        # executors chosen by name take their turn (a is next after c)
+        self.assertEqual(self.hold_slot('c'), 'c')
+        # the busy executor c is skipped
+        self.assertEqual([self.place() for _ in range(3)], ['a', 'b', 'a'])
+        self.assertEqual([self.place('a'), self.place()], ['a', 'b'])
+
+        state_file = Path(executors.USER_CONFIG.main_dir) / executors.STATE_FILE
+        self.assertEqual(json.loads(state_file.read_text(encoding='utf-8')), {'next': 2})
+
+    def test_least_loaded(self):
+        """ Builds go to the executor with the lowest share of busy slots
+        """
+        executors.USER_CONFIG.build_placement = 'least-loaded'
+        self.set_executors(a=2, b=1)
+
+        self.assertEqual(self.hold_slot(), 'a')
+        # a is half busy
+        self.assertEqual(self.hold_slot(), 'b')
+        # b is full
+        self.assertEqual(self.place(), 'a')
+
+    def test_choose_executor_holds_no_slot(self):
+        """ choose_executor() picks like use_executor() without holding a slot
+        """
+        self.set_executors(a=1, b=1)
+        self.hold_slot('a')
+
+        self.assertEqual(executors.choose_executor().name, 'b')
+        self.assertEqual(executors.get_busy_slots(executors.get_executors()['b']), 0)
+        # without a free slot the first executor in turn is chosen
+        self.hold_slot('b')
+        self.assertEqual(executors.choose_executor().name, 'a')
+
+    def test_unknown_executor_dies(self):
+        """ Executor names are checked
+        """
+        self.set_executors(a=1)
+
+        with self.assertRaises(SystemExit), contextlib.redirect_stdout(io.StringIO()):
+            executors.choose_executor('missing')
+
+    def test_waits_for_busy_slot(self):
+        """ Builds wait until a slot of the executor is released
+        """
+        self.set_executors(a=1)
+        self.hold_slot('a')
+        threading.Timer(0.3, self.done.set).start()
+        start_time = time.perf_counter()
+
+        with mock.patch.object(executors, 'SLOT_RETRY_DELAY', 0.05), \
+             contextlib.redirect_stdout(io.StringIO()) as output:
+            with executors.use_executor() as executor:
+                waited = time.perf_counter() - start_time
+
+        self.assertEqual(executor.name, 'a')
+        self.assertGreaterEqual(waited, 0.3)
+        self.assertIn('Waiting for a free build slot on: a', output.getvalue())
+
+    def test_ssh_build(self):
+        """ Inputs are synced to a per build directory on the node, the output
+            is fetched into the staging directory & the build directory removed
+        """
+        files_dir = Path(executors.USER_CONFIG.files_dir)
+        files_dir.mkdir(parents=True)
+        (files_dir / 'motd').write_text('hello from files_dir\n', encoding='utf-8')
+        template_path = self.tmp_dir / 'alpine.yaml'
+        template_path.write_text(f"source: {files_dir}/motd\n", encoding='utf-8')
+
+        node_dir = self.tmp_dir / 'node'
+        executor = executors.SSHExecutor('node1', {'host': 'builder@node1',
+                                                   'dir': str(node_dir), 'ssh': 'ssh'})
+        staging_dirs = [Path(tempfile.mkdtemp(dir=self.tmp_dir)) for _ in range(2)]
+
+        for staging_dir in staging_dirs:
+            build_dir = executor.get_build_dir(staging_dir)
+            template, target_dir = executor.get_paths(str(template_path), staging_dir)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                record = executor.run(f"sudo distrobuilder build-lxd {template} {target_dir}",
+                                      'alpine', str(template_path), str(staging_dir))
+
+            self.assertEqual(record['returncode'], 0)
+            self.assertEqual(record['executor'], 'node1')
+            # the template refers to the files synced into the build directory
+            self.assertEqual((staging_dir / 'template.yaml').read_text(encoding='utf-8'),
+                             f"source: {build_dir}/files/motd\n")
+            self.assertEqual((staging_dir / 'source.out').read_text(encoding='utf-8'),
+                             'hello from files_dir\n')
+
+        # builds share no directories on the node
+        self.assertEqual(list((node_dir / 'builds').iterdir()), [])
+        self.assertEqual([path.name for path in node_dir.iterdir()], ['builds'])
+
+
+if __name__ == '__main__':
+    unittest.main()
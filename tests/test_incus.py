@@ -0,0 +1,243 @@
+""" Tests the Incus / LXD REST client against a stand-in API server on a unix socket
+"""
+import email
+import email.policy
+import hashlib
+import http.server
+import json
+import os
+from pathlib import Path
+import socketserver
+import tempfile
+import threading
+import unittest
+from urllib.parse import unquote, urlsplit
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app classes
+from distrobuilder_menu.api.incus import Incus
+
+
+class StandInAPI(http.server.BaseHTTPRequestHandler):
+    """ Answers the subset of the Incus REST API used by dbmenu
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """ Keeps test output quiet (unix sockets have no client address)
+        """
+
+    def send_json(self, data, status=200):
+        """ Sends a JSON response
+        """
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, code, error):
+        """ Sends an API error response
+        """
+        self.send_json({'type': 'error', 'error': error, 'error_code': code}, status=code)
+
+    def send_operation(self, metadata):
+        """ Queues an async operation answered by the operation wait endpoint
+        """
+        operation = f"/1.0/operations/{len(self.server.operations)}"
+        self.server.operations[operation] = metadata
+        self.send_json({'type': 'async', 'operation': operation})
+
+    def read_body(self):
+        """ Reads a request body (the split upload must not be chunked)
+        """
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Server info / aliases / images / operation wait
+        """
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        path = urlsplit(self.path).path
+        aliases = self.server.aliases
+
+        if path == '/1.0':
+            self.send_json({'type': 'sync', 'metadata': {'environment': {'server': 'incus'}}})
+        elif path == '/1.0/images/aliases':
+            self.send_json({'type': 'sync', 'metadata': [
+                {'name': name, 'target': target} for name, target in aliases.items()]})
+        elif path.startswith('/1.0/images/aliases/'):
+            alias = unquote(path.removeprefix('/1.0/images/aliases/'))
+
+            if alias in aliases:
+                self.send_json({'type': 'sync', 'metadata': {'name': alias,
+                                                             'target': aliases[alias]}})
+            else:
+                self.send_error_json(404, 'Image alias not found')
+        elif path.startswith('/1.0/operations/') and path.endswith('/wait'):
+            metadata = self.server.operations[path.removesuffix('/wait')]
+            self.send_json({'type': 'sync', 'metadata': metadata})
+        else:
+            self.send_error_json(404, 'not found')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """ Image upload (unified or multipart) & alias creation
+        """
+        body = self.read_body()
+
+        if self.path == '/1.0/images/aliases':
+            data = json.loads(body)
+            self.server.aliases[data['name']] = data['target']
+            self.send_json({'type': 'sync', 'metadata': {}})
+            return
+
+        content_type = self.headers['Content-Type']
+
+        if content_type.startswith('multipart/form-data'):
+            message = email.message_from_bytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body,
+                policy=email.policy.HTTP
+            )
+            upload = {part.get_param('name', header='content-disposition'):
+                      (part.get_filename(), part.get_payload(decode=True))
+                      for part in message.iter_parts()}
+        else:
+            upload = {'image': (self.headers['X-Incus-filename'], body)}
+
+        self.server.uploads.append(upload)
+        fingerprint = hashlib.sha256(b''.join(item[1] for item in upload.values())).hexdigest()
+        self.send_operation({'status': 'Success', 'metadata': {'fingerprint': fingerprint}})
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        """ Image deletion (removes it's aliases)
+        """
+        self.read_body()
+        fingerprint = self.path.removeprefix('/1.0/images/')
+        self.server.aliases = {name: target for name, target in self.server.aliases.items()
+                               if target != fingerprint}
+        self.send_operation({'status': 'Success', 'metadata': {}})
+
+
+class StandInServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Threaded unix socket server keeping the stand-in API state
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, StandInAPI)
+        self.aliases = {}
+        self.operations = {}
+        self.requests = []
+        self.uploads = []
+
+
+class TestIncus(unittest.TestCase):
+    """ Incus client tests
+    """
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+        self.server = StandInServer(str(self.tmp_dir / 'unix.socket'))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        # the socket is found through INCUS_SOCKET (lxd_socket is not set)
+        os.environ['INCUS_SOCKET'] = self.server.server_address
+        self.incus = Incus()
+
+    def tearDown(self):
+        del os.environ['INCUS_SOCKET']
+        self.incus.http.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def write_file(self, name, data):
+        """ Writes a test artifact
+        """
+        file_path = self.tmp_dir / name
+        file_path.write_bytes(data)
+        return str(file_path)
+
+    def test_check_socket(self):
+        """ The server name selects the header prefix
+        """
+        self.assertTrue(self.incus.check_socket())
+        self.assertEqual(self.incus.server, 'incus')
+        self.assertEqual(self.incus.header_prefix, 'X-Incus')
+
+    def test_alias_lookup(self):
+        """ Missing aliases return None & existing aliases their fingerprint
+        """
+        self.server.aliases['alpine-3.19/default'] = 'abc123'
+
+        self.assertIsNone(self.incus.get_alias('missing'))
+        self.assertEqual(self.incus.get_alias('alpine-3.19/default'), 'abc123')
+        self.assertEqual(self.incus.get_aliases(), {'alpine-3.19/default': 'abc123'})
+        # aliases are quoted in the API path
+        self.assertIn(('GET', '/1.0/images/aliases/alpine-3.19%2Fdefault'),
+                      [request[:2] for request in self.server.requests])
+
+    def test_delete_waits_for_operation(self):
+        """ Deleting an image waits for the async operation
+        """
+        self.server.aliases['alpine'] = 'abc123'
+        self.incus.delete_image('abc123')
+
+        self.assertEqual(self.server.aliases, {})
+        self.assertEqual([request[1] for request in self.server.requests][-1],
+                         '/1.0/operations/0/wait?timeout=-1')
+
+    def test_failed_operation_dies(self):
+        """ A failed operation exits with the API error
+        """
+        self.server.operations['/1.0/operations/99'] = {'status': 'Failure', 'err': 'boom'}
+
+        with self.assertRaises(SystemExit):
+            self.incus.wait_operation({'operation': '/1.0/operations/99'})
+
+    def test_import_unified(self):
+        """ Unified tarballs are streamed as the request body
+        """
+        self.incus.check_socket()
+        image_path = self.write_file('alpine.tar.xz', b'unified' * 1000)
+
+        fingerprint = self.incus.import_image('alpine', image_path=image_path)
+
+        self.assertEqual(self.server.uploads, [{'image': ('alpine.tar.xz', b'unified' * 1000)}])
+        self.assertEqual(fingerprint, hashlib.sha256(b'unified' * 1000).hexdigest())
+        self.assertEqual(self.server.aliases, {'alpine': fingerprint})
+
+    def test_import_split(self):
+        """ Split images are streamed as multipart/form-data with a Content-Length
+        """
+        self.incus.check_socket()
+        meta_path = self.write_file('incus.tar.xz', b'meta')
+        rootfs_path = self.write_file('rootfs.squashfs', b'rootfs' * 300000)
+
+        fingerprint = self.incus.import_image(None, meta_path=meta_path,
+                                              rootfs_path=rootfs_path
+                                             )
+        upload = self.server.uploads[0]
+        headers = [request[2] for request in self.server.requests if request[0] == 'POST'][0]
+
+        self.assertEqual(upload['metadata'], ('incus.tar.xz', b'meta'))
+        self.assertEqual(upload['rootfs'], ('rootfs.squashfs', b'rootfs' * 300000))
+        self.assertNotIn('Transfer-Encoding', headers)
+        self.assertEqual(fingerprint, hashlib.sha256(b'meta' + b'rootfs' * 300000).hexdigest())
+        # no alias was requested
+        self.assertEqual(self.server.aliases, {})
+
+    def test_import_split_vm(self):
+        """ vm disks are uploaded as the rootfs.img part
+        """
+        self.incus.check_socket()
+        meta_path = self.write_file('incus.tar.xz', b'meta')
+        rootfs_path = self.write_file('disk.qcow2', b'qcow2')
+
+        self.incus.import_image('alpine-vm', meta_path=meta_path, rootfs_path=rootfs_path)
+
+        self.assertEqual(self.server.uploads[0]['rootfs.img'], ('disk.qcow2', b'qcow2'))
+        self.assertIn('alpine-vm', self.server.aliases)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+""" Tests layered build work directories & base layer locking
+"""
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import layers
+
+FAKE_SUDO = """#!/bin/sh
+exec "$@"
+"""
+
+TEMPLATE = """image:
+  distribution: alpine
+packages:
+  manager: apk
+  sets:
+  - packages:
+    - busybox
+    action: install
+"""
+
+BUILD_OPTIONS = {'release': '3.19', 'variant': 'default', 'arch': 'amd64',
+                 'type_top_level': 'container'}
+
+SETTINGS = ('layers_dir', 'subdir_custom', 'main_dir')
+
+
+class TestLayers(unittest.TestCase):
+    """ Layered build tests (copies use cp -a as the test directory is not on btrfs)
+    """
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+        self.saved = {name: getattr(layers.USER_CONFIG, name) for name in SETTINGS}
+        layers.USER_CONFIG.main_dir = str(self.tmp_dir / 'main')
+        layers.USER_CONFIG.layers_dir = str(self.tmp_dir / 'layers')
+        layers.USER_CONFIG.subdir_custom = str(self.tmp_dir / 'custom')
+
+        bin_dir = self.tmp_dir / 'bin'
+        bin_dir.mkdir()
+        (bin_dir / 'sudo').write_text(FAKE_SUDO, encoding='utf-8')
+        (bin_dir / 'sudo').chmod(0o755)
+        self.saved_path = os.environ['PATH']
+        os.environ['PATH'] = f"{bin_dir}:{self.saved_path}"
+
+        self.standard = self.tmp_dir / 'alpine.yaml'
+        self.standard.write_text(TEMPLATE, encoding='utf-8')
+        self.custom = Path(layers.USER_CONFIG.subdir_custom) / 'alpine-web.yaml'
+        self.custom.parent.mkdir()
+        footer = json.dumps({'type': 'base', 'source': str(self.standard)})
+        self.custom.write_text(f"{TEMPLATE}\n#dbmenu {footer}\n", encoding='utf-8')
+
+    def tearDown(self):
+        os.environ['PATH'] = self.saved_path
+
+        for name, value in self.saved.items():
+            setattr(layers.USER_CONFIG, name, value)
+
+    def prepare(self):
+        """ Prepares a layered build of the custom template
+        """
+        with contextlib.redirect_stdout(io.StringIO()):
+            return layers.prepare_layered_build(dict(BUILD_OPTIONS), str(self.custom))
+
+    def test_builds_have_own_work_dirs(self):
+        """ Builds of the same template / release / variant never share a work directory
+        """
+        first = self.prepare()
+        second = self.prepare()
+
+        self.assertNotEqual(first['work_dir'], second['work_dir'])
+        self.assertTrue(Path(first['work_dir']).name.startswith('alpine-web-3.19-default-'))
+        self.assertEqual(first['workspace'], f"{first['work_dir']}/rootfs")
+
+        # cancelled builds only leave the work root
+        for layered_build in (first, second):
+            layers.cleanup_layered_build(layered_build)
+
+        self.assertEqual(list((Path(layers.USER_CONFIG.layers_dir) / 'work').iterdir()), [])
+
+    def test_layer_is_built_once(self):
+        """ Concurrent builds wait for one build of a missing base layer & snapshot it
+        """
+        built = []
+
+        def build_layer(build_options, standard_template, layer_dir, cache_dir=None):
+            # pylint: disable=unused-argument
+            built.append(layer_dir.name)
+            time.sleep(0.3)
+            layer_dir.mkdir(parents=True)
+            (layer_dir / 'os-release').write_text('alpine\n', encoding='utf-8')
+            Path(f"{layer_dir}.json").write_text(json.dumps(
+                {'source': standard_template,
+                 'checksum': layers.get_checksum(standard_template)}), encoding='utf-8')
+
+        layered_builds = [self.prepare() for _ in range(3)]
+        threads = [threading.Thread(target=layers.create_layered_build,
+                                    args=(layered_build, dict(BUILD_OPTIONS)))
+                   for layered_build in layered_builds]
+
+        with mock.patch.object(layers, 'build_layer', build_layer), \
+             contextlib.redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(built, ['alpine-3.19-default'])
+
+        for layered_build in layered_builds:
+            workspace = Path(layered_build['workspace'])
+            self.assertEqual((workspace / 'os-release').read_text(encoding='utf-8'), 'alpine\n')
+            self.assertTrue(Path(layered_build['template']).is_file())
+            layers.cleanup_layered_build(layered_build)
+            self.assertFalse(Path(layered_build['work_dir']).exists())
+
+    def test_snapshot_needs_same_filesystem(self):
+        """ Layers are only snapshotted on their own btrfs filesystem (|| copied)
+        """
+        layer_dir = Path(layers.USER_CONFIG.layers_dir) / 'alpine-3.19-default'
+        layer_dir.mkdir(parents=True)
+        (layer_dir / 'os-release').write_text('alpine\n', encoding='utf-8')
+        disk_workspace = self.tmp_dir / 'layers' / 'work' / 'disk' / 'rootfs'
+        disk_workspace.parent.mkdir(parents=True)
+
+        with mock.patch.object(layers, 'check_btrfs', return_value=True):
+            self.assertTrue(layers.check_snapshot(layer_dir, disk_workspace))
+
+            # e.g a tmpfs workspace
+            with tempfile.TemporaryDirectory(dir='/dev/shm') as tmpfs_dir:
+                tmpfs_workspace = Path(tmpfs_dir) / 'layer' / 'rootfs'
+
+                if Path(tmpfs_dir).stat().st_dev == layer_dir.parent.stat().st_dev:
+                    self.skipTest('/dev/shm is on the test filesystem')
+
+                layers.snapshot_layer(layer_dir, tmpfs_workspace)
+                self.assertEqual((tmpfs_workspace / 'os-release').read_text(encoding='utf-8'),
+                                 'alpine\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
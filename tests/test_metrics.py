@@ -0,0 +1,46 @@
+""" Tests the metrics textfile
+"""
+import os
+from pathlib import Path
+import tempfile
+import unittest
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """ Metrics textfile tests
+    """
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+        self.metrics = metrics.Metrics()
+        self.metrics.metrics_file = str(self.tmp_dir / 'dbmenu.prom')
+        self.saved_lxd_json = self.metrics.user_config.lxd_json
+
+    def tearDown(self):
+        self.metrics.user_config.lxd_json = self.saved_lxd_json
+
+    def test_cache_update_timestamps(self):
+        """ Cache files are exported as their update time (the age is time() - timestamp)
+        """
+        cache_file = self.tmp_dir / 'lxd.json'
+        cache_file.write_text('[]', encoding='utf-8')
+        os.utime(cache_file, (1700000000, 1700000000))
+        self.metrics.user_config.lxd_json = str(cache_file)
+
+        # samples of metrics dbmenu no longer writes are dropped
+        Path(self.metrics.metrics_file).write_text(
+            'dbmenu_cache_age_seconds{cache="images"} 12\n'
+            'dbmenu_builds_total{status="success"} 2\n', encoding='utf-8')
+        self.metrics.write()
+        text = Path(self.metrics.metrics_file).read_text(encoding='utf-8')
+
+        self.assertIn('dbmenu_cache_updated_timestamp_seconds{cache="images"} 1700000000\n', text)
+        self.assertIn('dbmenu_builds_total{status="success"} 2\n', text)
+        self.assertNotIn('dbmenu_cache_age_seconds', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+""" Tests the progress reporter
+"""
+import io
+import sys
+import unittest
+# test environment (must be imported before distrobuilder_menu)
+import tests  # pylint: disable=unused-import
+# app modules
+from distrobuilder_menu.api.progress import Progress
+
+
+class FakeTerminal(io.StringIO):
+    """ StringIO reporting itself as a TTY
+    """
+    def isatty(self):
+        return True
+
+
+class TestProgress(unittest.TestCase):
+    """ TTY progress line tests
+    """
+    def setUp(self):
+        self.saved_stdout = sys.stdout
+        sys.stdout = FakeTerminal()
+        self.terminal = sys.stdout
+
+    def tearDown(self):
+        sys.stdout = self.saved_stdout
+
+    def test_interrupted_line_ends(self):
+        """ An interrupted transfer finishes it's progress line with a newline
+        """
+        with self.assertRaises(KeyboardInterrupt):
+            with Progress('Downloading', total=100, interval=0.000001) as progress:
+                progress.update(40)
+                raise KeyboardInterrupt
+
+        lines = self.terminal.getvalue().split('\r')
+        self.assertTrue(lines[-1].startswith('Downloading: 40 B / 100 B (40%)'))
+        self.assertTrue(lines[-1].rstrip(' \n').endswith('(interrupted)'))
+        self.assertTrue(lines[-1].endswith('\n'))
+
+    def test_end_line(self):
+        """ Messages printed after end_line() start on a new line
+        """
+        with Progress('Downloading', total=100, interval=0.000001) as progress:
+            progress.update(10)
+            progress.end_line()
+            print('HTTP error: 404')
+            progress.end_line()
+
+        output = self.terminal.getvalue()
+        self.assertIn('ETA', output)
+        self.assertIn('\nHTTP error: 404\n', output)
+        self.assertEqual(output.count('\n'), 3)
+        self.assertNotIn('interrupted', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
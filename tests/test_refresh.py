@@ -0,0 +1,69 @@
+""" Tests the background refreshes
+"""
+import io
+import sys
+import unittest
+# test environment (must be imported before distrobuilder_menu)
+import tests  # pylint: disable=unused-import
+# app modules
+from distrobuilder_menu import refresh, utils
+
+
+class TestRefresher(unittest.TestCase):
+    """ Background refresh tests
+    """
+    def setUp(self):
+        self.saved_streams = (sys.stdout, sys.stderr)
+        sys.stdout = io.StringIO()
+        sys.stderr = io.StringIO()
+        self.terminal = (sys.stdout, sys.stderr)
+        refresh.take_notices()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.saved_streams
+
+    def run_refresh(self, refreshers):
+        """ Runs a background refresh to the end & returns the notices
+        """
+        refresher = refresh.Refresher()
+        self.assertTrue(refresher.start(list(refreshers), refreshers))
+        refresher.thread.join(30)
+
+        self.assertFalse(refresher.thread.is_alive())
+        self.assertEqual(refresher.output.buffers, {})
+        self.assertEqual(refresher.errors.buffers, {})
+        return refresh.take_notices()
+
+    def test_errors_become_notices(self):
+        """ An unexpected error is one notice & the next resource is still refreshed
+        """
+        def broken():
+            print('fetching images')
+            raise ValueError('bad json')
+
+        notices = self.run_refresh({'images': broken, 'templates': lambda: None})
+
+        self.assertEqual(len(notices), 2)
+        self.assertEqual(notices[0],
+                         "WARN: background refresh of images failed => ValueError('bad json')")
+        self.assertTrue(notices[1].startswith('INFO: templates refreshed'))
+        self.assertEqual(self.terminal[0].getvalue(), '')
+
+    def test_output_is_captured(self):
+        """ stderr & command output of the refresh thread stay out of the terminal
+        """
+        def noisy():
+            print('warning', file=sys.stderr)
+            utils.run_command('echo out; echo err >&2')
+            utils.die(1, 'ERROR: sync failed')
+
+        notices = self.run_refresh({'templates': noisy})
+
+        self.assertEqual(notices,
+                         ['WARN: background refresh of templates failed => ERROR: sync failed'])
+        self.assertEqual(self.terminal[0].getvalue(), '')
+        self.assertEqual(self.terminal[1].getvalue(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
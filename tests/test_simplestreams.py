@@ -0,0 +1,187 @@
+""" Tests the simplestreams reader against a stand-in http.server remote
+"""
+import http.server
+import json
+from pathlib import Path
+import tempfile
+import threading
+import unittest
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app classes
+from distrobuilder_menu.api.simplestreams import Simplestreams
+
+INDEX = {
+    'format': 'index:1.0',
+    'index': {
+        'images': {'datatype': 'image-downloads', 'path': 'streams/v1/images.json'},
+    },
+}
+
+PRODUCTS = {
+    'format': 'products:1.0',
+    'products': {
+        'alpine:3.19:amd64:default': {
+            'aliases': 'alpine/3.19/default,alpine/3.19',
+            'arch': 'amd64',
+            'os': 'Alpine',
+            'release': '3.19',
+            'variant': 'default',
+            'versions': {
+                '20240101_13:00': {'items': {
+                    'root.squashfs': {'ftype': 'squashfs'},
+                }},
+                '20240102_13:00': {'items': {
+                    'lxd.tar.xz': {'ftype': 'lxd.tar.xz'},
+                    'root.squashfs': {'ftype': 'squashfs'},
+                    'disk.qcow2': {'ftype': 'disk-kvm.img'},
+                }},
+            },
+        },
+        'ubuntu:noble:arm64': {
+            'arch': 'arm64',
+            'os': 'Ubuntu',
+            'release': 'noble',
+            'versions': {
+                '20240101': {'items': {'root.squashfs': {'ftype': 'squashfs'}}},
+            },
+        },
+        'debian:sid:amd64:default': {
+            'arch': 'amd64',
+            'os': 'Debian',
+            'release': 'sid',
+            'versions': {},
+        },
+    },
+}
+
+FILES = {
+    '/streams/v1/index.json': json.dumps(INDEX).encode(),
+    '/streams/v1/images.json': json.dumps(PRODUCTS).encode(),
+}
+
+
+class StandInRemote(http.server.BaseHTTPRequestHandler):
+    """ Serves the simplestreams files with an ETag & answers conditional requests
+    """
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """ Keeps test output quiet
+        """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ 200 with the file || 304 when the ETag matches
+        """
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+
+        etag = f"\"{self.server.version}\""
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = FILES[self.path]
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestSimplestreams(unittest.TestCase):
+    """ Simplestreams reader tests
+    """
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInRemote)
+        self.server.requests = []
+        self.server.version = 1
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.simplestreams = Simplestreams()
+        self.simplestreams.remotes = {'images': f"http://127.0.0.1:{self.server.server_port}/"}
+        self.simplestreams.cache_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_products(self):
+        """ The products file is found through the index
+        """
+        products = self.simplestreams.get_products('images')
+
+        self.assertEqual(set(products), set(PRODUCTS['products']))
+        self.assertEqual([request[0] for request in self.server.requests],
+                         ['/streams/v1/index.json', '/streams/v1/images.json'])
+
+    def test_conditional_requests(self):
+        """ Unchanged files are answered with 304 & read from the cache
+        """
+        first = self.simplestreams.get_images('images')
+        self.server.requests.clear()
+        second = self.simplestreams.get_images('images')
+
+        self.assertEqual(first, second)
+        # the cached ETag is sent with every request
+        self.assertEqual([request[1] for request in self.server.requests], ['"1"', '"1"'])
+
+        # a changed file is downloaded again
+        self.server.version = 2
+        self.server.requests.clear()
+        self.simplestreams.get_images('images')
+        meta_file = self.simplestreams.cache_dir / 'images' / 'index.json.meta'
+
+        self.assertEqual(json.loads(meta_file.read_text(encoding='utf-8'))['etag'], '"2"')
+
+    def test_missing_file_dies(self):
+        """ HTTP errors exit with the failing URL
+        """
+        self.simplestreams.remotes['images'] += 'missing'
+
+        with self.assertRaises(SystemExit):
+            self.simplestreams.get_products('images')
+
+    def test_lxc_json_mapping(self):
+        """ Products are converted to 'lxc image ls -f json' images
+        """
+        images = self.simplestreams.get_images('images')
+        alpine = [image for image in images if image['properties']['os'] == 'Alpine']
+        ubuntu = [image for image in images if image['properties']['os'] == 'Ubuntu']
+
+        # only the newest version & known item types are listed
+        self.assertEqual(sorted(image['type'] for image in alpine),
+                         ['container', 'virtual-machine'])
+        self.assertEqual(alpine[0]['architecture'], 'x86_64')
+        self.assertEqual(alpine[0]['aliases'],
+                         [{'name': 'alpine/3.19/default'}, {'name': 'alpine/3.19'}])
+        self.assertEqual(alpine[0]['remote'], 'images')
+
+        # unaliased products have null aliases & the default variant
+        self.assertEqual(ubuntu[0]['architecture'], 'aarch64')
+        self.assertIsNone(ubuntu[0]['aliases'])
+        self.assertEqual(ubuntu[0]['properties'], {'os': 'Ubuntu', 'release': 'noble',
+                                                   'variant': 'default',
+                                                   'architecture': 'arm64',
+                                                   'type': 'squashfs'})
+        # products without versions are skipped
+        self.assertEqual(len(images), 3)
+
+    def test_update_lxd_json(self):
+        """ The merged listing of all remotes is written as JSON
+        """
+        self.simplestreams.remotes['mirror'] = self.simplestreams.remotes['images']
+        outfile = self.simplestreams.cache_dir / 'lxd.json'
+
+        self.simplestreams.update_lxd_json(outfile)
+        images = json.loads(outfile.read_text(encoding='utf-8'))
+
+        self.assertEqual([image['remote'] for image in images],
+                         ['images'] * 3 + ['mirror'] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+""" Tests the artifact store garbage collection
+"""
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import builder
+from distrobuilder_menu import locks
+from distrobuilder_menu import store
+
+FAKE_SUDO = """#!/bin/sh
+exec "$@"
+"""
+
+SETTINGS = ('main_dir', 'target_dir')
+
+
+class TestStagingDirs(unittest.TestCase):
+    """ Stale staging directory tests
+    """
+    def setUp(self):
+        self.tmp_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+        self.saved = {name: getattr(store.USER_CONFIG, name) for name in SETTINGS}
+        store.USER_CONFIG.main_dir = str(self.tmp_dir / 'main')
+        store.USER_CONFIG.target_dir = str(self.tmp_dir / 'out')
+
+        # gc removes staging directories with sudo
+        sudo = self.tmp_dir / 'bin' / 'sudo'
+        sudo.parent.mkdir()
+        sudo.write_text(FAKE_SUDO, encoding='utf-8')
+        sudo.chmod(0o755)
+
+        patcher = mock.patch.dict(os.environ, {'PATH': f"{sudo.parent}:{os.environ['PATH']}"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(store.USER_CONFIG, name, value)
+
+    def test_running_builds_are_skipped(self):
+        """ gc only removes stale staging directories no build holds
+        """
+        created = {}
+        done = threading.Event()
+
+        def run_build():
+            created['running'] = builder.create_staging_dir('running')
+            created['started'] = True
+            done.wait(30)
+            builder.release_staging_dir(created['running'])
+
+        thread = threading.Thread(target=run_build)
+        thread.start()
+
+        while 'started' not in created:
+            time.sleep(0.01)
+
+        # a failed build releases the lock but keeps it's staging directory
+        failed = builder.create_staging_dir('failed')
+        (Path(failed) / 'rootfs.squashfs').write_text('', encoding='utf-8')
+        builder.release_staging_dir(failed)
+        fresh = builder.create_staging_dir('fresh')
+        builder.release_staging_dir(fresh)
+
+        for staging_dir in (created['running'], failed):
+            os.utime(staging_dir, (0, 0))
+
+        try:
+            self.assertEqual(store.remove_staging_dirs(), 1)
+        finally:
+            done.set()
+            thread.join(30)
+
+        self.assertTrue(Path(created['running']).is_dir())
+        self.assertFalse(Path(failed).exists())
+        self.assertTrue(Path(fresh).is_dir())
+        self.assertFalse(locks.get_lock_file(store.get_staging_lock(failed)).exists())
+        self.assertEqual(locks.get_held(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
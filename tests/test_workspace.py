@@ -0,0 +1,119 @@
+""" Tests tmpfs workspace placement & reservations
+"""
+from pathlib import Path
+import tempfile
+import threading
+import unittest
+from unittest import mock
+# test environment (must be imported before distrobuilder_menu)
+from tests import TEST_HOME
+# app modules
+from distrobuilder_menu import buildcache
+from distrobuilder_menu import workspace
+
+MIB = 1048576
+
+
+class TestWorkspace(unittest.TestCase):
+    """ Workspace placement tests (10 MiB free / 1 MiB images / 8 x multiple)
+    """
+    def setUp(self):
+        self.tmpfs_dir = Path(tempfile.mkdtemp(dir=TEST_HOME))
+        self.saved = {name: getattr(workspace.USER_CONFIG, name)
+                      for name in ('tmpfs_dir', 'tmpfs_workspace', 'tmpfs_size_multiple')}
+        workspace.USER_CONFIG.tmpfs_dir = str(self.tmpfs_dir)
+        workspace.USER_CONFIG.tmpfs_workspace = True
+        workspace.USER_CONFIG.tmpfs_size_multiple = 8
+
+        for name, value in (('is_tmpfs', True), ('get_free_memory', 10 * MIB),
+                            ('get_expected_size', MIB)):
+            patcher = mock.patch.object(workspace, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(workspace.USER_CONFIG, name, value)
+
+    def plan_in_thread(self, staging_dir, done):
+        """ Plans a workspace in another thread (which holds it until done is set)
+        """
+        planned = {}
+
+        def build():
+            planned['work'] = workspace.plan_workspace('alpine', staging_dir)
+            planned['ready'].set()
+            done.wait()
+            workspace.release_workspace(planned['work'])
+
+        planned['ready'] = threading.Event()
+        thread = threading.Thread(target=build)
+        thread.start()
+        planned['ready'].wait()
+
+        return thread, planned['work']
+
+    def test_active_workspaces_are_reserved(self):
+        """ Concurrent builds count the expected size of other tmpfs workspaces
+        """
+        done = threading.Event()
+        first_thread, first = self.plan_in_thread('first', done)
+        second_thread, second = self.plan_in_thread('second', done)
+
+        self.assertEqual(first['placement'], 'tmpfs')
+        self.assertEqual(second['placement'], 'tmpfs')
+        self.assertEqual(second['free_bytes'], 9 * MIB)
+        self.assertEqual(sorted(path.name for path in self.tmpfs_dir.iterdir()),
+                         ['dbmenu-first.reserved', 'dbmenu-second.reserved'])
+
+        # 10 MiB - 2 x 1 MiB reserved is not more than 8 x 1 MiB
+        third = workspace.plan_workspace('alpine', 'third')
+        workspace.release_workspace(third)
+        self.assertEqual(third['placement'], 'disk')
+        self.assertEqual(third['free_bytes'], 8 * MIB)
+
+        done.set()
+        first_thread.join()
+        second_thread.join()
+
+        self.assertEqual(list(self.tmpfs_dir.iterdir()), [])
+        fourth = workspace.plan_workspace('alpine', 'fourth')
+        workspace.release_workspace(fourth)
+        self.assertEqual(fourth['free_bytes'], 10 * MIB)
+
+    def test_stale_reservations_are_removed(self):
+        """ Reservations of ended builds (their lock is free) are not counted
+        """
+        stale = self.tmpfs_dir / 'dbmenu-stale.reserved'
+        stale.write_text(str(5 * MIB), encoding='utf-8')
+
+        self.assertEqual(workspace.get_reserved_bytes(), 0)
+        self.assertFalse(stale.exists())
+
+    def test_workspace_is_removed(self):
+        """ The workspace & it's reservation are removed after the build
+        """
+        work = workspace.plan_workspace('alpine', 'build')
+
+        with mock.patch.object(workspace.utils, 'check_command') as check_command:
+            with workspace.use_workspace(work):
+                self.assertTrue(Path(work['path']).is_dir())
+                Path(work['path']).rmdir()
+
+        check_command.assert_called_once_with(f"sudo rm -rf {work['path']}", exit_on_error=True)
+        self.assertEqual(list(self.tmpfs_dir.iterdir()), [])
+
+    def test_layered_workspace_is_separate(self):
+        """ Layered builds never snapshot into the cache work directories (see buildcache.py)
+        """
+        layered_build = {'workspace': 'work/alpine/rootfs'}
+        work = workspace.plan_workspace('alpine', 'layered', layered_build)
+        workspace.release_workspace(work)
+
+        self.assertEqual(layered_build['workspace'], f"{work['path']}/layer/rootfs")
+        self.assertNotIn(Path(layered_build['workspace']).parent.name,
+                         buildcache.WORK_DIRS)
+
+
+if __name__ == '__main__':
+    unittest.main()